@@ -0,0 +1,222 @@
+"""Headless batch runner: send prompts from a JSONL file to OpenRouter.
+
+Each input line is a JSON object with a ``question`` and optional ``id``,
+``context``, ``system_prompt``, ``model``, ``temperature`` and ``max_tokens``.
+Results are written as JSONL in completion order. Completed ids are appended to
+a checkpoint file so an interrupted run can be resumed without re-sending them.
+
+    python batch_runner.py prompts.jsonl -o results.jsonl --checkpoint run.ckpt
+    cat prompts.jsonl | python batch_runner.py - --concurrency 8
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openrouter_api import (
+    build_messages,
+    call_openrouter_api,
+    error_from_event,
+    DEFAULT_MODEL,
+    DEFAULT_SYSTEM_PROMPT,
+    OPENROUTER_BASE_URL,
+)
+from sse_parser import SSEParser, iter_chat_chunks
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_REQUESTS_PER_MINUTE = 60
+
+
+class IntervalLimiter:
+    """Space request starts evenly to stay under a per-key requests-per-minute limit"""
+
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def iter_prompts(stream):
+    """Yield ``(prompt_id, record)`` from a JSONL stream, numbering lines without an id"""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"Skipping line {line_number}: {e}", file=sys.stderr)
+            continue
+        if not isinstance(record, dict) or not record.get('question'):
+            print(f"Skipping line {line_number}: no question", file=sys.stderr)
+            continue
+        yield str(record.get('id', line_number)), record
+
+
+def load_checkpoint(path: str) -> set:
+    """Ids already completed by an earlier run"""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def run_prompt(prompt_id: str, record: dict, defaults: dict) -> dict:
+    """Send one prompt through the same message building and API call as the app"""
+    model = record.get('model', defaults['model'])
+    messages = build_messages(
+        record.get('system_prompt', defaults['system_prompt']),
+        record.get('context', ''),
+        record['question']
+    )
+    result = {'id': prompt_id, 'model': model, 'text': '', 'usage': None,
+              'latency': None, 'finish_reason': None, 'error': None}
+    started = time.monotonic()
+    try:
+        response = call_openrouter_api(
+            messages=messages,
+            model=model,
+            temperature=record.get('temperature', defaults['temperature']),
+            max_tokens=record.get('max_tokens', defaults['max_tokens']),
+            api_key=defaults['api_key'],
+            base_url=defaults.get('base_url')
+        )
+        parts = []
+        try:
+            for chunk in iter_chat_chunks(response, SSEParser()):
+                if chunk['error']:
+                    raise error_from_event(chunk['error'], mid_stream=bool(parts))
+                if chunk['content']:
+                    parts.append(chunk['content'])
+                if chunk['finish_reason']:
+                    result['finish_reason'] = chunk['finish_reason']
+                if chunk['usage']:
+                    result['usage'] = chunk['usage']
+        finally:
+            response.close()
+        result['text'] = "".join(parts)
+    except Exception as e:
+        result['error'] = str(e)
+    result['latency'] = round(time.monotonic() - started, 3)
+    return result
+
+
+def run_batch(prompts, output, defaults: dict, concurrency: int = DEFAULT_CONCURRENCY,
+              requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE, checkpoint_path: str = None) -> dict:
+    """Run prompts with bounded concurrency, streaming results out as they finish"""
+    completed = load_checkpoint(checkpoint_path)
+    limiter = IntervalLimiter(requests_per_minute)
+    output_lock = threading.Lock()
+    slots = threading.BoundedSemaphore(concurrency)
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8") if checkpoint_path else None
+    stats = {'submitted': 0, 'skipped': 0, 'succeeded': 0, 'failed': 0}
+
+    def _work(prompt_id, record):
+        try:
+            limiter.wait()
+            result = run_prompt(prompt_id, record, defaults)
+            with output_lock:
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                if result['error']:
+                    stats['failed'] += 1
+                    return
+                stats['succeeded'] += 1
+                if checkpoint is not None:
+                    checkpoint.write(prompt_id + "\n")
+                    checkpoint.flush()
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+            for prompt_id, record in prompts:
+                if prompt_id in completed:
+                    stats['skipped'] += 1
+                    continue
+                # Bound in-flight work so huge input files are read lazily
+                slots.acquire()
+                stats['submitted'] += 1
+                executor.submit(_work, prompt_id, record)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    return stats
+
+
+def _positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be a whole number, got {value!r}") from None
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def _rate(value: str) -> float:
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be a number, got {value!r}") from None
+    if number < 0 or not math.isfinite(number):
+        raise argparse.ArgumentTypeError(f"must be a positive number, or 0 for unlimited, got {value}")
+    return number
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL prompt file, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSONL results file (default: stdout)")
+    parser.add_argument("--checkpoint", help="File of completed ids used to resume a run")
+    parser.add_argument("--api-key", default=os.environ.get("OPENROUTER_API_KEY", ""),
+                        help="OpenRouter API key (default: $OPENROUTER_API_KEY)")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--system-prompt", default=DEFAULT_SYSTEM_PROMPT)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    parser.add_argument("--concurrency", type=_positive_int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rpm", type=_rate, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="Requests per minute for the API key (0 = unlimited)")
+    parser.add_argument("--base-url", default=OPENROUTER_BASE_URL,
+                        help="API base URL, e.g. a local mock_openrouter.py")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("an API key is required (--api-key or $OPENROUTER_API_KEY)")
+    defaults = {
+        'api_key': args.api_key,
+        'model': args.model,
+        'system_prompt': args.system_prompt,
+        'temperature': args.temperature,
+        'max_tokens': args.max_tokens,
+        'base_url': args.base_url
+    }
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    output = sys.stdout if args.output == "-" else open(args.output, "a", encoding="utf-8")
+    try:
+        stats = run_batch(iter_prompts(source), output, defaults, args.concurrency, args.rpm, args.checkpoint)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    print(json.dumps(stats), file=sys.stderr)
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
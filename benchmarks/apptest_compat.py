@@ -0,0 +1,137 @@
+"""AppTest helpers shared by the benchmark scripts.
+
+Importing this module patches four problems in Streamlit 1.28's AppTest:
+
+- Selectbox and multiselect options are sent with ``format_func`` applied but
+  the current value is looked up by its raw key, which raises ValueError for
+  the model pickers in main.py; the lookups fall back to the default indices.
+- A run returns as soon as the script calls ``st.rerun()``, before the rerun
+  has finished, and then fails reading the client state; runs now wait for the
+  runner to shut down, keeping only the output of the last script pass. Button
+  triggers are reset before the rerun, as the real runner does, so a button
+  that calls ``st.rerun()`` does not fire again on every pass.
+- Completion is polled every 100 ms, which swamps the timing of short runs;
+  it is polled every few milliseconds instead.
+- Every run compiles the script afresh; like the real runtime, runs now share
+  one script cache so time and allocations are those of executing main.py.
+
+``last_run`` holds the script time of the most recent run, from the first
+script start to the end of the last pass, excluding AppTest's own overhead.
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from streamlit.proto.WidgetStates_pb2 import WidgetState  # noqa: E402
+from streamlit.runtime.scriptrunner import ScriptRunnerEvent  # noqa: E402
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+from streamlit.testing.v1 import element_tree, local_script_runner  # noqa: E402
+
+APP_PATH = os.path.join(ROOT, "main.py")
+POLL_SECONDS = 0.002
+
+# Script time and number of script passes (more than one after st.rerun) of the last run
+last_run = {'script_seconds': None, 'script_passes': 0}
+
+
+def _selectbox_widget_state(self) -> WidgetState:
+    state = WidgetState()
+    state.id = self.id
+    try:
+        index = self.index
+    except ValueError:
+        index = self.proto.default
+    if index is not None:
+        state.int_value = index
+    return state
+
+
+def _multiselect_widget_state(self) -> WidgetState:
+    state = WidgetState()
+    state.id = self.id
+    try:
+        indices = self.indices
+    except ValueError:
+        indices = list(self.proto.default)
+    state.int_array_value.data[:] = indices
+    return state
+
+
+element_tree.Selectbox._widget_state = property(_selectbox_widget_state)
+element_tree.Multiselect._widget_state = property(_multiselect_widget_state)
+
+_LocalScriptRunner = local_script_runner.LocalScriptRunner
+_original_init = _LocalScriptRunner.__init__
+_original_run = _LocalScriptRunner.run
+_original_on_script_finished = _LocalScriptRunner._on_script_finished
+
+
+def _runner_init(self, *args, **kwargs):
+    _original_init(self, *args, **kwargs)
+    self.script_passes = 0
+    self.script_started = None
+    self.script_finished = None
+
+    def _track(sender, event, **kwargs):
+        now = time.perf_counter()
+        if event == ScriptRunnerEvent.SCRIPT_STARTED:
+            if self.script_passes:
+                # Drop the output of the pass st.rerun() cut short
+                self.forward_msg_queue.clear()
+            else:
+                self.script_started = now
+            self.script_passes += 1
+        elif event in (ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
+                       ScriptRunnerEvent.SCRIPT_STOPPED_WITH_COMPILE_ERROR):
+            self.script_finished = now
+
+    self.on_event.connect(_track, weak=False)
+
+
+def _runner_run(self, *args, **kwargs):
+    tree = _original_run(self, *args, **kwargs)
+    finished = self.script_finished or time.perf_counter()
+    last_run['script_seconds'] = finished - self.script_started if self.script_started else None
+    last_run['script_passes'] = self.script_passes
+    return tree
+
+
+def _on_script_finished(self, ctx, event, premature_stop):
+    if event == ScriptRunnerEvent.SCRIPT_STOPPED_FOR_RERUN:
+        self._session_state._state._reset_triggers()
+    _original_on_script_finished(self, ctx, event, premature_stop)
+
+
+def _script_stopped(self) -> bool:
+    # The runner shuts down once no rerun is pending, after its last pass
+    return ScriptRunnerEvent.SHUTDOWN in self.events
+
+
+def _require_widgets_deltas(runner, timeout: float = 3) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if runner.script_stopped():
+            return
+        time.sleep(POLL_SECONDS)
+    runner.request_stop()
+    runner.join()
+    raise RuntimeError(f"AppTest script run timed out after {timeout}s")
+
+
+_LocalScriptRunner.__init__ = _runner_init
+_LocalScriptRunner.run = _runner_run
+_LocalScriptRunner._on_script_finished = _on_script_finished
+_LocalScriptRunner.script_stopped = _script_stopped
+local_script_runner.require_widgets_deltas = _require_widgets_deltas
+_script_cache = ScriptCache()
+local_script_runner.ScriptCache = lambda: _script_cache
+
+
+def new_app(timeout: float = 60) -> AppTest:
+    """A fresh headless session of main.py"""
+    return AppTest.from_file(APP_PATH, default_timeout=timeout)
@@ -0,0 +1,85 @@
+"""Microbenchmark of the per-rerun "already in history?" check.
+
+Compares the old ``dict in list`` scan with the hash-set lookup in
+ConversationHistory, and the memory the history holds, at several sizes:
+
+    python benchmarks/bench_history_dedup.py --sizes 10 100 1000 10000
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_record import ConversationHistory, content_hash  # noqa: E402
+
+RESPONSE_CHARS = 2000
+
+
+def make_conversations(count: int, seed: int = 3) -> list:
+    rng = random.Random(seed)
+    words = ["token", "stream", "model", "answer", "python", "latency", "cache", "the", "a", "of"]
+    return [{
+        'system_prompt': 'You are a helpful AI assistant.',
+        'context': '',
+        'question': f"Question {i}: " + " ".join(rng.choices(words, k=12)),
+        'response': " ".join(rng.choices(words, k=RESPONSE_CHARS // 6)),
+        'timestamp': f"2024-01-01T00:{i % 60:02d}:00.{i:06d}"
+    } for i in range(count)]
+
+
+def measure_memory(build) -> float:
+    tracemalloc.start()
+    container = build()
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del container
+    return current / 1e6
+
+
+def run(size: int, repeat: int) -> dict:
+    conversations = make_conversations(size)
+    # The current conversation is new, so the old check scans the whole list
+    current = dict(conversations[-1], question="A brand new question")
+
+    history_list = [conv.copy() for conv in conversations]
+    history = ConversationHistory(max_entries=size)
+    for conv in conversations:
+        history.append(conv)
+
+    list_check = timeit.timeit(lambda: current not in history_list, number=repeat) / repeat
+    set_check = timeit.timeit(lambda: content_hash(current) not in history, number=repeat) / repeat
+    return {
+        'size': size,
+        'list_us': list_check * 1e6,
+        'set_us': set_check * 1e6,
+        'list_mb': measure_memory(lambda: [conv.copy() for conv in make_conversations(size)]),
+        'records_mb': measure_memory(lambda: _build_history(size))
+    }
+
+
+def _build_history(size: int) -> ConversationHistory:
+    history = ConversationHistory(max_entries=size)
+    for conv in make_conversations(size):
+        history.append(conv)
+    return history
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'entries':>8} {'list us':>10} {'set us':>8} {'list MB':>8} {'records MB':>11}")
+    for size in args.sizes:
+        result = run(size, args.repeat)
+        print(f"{result['size']:>8} {result['list_us']:>10.1f} {result['set_us']:>8.1f} "
+              f"{result['list_mb']:>8.1f} {result['records_mb']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Rerun cost of main.py for typical interactions, measured headlessly with AppTest.
+
+Every click re-executes the whole script, so this times full reruns for an
+idle rerun, the theme toggle, opening settings, submitting a question
+(against mock_openrouter.py) and loading a history item, with the history store
+seeded at several sizes. Each scenario reports fastest, median and p95 script time
+(every pass when a click calls st.rerun, without AppTest's own overhead), peak
+Python allocations during one rerun, and the number of rendered elements.
+
+    python benchmarks/bench_rerun_cost.py --sizes 0 100 1000 --output rerun.json
+    python benchmarks/bench_rerun_cost.py --baseline benchmarks/rerun_baseline.json
+    python benchmarks/bench_rerun_cost.py --save-baseline benchmarks/rerun_baseline.json
+
+With --baseline, exits non-zero when a scenario got slower, allocates more or
+renders more elements than the stored run by more than the tolerances. Timings
+only compare meaningfully on the machine the baseline was recorded on.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# The model catalog is fetched from the mock; don't save it as the app's snapshot
+os.environ.setdefault("CHAT_MODEL_CATALOG", "")
+
+from apptest_compat import last_run, new_app  # noqa: E402
+from conversation_store import ConversationStore, get_conversation_store  # noqa: E402
+from mock_openrouter import MockConfig, MockOpenRouter  # noqa: E402
+import openrouter_api  # noqa: E402
+from session_settings import SessionSettings  # noqa: E402
+
+API_KEY = "sk-or-benchmark"
+# History is filed under a hash of the API key, as history_owner in main.py does
+HISTORY_OWNER = "key:" + hashlib.sha256(API_KEY.encode("utf-8")).hexdigest()[:16]
+SCENARIOS = ("idle", "theme_toggle", "open_settings", "submit", "load_history")
+# Unmeasured reruns first, so imports, connections and caches are warm
+WARMUP = 3
+# Regression tolerances against the baseline; time is compared on the fastest
+# rerun, which is far less sensitive to noise from other processes than the median
+TIME_TOLERANCE = 0.25
+TIME_FLOOR_MS = 10.0
+ALLOC_TOLERANCE = 0.20
+# Short answers streamed instantly, so submit measures the app rather than the stream
+MOCK_CONFIG = MockConfig(completion_tokens=7, seed=0)
+
+
+def seed_history(path: str, size: int) -> None:
+    store = ConversationStore(path)
+    for i in range(size):
+        store.save({
+            'system_prompt': 'You are a helpful AI assistant.',
+            'context': '',
+            'question': f"Seeded question {i} about streaming latency and caching",
+            'response': f"Seeded answer {i}. " + "Some words of a typical answer. " * 40,
+            'timestamp': f"2024-01-{1 + i % 28:02d}T12:{i % 60:02d}:00",
+            'model': 'openai/gpt-3.5-turbo'
+        }, HISTORY_OWNER)
+    store.flush()
+
+
+def count_elements(node) -> int:
+    children = getattr(node, "children", None)
+    if not children:
+        return 1
+    return 1 + sum(count_elements(child) for child in children.values())
+
+
+def new_session(db_path: str, base_url: str):
+    app = new_app()
+    # No rate limiting or similar-question prompts, so repeated submits stay comparable
+    app.session_state['settings'] = SessionSettings(
+        api_key=API_KEY, api_base_url=base_url, history_db_path=db_path, suggest_similar=False,
+        rate_limit_rpm=0, max_concurrent_streams=0
+    )
+    app.run()
+    return app
+
+
+def _button(app, label: str = None, key: str = None, key_prefix: str = None):
+    for button in app.button:
+        if ((label is not None and button.label == label) or (key is not None and button.key == key)
+                or (key_prefix is not None and (button.key or "").startswith(key_prefix))):
+            return button
+    raise LookupError(label or key or key_prefix)
+
+
+def prepare(app, scenario: str, step: int) -> None:
+    """Set up the widget interaction the next rerun will process"""
+    if scenario == "theme_toggle":
+        _button(app, key="theme_toggle").click()
+    elif scenario == "open_settings":
+        app.session_state['settings_visible'] = False
+        _button(app, key="settings_toggle").click()
+    elif scenario == "submit":
+        # The previous answer is saved in the background; wait so every pass sees the same history
+        get_conversation_store(app.session_state['settings'].history_db_path).flush()
+        app.text_area(key="question").input(f"Benchmark question {step}: how do reruns scale?")
+        app.run()
+        _button(app, label="🚀 Send to AI").click()
+    elif scenario == "load_history":
+        _button(app, key_prefix="load_").click()
+
+
+def measure(db_path: str, base_url: str, scenario: str, repeat: int) -> dict:
+    app = new_session(db_path, base_url)
+    timings = []
+    for step in range(WARMUP + repeat):
+        prepare(app, scenario, step)
+        app.run()
+        if app.exception:
+            raise RuntimeError(f"{scenario}: {app.exception[0].value}")
+        if step >= WARMUP:
+            timings.append(last_run['script_seconds'] * 1000)
+
+    prepare(app, scenario, WARMUP + repeat)
+    tracemalloc.start()
+    app.run()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'min_ms': timings[0],
+        'median_ms': statistics.median(timings),
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'alloc_peak_kb': peak / 1024,
+        'elements': count_elements(app._tree),
+        'passes': last_run['script_passes']
+    }
+
+
+def run(sizes, scenarios, repeat: int) -> list:
+    results = []
+    server = MockOpenRouter(MOCK_CONFIG).start()
+    openrouter_api.OPENROUTER_BASE_URL = server.base_url
+    try:
+        for size in sizes:
+            with tempfile.TemporaryDirectory() as directory:
+                db_path = os.path.join(directory, "history.db")
+                seed_history(db_path, size)
+                for scenario in scenarios:
+                    if scenario == "load_history" and not size:
+                        continue
+                    result = measure(db_path, server.base_url, scenario, repeat)
+                    results.append({'scenario': scenario, 'history': size, **result})
+                    print(f"{scenario:>14} {size:>7} {result['min_ms']:>7.1f} {result['median_ms']:>9.1f} {result['p95_ms']:>8.1f} "
+                          f"{result['alloc_peak_kb']:>10.0f} {result['elements']:>9}", flush=True)
+    finally:
+        server.shutdown()
+    return results
+
+
+def compare(results: list, baseline: list, time_tolerance: float = TIME_TOLERANCE) -> list:
+    """Regressions of each result against the baseline run with the same scenario and size"""
+    previous = {(row['scenario'], row['history']): row for row in baseline}
+    regressions = []
+    for row in results:
+        old = previous.get((row['scenario'], row['history']))
+        if old is None:
+            continue
+        name = f"{row['scenario']} @ {row['history']}"
+        if (row['min_ms'] > old['min_ms'] * (1 + time_tolerance)
+                and row['min_ms'] - old['min_ms'] > TIME_FLOOR_MS):
+            regressions.append(f"{name}: fastest rerun {old['min_ms']:.1f} -> {row['min_ms']:.1f} ms")
+        if row['alloc_peak_kb'] > old['alloc_peak_kb'] * (1 + ALLOC_TOLERANCE):
+            regressions.append(f"{name}: peak allocations {old['alloc_peak_kb']:.0f} -> {row['alloc_peak_kb']:.0f} KB")
+        if row['elements'] > old['elements']:
+            regressions.append(f"{name}: elements {old['elements']} -> {row['elements']}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 100, 1000])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="compare against a saved results file")
+    parser.add_argument("--save-baseline", help="write results as the new baseline")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE,
+                        help="allowed slowdown of the fastest rerun as a fraction (default %(default)s)")
+    args = parser.parse_args()
+
+    print(f"{'scenario':>14} {'history':>7} {'min ms':>7} {'median ms':>9} {'p95 ms':>8} {'peak KB':>10} {'elements':>9}")
+    results = run(args.sizes, args.scenarios, args.repeat)
+    report = {'python': platform.python_version(), 'machine': platform.machine(),
+              'repeat': args.repeat, 'results': results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as handle:
+                json.dump(report, handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            regressions = compare(results, json.load(handle)['results'], args.time_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Benchmark the near-duplicate question index.
+
+Reports index build time, query latency and memory for several history sizes:
+
+    python benchmarks/bench_similarity.py --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity_index import SimilarityIndex  # noqa: E402
+
+STOPWORDS = "how what why when the a to in of for and is do i can my with".split()
+
+
+def make_vocabulary(count: int, rng: random.Random) -> list:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choices(letters, k=rng.randint(3, 9))) for _ in range(count)]
+
+
+def make_questions(count: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(5000, rng)
+    questions = []
+    for _ in range(count):
+        words = rng.choices(vocabulary, k=rng.randint(4, 10))
+        for _ in range(rng.randint(1, 4)):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(STOPWORDS))
+        questions.append(" ".join(words) + "?")
+    return questions
+
+
+def reword(question: str) -> str:
+    """Change casing, punctuation and whitespace the way users retype a question"""
+    return "  " + question.upper().replace("?", " ?!") + " "
+
+
+def edit(question: str, rng: random.Random) -> str:
+    """Drop one word, a small rewording"""
+    words = question.split()
+    del words[rng.randrange(len(words))]
+    return " ".join(words)
+
+
+def run(size: int, queries: int) -> dict:
+    questions = make_questions(size)
+    started = time.perf_counter()
+    index = SimilarityIndex()
+    for i, question in enumerate(questions):
+        index.add(question, i)
+    build_seconds = time.perf_counter() - started
+
+    # Memory is measured on a second build since tracemalloc slows the first one down
+    tracemalloc.start()
+    traced = SimilarityIndex()
+    for i, question in enumerate(questions):
+        traced.add(question, i)
+    memory, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del traced
+
+    rng = random.Random(size)
+    samples = []
+    hits = 0
+    edit_hits = 0
+    for _ in range(queries):
+        target = rng.randrange(size)
+        probe = reword(questions[target])
+        started = time.perf_counter()
+        match = index.query(probe)
+        samples.append(time.perf_counter() - started)
+        hits += bool(match and questions[match[1]] == questions[target])
+        match = index.query(edit(questions[target], rng), threshold=0.6)
+        edit_hits += bool(match and questions[match[1]] == questions[target])
+    samples.sort()
+    return {
+        'size': size,
+        'build_s': build_seconds,
+        'memory_mb': memory / 1e6,
+        'query_mean_us': statistics.fmean(samples) * 1e6,
+        'query_p99_us': samples[int(len(samples) * 0.99) - 1] * 1e6,
+        'recall': hits / queries,
+        'edit_recall': edit_hits / queries
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'entries':>8} {'build s':>8} {'mem MB':>8} {'mean us':>8} {'p99 us':>8} {'recall':>7} {'edit@0.6':>8}")
+    for size in args.sizes:
+        result = run(size, args.queries)
+        print(f"{result['size']:>8} {result['build_s']:>8.2f} {result['memory_mb']:>8.1f} "
+              f"{result['query_mean_us']:>8.1f} {result['query_p99_us']:>8.1f} {result['recall']:>7.3f} {result['edit_recall']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
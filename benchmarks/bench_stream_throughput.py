@@ -0,0 +1,161 @@
+"""End-to-end streaming throughput against the local mock OpenRouter server.
+
+Starts mock_openrouter.py in its own process, then simulates N concurrent
+sessions. Each session sends requests one after another through
+call_openrouter_api on the shared worker pool (GenerationJob) and drains
+them with the same polling loop the app uses. For each concurrency level it
+reports completed sessions per second, streamed tokens per second, CPU per
+streamed token in the app and in the mock, and the time to first token the
+app adds over the mock's configured first-token delay.
+
+    python benchmarks/bench_stream_throughput.py --sessions 1 8 32 --requests 5
+    python benchmarks/bench_stream_throughput.py --tokens-per-second 50 --first-token-delay 0.3
+    python benchmarks/bench_stream_throughput.py --error-rate 0.1 --errors 429 500 drop
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The model catalog is fetched from the mock; don't save it as the app's snapshot
+os.environ.setdefault("CHAT_MODEL_CATALOG", "")
+
+from generation_jobs import start_generation  # noqa: E402
+from mock_openrouter import ERROR_KINDS  # noqa: E402
+from openrouter_api import build_messages, get_http_session  # noqa: E402
+import openrouter_api  # noqa: E402
+
+MOCK_PATH = os.path.join(ROOT, "mock_openrouter.py")
+QUESTION = "Explain how streaming responses reduce perceived latency."
+
+
+def start_mock(args) -> tuple:
+    """Run the mock in its own process so its CPU time is measured separately; returns (process, base URL)"""
+    command = [
+        sys.executable, MOCK_PATH, "--port", "0",
+        "--completion-tokens", str(args.tokens), "--tokens-per-second", str(args.tokens_per_second),
+        "--first-token-delay", str(args.first_token_delay), "--chunk-tokens", str(args.chunk_tokens),
+        "--error-rate", str(args.error_rate), "--retry-after", str(args.retry_after),
+        "--errors", *args.errors,
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=ROOT)
+    line = process.stdout.readline()
+    if "listening on" not in line:
+        process.kill()
+        raise RuntimeError(f"mock server did not start: {line!r}")
+    return process, line.rsplit(" ", 1)[1].strip()
+
+
+def mock_stats(base_url: str) -> dict:
+    return get_http_session().get(f"{base_url}/stats", timeout=5).json()
+
+
+def run_session(session_number: int, requests: int, request: dict, max_retries: int) -> list:
+    """Send requests one after another, reading each like the app's streaming loop"""
+    results = []
+    for _ in range(requests):
+        job = start_generation(request, {'session_id': f"bench-{session_number}"}, max_retries=max_retries)
+        cursor = 0
+        while True:
+            is_finished = job.is_finished
+            cursor += len(job.read(cursor))
+            if is_finished:
+                break
+        timings = job.timings()
+        results.append({'status': job.status, 'ttft': timings['ttft'], 'total': timings['total'],
+                        'tokens': timings['completion_tokens'] if job.status == 'done' else 0,
+                        'failed_attempts': len(job.attempts)})
+    return results
+
+
+def run(concurrency: int, args, base_url: str) -> dict:
+    request = {
+        'messages': build_messages("You are a helpful AI assistant.", "", QUESTION),
+        'model': args.model, 'temperature': 0.7, 'max_tokens': args.tokens,
+        'api_key': "sk-or-mock", 'base_url': base_url
+    }
+    before = mock_stats(base_url)
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        sessions = list(executor.map(
+            lambda number: run_session(number, args.requests, request, args.max_retries), range(concurrency)
+        ))
+    wall = time.perf_counter() - started
+    app_cpu = time.process_time() - cpu_before
+    after = mock_stats(base_url)
+
+    results = [result for session in sessions for result in session]
+    done = [result for result in results if result['status'] == 'done']
+    tokens = sum(result['tokens'] for result in done)
+    streamed = after['tokens_streamed'] - before['tokens_streamed']
+    overheads = sorted((result['ttft'] - args.first_token_delay) * 1000 for result in done if result['ttft'])
+    return {
+        'sessions': concurrency,
+        'requests': len(results),
+        'errors': len(results) - len(done),
+        'failed_attempts': sum(result['failed_attempts'] for result in results),
+        'wall_seconds': wall,
+        'sessions_per_second': concurrency / wall,
+        'tokens_per_second': tokens / wall,
+        'app_cpu_us_per_token': app_cpu / tokens * 1e6 if tokens else None,
+        'mock_cpu_us_per_token': (after['cpu_seconds'] - before['cpu_seconds']) / streamed * 1e6 if streamed else None,
+        'ttft_overhead_p50_ms': statistics.median(overheads) if overheads else None,
+        'ttft_overhead_p95_ms': overheads[min(len(overheads) - 1, int(len(overheads) * 0.95))] if overheads else None,
+    }
+
+
+def _format(value, spec: str) -> str:
+    return format(value, spec) if value is not None else "n/a"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 8, 32], help="concurrency levels")
+    parser.add_argument("--requests", type=int, default=5, help="requests per session")
+    parser.add_argument("--tokens", type=int, default=200, help="completion tokens per answer")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="mock token rate (0 = unthrottled)")
+    parser.add_argument("--first-token-delay", type=float, default=0.0, help="mock delay before the first token")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="tokens per SSE event")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--errors", nargs="+", choices=ERROR_KINDS, default=["429", "500", "drop"])
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--max-retries", type=int, default=2)
+    parser.add_argument("--model", default="openai/gpt-3.5-turbo")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    process, base_url = start_mock(args)
+    # Keep the model catalog refresh local too
+    openrouter_api.OPENROUTER_BASE_URL = base_url
+    results = []
+    try:
+        print(f"{'sessions':>8} {'requests':>8} {'errors':>6} {'sess/s':>8} {'tok/s':>9} "
+              f"{'app us/tok':>10} {'mock us/tok':>11} {'TTFT+ p50 ms':>12} {'p95 ms':>7}")
+        for concurrency in args.sessions:
+            result = run(concurrency, args, base_url)
+            results.append(result)
+            print(f"{result['sessions']:>8} {result['requests']:>8} {result['errors']:>6} "
+                  f"{result['sessions_per_second']:>8.2f} {result['tokens_per_second']:>9.0f} "
+                  f"{_format(result['app_cpu_us_per_token'], '>10.1f')} "
+                  f"{_format(result['mock_cpu_us_per_token'], '>11.1f')} "
+                  f"{_format(result['ttft_overhead_p50_ms'], '>12.1f')} "
+                  f"{_format(result['ttft_overhead_p95_ms'], '>7.1f')}", flush=True)
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump({'config': vars(args), 'results': results}, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
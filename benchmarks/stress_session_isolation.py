@@ -0,0 +1,153 @@
+"""Drive many sessions' settings at once and check they never leak.
+
+Each simulated session gets its own thread with its own Streamlit
+ScriptRunContext and SessionState, the way the server binds one session to
+each script thread. All threads then call get_settings/set_settings in
+parallel with per-session values, checking after every update that they only
+ever see their own. The thread switch interval is shortened so updates
+interleave as tightly as possible. Exits non-zero on any cross-talk:
+
+    python benchmarks/stress_session_isolation.py --sessions 16 --rounds 2000
+
+``--app`` also runs main.py through AppTest for each session as a UI smoke
+test. AppTest swaps process-wide runtime globals while a script runs, so those
+reruns take turns under a lock and are not part of the concurrency check.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import FrozenInstanceError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import streamlit as st  # noqa: E402
+from streamlit.runtime.scriptrunner import ScriptRunContext, add_script_run_ctx  # noqa: E402
+from streamlit.runtime.state import SafeSessionState, SessionState  # noqa: E402
+
+from session_settings import DEFAULT_SETTINGS, SessionSettings, get_settings, set_settings  # noqa: E402
+
+
+RUN_LOCK = threading.Lock()
+
+
+def bind_session(session_number: int) -> None:
+    """Give the current thread its own session, as the server does for a script run"""
+    ctx = ScriptRunContext(
+        session_id=f"session-{session_number}",
+        _enqueue=lambda msg: None,
+        query_string="",
+        session_state=SafeSessionState(SessionState(), lambda: None),
+        uploaded_file_mgr=None,
+        page_script_hash="",
+        user_info={},
+    )
+    add_script_run_ctx(threading.current_thread(), ctx)
+
+
+def run_settings_session(session_number: int, rounds: int, start: threading.Barrier) -> list:
+    """Update and re-read one session's settings; return the cross-talk problems it saw"""
+    problems = []
+    bind_session(session_number)
+    initial = st.session_state.settings = SessionSettings()
+    start.wait()
+    for round_number in range(rounds):
+        api_key = f"sk-or-session-{session_number}-round-{round_number}"
+        system_prompt = f"You are assistant number {session_number}."
+        set_settings(api_key=api_key, system_prompt=system_prompt, max_tokens=session_number + 1)
+        time.sleep(0)
+        settings = get_settings()
+        if (settings.api_key, settings.system_prompt, settings.max_tokens) != (
+                api_key, system_prompt, session_number + 1):
+            problems.append(f"session {session_number} round {round_number}: saw {settings.api_key!r}, "
+                            f"{settings.system_prompt!r}, max_tokens={settings.max_tokens}")
+    try:
+        get_settings().api_key = 'leak'
+        problems.append(f"session {session_number}: settings accepted an in-place write")
+    except FrozenInstanceError:
+        pass
+    if initial.api_key != '':
+        problems.append(f"session {session_number}: the original settings object was modified")
+    return problems
+
+
+def rerun(app) -> None:
+    with RUN_LOCK:
+        app.run()
+
+
+def run_app_session(session_number: int, rounds: int, start: threading.Barrier) -> list:
+    """Enter one session's values through the UI; return the problems seen"""
+    from apptest_compat import new_app
+    problems = []
+    app = new_app()
+    app.session_state['settings_visible'] = True
+    start.wait()
+    rerun(app)
+    for round_number in range(rounds):
+        api_key = f"sk-or-session-{session_number}-round-{round_number}"
+        system_prompt = f"You are assistant number {session_number}."
+        app.text_input[0].input(api_key)
+        app.text_area(key="question").input(f"question from {session_number}")
+        rerun(app)
+        # The sidebar System Prompt follows the API key inputs
+        next(area for area in app.sidebar.text_area if area.label == "System Prompt (Advanced)").input(system_prompt)
+        rerun(app)
+        settings = app.session_state['settings']
+        if settings.api_key != api_key:
+            problems.append(f"app session {session_number}: api_key {settings.api_key!r} != {api_key!r}")
+        if settings.system_prompt != system_prompt:
+            problems.append(f"app session {session_number}: system_prompt {settings.system_prompt!r}")
+        if app.exception:
+            problems.append(f"app session {session_number}: {app.exception[0].value}")
+    return problems
+
+
+def run_sessions(target, sessions: int, rounds: int) -> list:
+    start = threading.Barrier(sessions)
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        results = list(executor.map(lambda n: target(n, rounds, start), range(sessions)))
+    return [problem for result in results for problem in result]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--app", action="store_true", help="also run the AppTest UI smoke test")
+    parser.add_argument("--app-rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    started = time.perf_counter()
+    try:
+        problems = run_sessions(run_settings_session, args.sessions, args.rounds)
+    finally:
+        sys.setswitchinterval(switch_interval)
+    elapsed = time.perf_counter() - started
+    print(f"{args.sessions} sessions x {args.rounds} parallel settings updates in {elapsed:.1f}s")
+
+    if args.app:
+        started = time.perf_counter()
+        problems += run_sessions(run_app_session, args.sessions, args.app_rounds)
+        print(f"{args.sessions} app sessions x {args.app_rounds} rounds in {time.perf_counter() - started:.1f}s")
+
+    if DEFAULT_SETTINGS['api_key'] != '':
+        problems.append(f"module defaults were modified: api_key={DEFAULT_SETTINGS['api_key']!r}")
+    try:
+        DEFAULT_SETTINGS['api_key'] = 'leak'
+        problems.append("module defaults accepted a write")
+    except TypeError:
+        pass
+
+    for problem in problems[:20]:
+        print(f"CROSS-TALK: {problem}")
+    print("OK: no cross-talk" if not problems else f"FAILED: {len(problems)} problem(s)")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""Send only the parts of a long context that matter to the question.
+
+A context document is split into chunks of about CHUNK_TOKENS along paragraph
+and sentence boundaries, and indexed for BM25 ranking. The index is built
+once per document and shared by every session in the process, keyed by a hash
+of the text. For each question the best-scoring chunks are sent, in document
+order, until the token budget or DEFAULT_TOP_K is reached. A context that
+already fits the budget is sent whole.
+"""
+import hashlib
+import math
+import re
+import threading
+from collections import OrderedDict
+
+from usage_stats import estimate_tokens
+
+CHUNK_TOKENS = 300
+DEFAULT_CONTEXT_TOKEN_BUDGET = 1500
+DEFAULT_TOP_K = 6
+# Indexed documents kept per process
+INDEX_CACHE_SIZE = 32
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+PREVIEW_CHARS = 120
+EXCERPTS_HEADER = "Excerpts of a longer document, selected for this question:"
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_TERM = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    """Lowercased index terms; single letters are dropped, single digits kept"""
+    return [term for term in _TERM.findall(text.lower()) if len(term) > 1 or term.isdigit()]
+
+
+def _pieces(text: str, chunk_tokens: int):
+    """Yield ``(piece, starts_paragraph)``: paragraphs, or the sentences (or slices) of long ones"""
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= chunk_tokens:
+            yield paragraph, True
+            continue
+        starts_paragraph = True
+        for sentence in _SENTENCE_END.split(paragraph):
+            if estimate_tokens(sentence) <= chunk_tokens:
+                yield sentence, starts_paragraph
+            else:
+                # No usable boundary, e.g. a table or minified code: slice by its token density
+                size = max(1, len(sentence) * chunk_tokens // estimate_tokens(sentence))
+                for start in range(0, len(sentence), size):
+                    yield sentence[start:start + size], starts_paragraph and start == 0
+            starts_paragraph = False
+
+
+def split_chunks(text: str, chunk_tokens: int = CHUNK_TOKENS) -> list:
+    """Pack paragraphs and sentences into chunks of at most about ``chunk_tokens``"""
+    chunks = []
+    current = ""
+    current_tokens = 0
+    for piece, starts_paragraph in _pieces(text, chunk_tokens):
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append(current)
+            current, current_tokens = "", 0
+        if current:
+            current += "\n\n" if starts_paragraph else " "
+        current += piece
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class ContextChunk:
+    __slots__ = ('number', 'text', 'tokens', 'length')
+
+    def __init__(self, number: int, text: str, length: int):
+        self.number = number
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        self.length = length
+
+
+class ContextIndex:
+    """BM25 index over the chunks of one document"""
+
+    def __init__(self, text: str, chunk_tokens: int = CHUNK_TOKENS):
+        self.chunks = []
+        self._postings = {}
+        for number, chunk_text in enumerate(split_chunks(text, chunk_tokens)):
+            terms = tokenize(chunk_text)
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                self._postings.setdefault(term, []).append((number, count))
+            self.chunks.append(ContextChunk(number, chunk_text, len(terms)))
+        self.full_tokens = estimate_tokens(text)
+        self._average_length = sum(chunk.length for chunk in self.chunks) / max(len(self.chunks), 1) or 1.0
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def rank(self, query: str) -> list:
+        """``(chunk number, score)`` for every chunk sharing a term with the query, best first"""
+        count = len(self.chunks)
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for number, frequency in postings:
+                length_norm = 1 - BM25_B + BM25_B * self.chunks[number].length / self._average_length
+                scores[number] = scores.get(number, 0.0) + idf * frequency * (BM25_K1 + 1) / (
+                    frequency + BM25_K1 * length_norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_context_index(text: str, chunk_tokens: int = CHUNK_TOKENS) -> ContextIndex:
+    """Index of a document, built on first use and shared by every session in the process"""
+    key = (hashlib.sha256(text.encode("utf-8")).hexdigest(), chunk_tokens)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    # Built outside the lock; two sessions racing on a new document just build it twice
+    index = ContextIndex(text, chunk_tokens)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def _preview(text: str) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS - 1].rstrip() + "…"
+
+
+def select_context(document: str, question: str, budget: int, top_k: int = DEFAULT_TOP_K) -> tuple:
+    """The context to send and a report of what was chosen, or ``(document, None)`` when it fits"""
+    if estimate_tokens(document) <= budget:
+        return document, None
+    index = get_context_index(document)
+    ranked = index.rank(question)
+    scores = dict(ranked)
+    # Without a single matching term, fall back to the start of the document
+    candidates = [number for number, _score in ranked] if ranked else range(len(index))
+
+    chosen = []
+    tokens = estimate_tokens(EXCERPTS_HEADER)
+    for number in candidates:
+        if len(chosen) >= top_k:
+            break
+        chunk = index.chunks[number]
+        cost = chunk.tokens + estimate_tokens(f"[Excerpt {number + 1} of {len(index)}]")
+        if tokens + cost > budget:
+            continue
+        chosen.append(number)
+        tokens += cost
+    chosen.sort()
+
+    text = "\n\n".join([EXCERPTS_HEADER] + [
+        f"[Excerpt {number + 1} of {len(index)}]\n{index.chunks[number].text}" for number in chosen
+    ])
+    context_tokens = estimate_tokens(text)
+    return text, {
+        'chunks': len(index),
+        'included': [{'number': number + 1, 'score': scores.get(number, 0.0),
+                      'tokens': index.chunks[number].tokens, 'preview': _preview(index.chunks[number].text)}
+                     for number in chosen],
+        'matched': bool(ranked),
+        'context_tokens': context_tokens,
+        'full_tokens': index.full_tokens,
+        'saved_tokens': max(0, index.full_tokens - context_tokens)
+    }
+
+
+def format_retrieval_report(report: dict) -> str:
+    """One-line summary of which context chunks were sent"""
+    numbers = ", ".join(f"#{chunk['number']}" for chunk in report['included'])
+    text = (f"📄 Context: {len(report['included'])} of {report['chunks']} chunks ({numbers or 'none'}) • "
+            f"~{report['context_tokens']:,} of ~{report['full_tokens']:,} tokens")
+    if not report['matched']:
+        text += " • no terms matched, sent the beginning"
+    if report['saved_tokens']:
+        text += f" • saved ~{report['saved_tokens']:,} prompt tokens"
+    return text
@@ -0,0 +1,161 @@
+import re
+
+from model_catalog import get_model_catalog
+from usage_stats import estimate_prompt_tokens, estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+
+# Head room for tokenizer differences between the estimate and the provider
+SAFETY_MARGIN_TOKENS = 256
+# Prior turns are capped well below most context windows so prompt cost stays flat
+DEFAULT_HISTORY_TOKEN_BUDGET = 3000
+# Turns move into the summary this many at a time, so the verbatim window (and
+# the message prefix) only shifts every few turns instead of on every turn
+ROLLUP_BLOCK = 4
+# Share of the history budget the summaries may use before the oldest are dropped
+SUMMARY_SHARE = 0.25
+SUMMARY_QUESTION_CHARS = 160
+SUMMARY_ANSWER_CHARS = 240
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def prompt_room(model: str, max_tokens: int, fixed_tokens: int) -> int:
+    """Tokens of the model's context window left once the fixed prompt and the reply are reserved"""
+    return get_model_catalog().context_length(model) - max_tokens - SAFETY_MARGIN_TOKENS - fixed_tokens
+
+
+def history_budget(model: str, max_tokens: int, fixed_tokens: int, cap: int = DEFAULT_HISTORY_TOKEN_BUDGET) -> int:
+    """Tokens left for prior turns once the fixed prompt and the reply are reserved"""
+    return max(0, min(cap, prompt_room(model, max_tokens, fixed_tokens)))
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def summarize_turn(question: str, response: str) -> str:
+    """One-line extractive digest of a turn: the question and the answer's opening sentence"""
+    first_sentence = _SENTENCE_END.split(response.strip(), 1)[0] if response.strip() else ""
+    return f"- Q: {_clip(question, SUMMARY_QUESTION_CHARS)} A: {_clip(first_sentence, SUMMARY_ANSWER_CHARS)}"
+
+
+class ConversationTurn:
+    __slots__ = ('question', 'response', 'tokens')
+
+    def __init__(self, question: str, response: str):
+        self.question = question
+        self.response = response
+        self.tokens = (2 * MESSAGE_OVERHEAD_TOKENS + estimate_tokens(question) + estimate_tokens(response))
+
+    def messages(self) -> list:
+        return [{"role": "user", "content": self.question},
+                {"role": "assistant", "content": self.response}]
+
+
+class ConversationContext:
+    """Prior turns of the current conversation, fitted into a token budget.
+
+    Recent turns are sent verbatim. Older ones are rolled up, a block at a
+    time, into extractive summaries that are computed once and cached. The
+    boundary only moves by whole blocks, so consecutive requests share the
+    same message prefix.
+    """
+
+    def __init__(self):
+        self.turns = []
+        self._block_summaries = {}
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def add_turn(self, question: str, response: str) -> None:
+        if question and response:
+            self.turns.append(ConversationTurn(question, response))
+
+    def clear(self) -> None:
+        self.turns = []
+        self._block_summaries = {}
+
+    def _block_summary(self, block: int) -> tuple:
+        """Cached ``(text, tokens)`` digest of the turns in one rollup block"""
+        cached = self._block_summaries.get(block)
+        if cached is None:
+            turns = self.turns[block * ROLLUP_BLOCK:(block + 1) * ROLLUP_BLOCK]
+            text = "\n".join(summarize_turn(turn.question, turn.response) for turn in turns)
+            cached = self._block_summaries[block] = (text, estimate_tokens(text) + 1)
+        return cached
+
+    def history_messages(self, budget: int) -> tuple:
+        """Messages for prior turns within ``budget`` tokens, and a report of what was kept"""
+        total_tokens = sum(turn.tokens for turn in self.turns)
+        report = {'turns': len(self.turns), 'verbatim': 0, 'summarized': 0, 'dropped': 0,
+                  'history_tokens': 0, 'full_tokens': total_tokens, 'saved_tokens': 0}
+        if not self.turns or budget <= 0:
+            report['dropped'] = len(self.turns)
+            report['saved_tokens'] = total_tokens
+            return [], report
+
+        # Once everything no longer fits, summaries get a fixed share so they only change when
+        # the verbatim window moves, and the window starts at the earliest block boundary that fits
+        start = 0
+        verbatim_tokens = total_tokens
+        summary_budget = int(budget * SUMMARY_SHARE) if total_tokens > budget else 0
+        verbatim_budget = budget - summary_budget
+        while verbatim_tokens > verbatim_budget and start < len(self.turns):
+            block_end = min(len(self.turns), start + ROLLUP_BLOCK)
+            verbatim_tokens -= sum(turn.tokens for turn in self.turns[start:block_end])
+            start = block_end
+        # A single very long recent turn can still overflow: drop turns from the front
+        while verbatim_tokens > verbatim_budget and start < len(self.turns):
+            verbatim_tokens -= self.turns[start].tokens
+            start += 1
+
+        # Roll complete blocks before the window into summaries, newest first, within their share
+        summaries = []
+        summary_tokens = 0
+        summarized_turns = 0
+        for block in range(start // ROLLUP_BLOCK - 1, -1, -1):
+            text, tokens = self._block_summary(block)
+            if summary_tokens + tokens > summary_budget:
+                break
+            summaries.insert(0, text)
+            summary_tokens += tokens
+            summarized_turns += ROLLUP_BLOCK
+
+        messages = []
+        if summaries:
+            # A user message, since providers may hoist system messages ahead of the cached context
+            messages.append({"role": "user",
+                             "content": "Summary of earlier turns in this conversation:\n" + "\n".join(summaries)})
+            summary_tokens += MESSAGE_OVERHEAD_TOKENS
+        for turn in self.turns[start:]:
+            messages.extend(turn.messages())
+
+        history_tokens = verbatim_tokens + summary_tokens
+        report.update({
+            'verbatim': len(self.turns) - start,
+            'summarized': summarized_turns,
+            'dropped': start - summarized_turns,
+            'history_tokens': history_tokens,
+            'saved_tokens': max(0, total_tokens - history_tokens)
+        })
+        return messages, report
+
+
+def fixed_prompt_tokens(system_prompt: str, context: str, question: str) -> int:
+    """Tokens of everything in the prompt except prior turns"""
+    messages = [{"content": text} for text in (system_prompt, context, question) if text and text.strip()]
+    return estimate_prompt_tokens(messages)
+
+
+def format_context_report(report: dict) -> str:
+    """One-line summary of how prior turns were fitted into the prompt"""
+    parts = [f"{report['verbatim']} verbatim"]
+    if report['summarized']:
+        parts.append(f"{report['summarized']} summarized")
+    if report['dropped']:
+        parts.append(f"{report['dropped']} dropped")
+    text = f"🧠 History: {report['turns']} turn(s) ({', '.join(parts)}) • ~{report['history_tokens']:,} tokens"
+    if report['saved_tokens']:
+        text += f" • saved ~{report['saved_tokens']:,} prompt tokens"
+    return text
@@ -0,0 +1,147 @@
+import hashlib
+import zlib
+from collections import deque
+
+CONTENT_FIELDS = ('system_prompt', 'context', 'question', 'response', 'timestamp')
+
+# Responses of records older than the newest KEEP_UNCOMPRESSED are zlib-compressed,
+# as are the oldest ones whenever uncompressed text passes MAX_UNCOMPRESSED_CHARS
+DEFAULT_KEEP_UNCOMPRESSED = 5
+DEFAULT_MAX_UNCOMPRESSED_CHARS = 200_000
+MIN_COMPRESS_CHARS = 256
+
+
+def content_hash(conv: dict) -> str:
+    """Stable id of a conversation's content, independent of storage-only keys"""
+    digest = hashlib.blake2b(digest_size=16)
+    for field in CONTENT_FIELDS:
+        digest.update(str(conv.get(field) or '').encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class ConversationRecord:
+    """Compact in-memory conversation whose response can be stored compressed"""
+
+    __slots__ = ('record_id', 'system_prompt', 'context', 'question', 'timestamp', 'model', '_response', '_is_compressed')
+
+    def __init__(self, conv: dict):
+        self.record_id = content_hash(conv)
+        self.system_prompt = conv.get('system_prompt') or ''
+        self.context = conv.get('context') or ''
+        self.question = conv.get('question') or ''
+        self.timestamp = conv.get('timestamp')
+        self.model = conv.get('model')
+        self._response = conv.get('response') or ''
+        self._is_compressed = False
+
+    @property
+    def response(self) -> str:
+        if self._is_compressed:
+            return zlib.decompress(self._response).decode("utf-8")
+        return self._response
+
+    @property
+    def is_compressed(self) -> bool:
+        return self._is_compressed
+
+    @property
+    def stored_size(self) -> int:
+        return len(self._response)
+
+    def compress(self) -> None:
+        if self._is_compressed or len(self._response) < MIN_COMPRESS_CHARS:
+            return
+        self._response = zlib.compress(self._response.encode("utf-8"), 6)
+        self._is_compressed = True
+
+    def get(self, field: str, default=None):
+        """dict-style access so records can stand in for the old history dicts"""
+        if field == 'response':
+            return self.response
+        if field in self.__slots__ and not field.startswith('_'):
+            value = getattr(self, field)
+            return default if value is None else value
+        return default
+
+    def to_dict(self) -> dict:
+        return {
+            'system_prompt': self.system_prompt,
+            'context': self.context,
+            'question': self.question,
+            'response': self.response,
+            'timestamp': self.timestamp,
+            'model': self.model
+        }
+
+
+class ConversationHistory:
+    """Bounded window of recent conversations with O(1) membership checks.
+
+    ``on_evict``, if set, is called with the record id of each record that falls
+    out of the window, so indexes over the window can drop it too.
+    """
+
+    __slots__ = ('max_entries', 'keep_uncompressed', 'max_uncompressed_chars', 'on_evict',
+                 '_records', '_ids', '_uncompressed_chars')
+
+    def __init__(self, max_entries: int = 50, keep_uncompressed: int = DEFAULT_KEEP_UNCOMPRESSED,
+                 max_uncompressed_chars: int = DEFAULT_MAX_UNCOMPRESSED_CHARS):
+        self.max_entries = max_entries
+        self.keep_uncompressed = keep_uncompressed
+        self.max_uncompressed_chars = max_uncompressed_chars
+        self.on_evict = None
+        self._records = deque()
+        self._ids = {}
+        self._uncompressed_chars = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __contains__(self, item) -> bool:
+        record_id = item if isinstance(item, str) else content_hash(item)
+        return record_id in self._ids
+
+    def get(self, record_id: str):
+        """The record with this id, or None if it is not in the window"""
+        return self._ids.get(record_id)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._records)[index]
+        return self._records[index]
+
+    def append(self, conv):
+        """Add a conversation dict or record; returns the record, or None if already present"""
+        record = conv if isinstance(conv, ConversationRecord) else ConversationRecord(conv)
+        if record.record_id in self._ids:
+            return None
+        self._records.append(record)
+        self._ids[record.record_id] = record
+        if not record.is_compressed:
+            self._uncompressed_chars += record.stored_size
+        while len(self._records) > self.max_entries:
+            dropped = self._records.popleft()
+            del self._ids[dropped.record_id]
+            if not dropped.is_compressed:
+                self._uncompressed_chars -= dropped.stored_size
+            if self.on_evict is not None:
+                self.on_evict(dropped.record_id)
+        self._compress_old()
+        return record
+
+    def _compress_old(self) -> None:
+        # Walk from the oldest record; only recently added ones can still be uncompressed
+        protected = len(self._records) - self.keep_uncompressed
+        for position, record in enumerate(self._records):
+            if position >= protected and self._uncompressed_chars <= self.max_uncompressed_chars:
+                break
+            if record.is_compressed:
+                continue
+            before = record.stored_size
+            record.compress()
+            if record.is_compressed:
+                self._uncompressed_chars -= before
@@ -0,0 +1,396 @@
+"""SQLite-backed conversation history shared by every session in the process.
+
+Writes are queued and committed in batches by a background thread so the
+Streamlit script thread never waits on disk; reads are paginated queries.
+Questions and responses are indexed in an FTS5 table kept in sync by triggers,
+so search stays incremental as each response is saved.
+
+Export a user's history, optionally filtered, as JSONL, Markdown or a zip, and
+import a JSONL or zip export (or a JSON list of dicts from an older session)
+back into history; see history_export.py:
+
+    python conversation_store.py export history.zip --db conversations.db --user alice --model openai/gpt-4o
+    python conversation_store.py import history.zip --db conversations.db --user alice
+"""
+import argparse
+import json
+import queue
+import re
+import sqlite3
+import sys
+import threading
+
+from history_export import EXPORT_FORMATS, export_format, read_export, write_export
+from metrics import HISTORY_QUEUE_DEPTH, HISTORY_SAVES
+
+DEFAULT_DB_PATH = "conversations.db"
+BATCH_SIZE = 100
+BATCH_INTERVAL = 0.25
+# Rows read per query while exporting, and rows queued per flush while importing,
+# so neither holds more than this many conversations in memory
+EXPORT_BATCH_SIZE = 500
+IMPORT_CHUNK_SIZE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    session_id TEXT,
+    model TEXT,
+    timestamp TEXT,
+    system_prompt TEXT,
+    context TEXT,
+    question TEXT,
+    response TEXT,
+    settings TEXT,
+    usage TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_user_time ON conversations(user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_conversations_session ON conversations(session_id);
+CREATE INDEX IF NOT EXISTS idx_conversations_model ON conversations(model);
+CREATE INDEX IF NOT EXISTS idx_conversations_time ON conversations(timestamp);
+"""
+
+# Columns added after the first release, created on databases that predate them
+_ADDED_COLUMNS = {"settings": "TEXT", "usage": "TEXT"}
+_COLUMNS = "id, model, timestamp, system_prompt, context, question, response"
+_EXPORT_COLUMNS = f"{_COLUMNS}, session_id, settings, usage"
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE conversations_fts USING fts5(
+    question, response, content='conversations', content_rowid='id', tokenize='unicode61'
+);
+CREATE TRIGGER conversations_fts_insert AFTER INSERT ON conversations BEGIN
+    INSERT INTO conversations_fts(rowid, question, response) VALUES (new.id, new.question, new.response);
+END;
+CREATE TRIGGER conversations_fts_delete AFTER DELETE ON conversations BEGIN
+    INSERT INTO conversations_fts(conversations_fts, rowid, question, response)
+    VALUES ('delete', old.id, old.question, old.response);
+END;
+CREATE TRIGGER conversations_fts_update AFTER UPDATE ON conversations BEGIN
+    INSERT INTO conversations_fts(conversations_fts, rowid, question, response)
+    VALUES ('delete', old.id, old.question, old.response);
+    INSERT INTO conversations_fts(rowid, question, response) VALUES (new.id, new.question, new.response);
+END;
+INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild');
+"""
+
+HIGHLIGHT_START = "**"
+HIGHLIGHT_END = "**"
+_SEARCH_TOKEN = re.compile(r"\w+")
+
+
+def build_fts_query(text: str) -> str:
+    """Turn free text into a safe FTS5 query; a last word of 3+ characters matches as a prefix"""
+    tokens = _SEARCH_TOKEN.findall(text)
+    if not tokens:
+        return ""
+    quoted = [f'"{token}"' for token in tokens]
+    # Very short prefixes match most of the index and are slow to rank
+    if len(tokens[-1]) >= 3:
+        quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _json_field(value):
+    """Settings and usage are stored as JSON text"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _filter_clause(user_id: str, model: str = None, date_from: str = None, date_to: str = None,
+                   prefix: str = "") -> tuple:
+    """SQL conditions and parameters for a user's conversations, optionally by model and date.
+
+    ``date_from`` and ``date_to`` are ISO date prefixes; ``date_to`` is inclusive.
+    """
+    filters = [f"{prefix}user_id = ?"]
+    params = [user_id]
+    if model:
+        filters.append(f"{prefix}model = ?")
+        params.append(model)
+    if date_from:
+        filters.append(f"{prefix}timestamp >= ?")
+        params.append(date_from)
+    if date_to:
+        # ISO timestamps on the end date sort below the next character after it
+        filters.append(f"{prefix}timestamp < ?")
+        params.append(date_to + "\uffff")
+    return " AND ".join(filters), params
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class ConversationStore:
+    """Conversation history table with a batched background writer"""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        writer = _connect(path)
+        writer.executescript(_SCHEMA)
+        self._add_columns(writer)
+        self.has_fts = self._ensure_fts(writer)
+        writer.commit()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, args=(writer,),
+                                        name="conversation-writer", daemon=True)
+        self._writer.start()
+
+    def save(self, record: dict, user_id: str, session_id: str = None) -> None:
+        """Queue a conversation for writing; returns immediately"""
+        self._queue.put(self._row(record, user_id, session_id))
+        HISTORY_QUEUE_DEPTH.inc()
+
+    def import_records(self, records, user_id: str, session_id: str = None, skip_existing: bool = False) -> int:
+        """Write history dicts from any iterable, a chunk at a time; returns how many were queued.
+
+        With ``skip_existing``, conversations already stored for the user (same timestamp,
+        question and response) are skipped, so an export can be imported again safely.
+        """
+        count = 0
+        for record in records:
+            if not record.get('response'):
+                continue
+            if skip_existing and self.contains(record, user_id):
+                continue
+            self.save(record, user_id, record.get('session_id') or session_id)
+            count += 1
+            # Wait for the writer now and then so a large import never piles up in the queue
+            if count % IMPORT_CHUNK_SIZE == 0:
+                self.flush()
+        return count
+
+    def flush(self) -> None:
+        """Block until every queued write is committed"""
+        self._queue.join()
+
+    def count(self, user_id: str) -> int:
+        return self._reader().execute(
+            "SELECT COUNT(*) FROM conversations WHERE user_id = ?", (user_id,)
+        ).fetchone()[0]
+
+    def page(self, user_id: str, limit: int = 10, offset: int = 0) -> list:
+        """Most recent conversations first, ``limit`` at a time"""
+        rows = self._reader().execute(
+            f"SELECT {_COLUMNS} FROM conversations WHERE user_id = ? "
+            "ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+            (user_id, limit, offset)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, conversation_id: int):
+        row = self._reader().execute(
+            f"SELECT {_COLUMNS} FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def contains(self, record: dict, user_id: str) -> bool:
+        """Whether the user already has this conversation stored"""
+        return self._reader().execute(
+            "SELECT 1 FROM conversations WHERE user_id = ? AND timestamp IS ? AND question = ? AND response = ? "
+            "LIMIT 1",
+            (user_id, record.get('timestamp'), record.get('question', ''), record.get('response', ''))
+        ).fetchone() is not None
+
+    def iter_conversations(self, user_id: str, model: str = None, date_from: str = None,
+                           date_to: str = None, batch_size: int = EXPORT_BATCH_SIZE):
+        """Yield the user's conversations oldest first, with settings and usage decoded.
+
+        Rows are read ``batch_size`` at a time by id, so memory use does not depend on
+        the size of the history and no read transaction stays open between batches.
+        """
+        where, params = _filter_clause(user_id, model, date_from, date_to)
+        last_id = 0
+        while True:
+            rows = self._reader().execute(
+                f"SELECT {_EXPORT_COLUMNS} FROM conversations WHERE {where} AND id > ? ORDER BY id LIMIT ?",
+                (*params, last_id, batch_size)
+            ).fetchall()
+            for row in rows:
+                conv = dict(row)
+                for field in ('settings', 'usage'):
+                    if conv[field]:
+                        try:
+                            conv[field] = json.loads(conv[field])
+                        except ValueError:
+                            pass
+                yield conv
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['id']
+
+    def iter_questions(self, user_id: str, after_id: int = 0, batch_size: int = EXPORT_BATCH_SIZE):
+        """Yield ``(id, question)`` for the user's conversations with ids above ``after_id``, oldest first"""
+        while True:
+            rows = self._reader().execute(
+                "SELECT id, question FROM conversations WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (user_id, after_id, batch_size)
+            ).fetchall()
+            for row in rows:
+                yield row[0], row[1] or ''
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+
+    def models(self, user_id: str) -> list:
+        rows = self._reader().execute(
+            "SELECT DISTINCT model FROM conversations WHERE user_id = ? AND model IS NOT NULL ORDER BY model",
+            (user_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def search(self, user_id: str, text: str, model: str = None, date_from: str = None,
+               date_to: str = None, limit: int = 20) -> list:
+        """Ranked full-text search over questions and responses with a highlighted snippet.
+
+        ``date_from`` and ``date_to`` are ISO date prefixes; ``date_to`` is inclusive.
+        """
+        query = build_fts_query(text)
+        if not query:
+            return []
+        where, params = _filter_clause(user_id, model, date_from, date_to, prefix="c.")
+
+        if not self.has_fts:
+            like = f"%{text.strip()}%"
+            rows = self._reader().execute(
+                "SELECT c.id, c.model, c.timestamp, c.question, substr(c.response, 1, 160) AS snippet "
+                f"FROM conversations c WHERE {where} AND (c.question LIKE ? OR c.response LIKE ?) "
+                "ORDER BY c.timestamp DESC LIMIT ?",
+                (*params, like, like, limit)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+        rows = self._reader().execute(
+            "SELECT c.id, c.model, c.timestamp, c.question, "
+            "snippet(conversations_fts, -1, ?, ?, '…', 16) AS snippet "
+            "FROM conversations_fts JOIN conversations c ON c.id = conversations_fts.rowid "
+            f"WHERE conversations_fts MATCH ? AND {where} "
+            "ORDER BY bm25(conversations_fts, 2.0, 1.0) LIMIT ?",
+            (HIGHLIGHT_START, HIGHLIGHT_END, query, *params, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def _add_columns(conn) -> None:
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(conversations)")}
+        for column, column_type in _ADDED_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE conversations ADD COLUMN {column} {column_type}")
+
+    @staticmethod
+    def _ensure_fts(conn) -> bool:
+        """Create the FTS5 index on first use; False if SQLite lacks FTS5"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'conversations_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            conn.executescript(_FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            print(f"Full-text search unavailable: {e}", file=sys.stderr)
+            return False
+        return True
+
+    def _reader(self) -> sqlite3.Connection:
+        # One read connection per thread; WAL lets reads run alongside the writer
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    @staticmethod
+    def _row(record, user_id, session_id):
+        return (
+            user_id, session_id, record.get('model'), record.get('timestamp'),
+            record.get('system_prompt', ''), record.get('context', ''),
+            record.get('question', ''), record.get('response', ''),
+            _json_field(record.get('settings')), _json_field(record.get('usage'))
+        )
+
+    def _write_loop(self, conn):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self._queue.get(timeout=BATCH_INTERVAL))
+            except queue.Empty:
+                pass
+            try:
+                conn.executemany(
+                    "INSERT INTO conversations "
+                    "(user_id, session_id, model, timestamp, system_prompt, context, question, response, "
+                    "settings, usage) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    batch
+                )
+                conn.commit()
+                HISTORY_SAVES.inc('ok', amount=len(batch))
+            except sqlite3.Error as e:
+                HISTORY_SAVES.inc('error', amount=len(batch))
+                print(f"Conversation store write failed: {e}", file=sys.stderr)
+            finally:
+                HISTORY_QUEUE_DEPTH.dec(amount=len(batch))
+                for _ in batch:
+                    self._queue.task_done()
+
+
+_store_lock = threading.Lock()
+_stores = {}
+
+
+def get_conversation_store(path: str = DEFAULT_DB_PATH) -> ConversationStore:
+    """Return the store shared by every session in this process"""
+    store = _stores.get(path)
+    if store is not None:
+        return store
+    with _store_lock:
+        if path not in _stores:
+            _stores[path] = ConversationStore(path)
+        return _stores[path]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Conversation store tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="Import a JSONL or zip export, or a JSON list of history dicts")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    import_parser.add_argument("--user", required=True, help="User id to file the conversations under")
+    import_parser.add_argument("--keep-duplicates", action="store_true",
+                               help="Import conversations that are already stored")
+    export_parser = commands.add_parser("export", help="Export a user's conversations")
+    export_parser.add_argument("file", help="Output path; the format follows the extension unless --format is given")
+    export_parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    export_parser.add_argument("--user", required=True)
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS)
+    export_parser.add_argument("--model")
+    export_parser.add_argument("--date-from", help="ISO date, inclusive")
+    export_parser.add_argument("--date-to", help="ISO date, inclusive")
+    args = parser.parse_args(argv)
+
+    store = get_conversation_store(args.db)
+    if args.command == "export":
+        records = store.iter_conversations(args.user, args.model, args.date_from, args.date_to)
+        with open(args.file, "wb") as handle:
+            count = write_export(records, handle, args.format or export_format(args.file))
+        print(f"Exported {count} conversations to {args.file}")
+        return 0
+
+    with open(args.file, "rb") as handle:
+        count = store.import_records(read_export(handle, args.file), args.user,
+                                     skip_existing=not args.keep_duplicates)
+    store.flush()
+    print(f"Imported {count} conversations into {args.db}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,391 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from latency_metrics import get_latency_stats, new_histogram
+from metrics import (
+    RATE_LIMIT_WAIT_SECONDS,
+    RATE_LIMIT_WAITING,
+    REQUESTS,
+    STREAMS_IN_FLIGHT,
+    STREAM_BYTES,
+    STREAM_PARSE_ERRORS,
+    TOKENS,
+    UPSTREAM_ERRORS,
+)
+from model_catalog import get_model_catalog
+from openrouter_api import (
+    OpenRouterError,
+    RATE_LIMIT,
+    STREAM_DROP,
+    UPSTREAM,
+    call_openrouter_api,
+    connect_time,
+    error_from_event,
+    error_from_exception,
+)
+from rate_limiter import WaitTicket, get_governor
+from resilience import (
+    DEFAULT_MAX_RETRIES,
+    FALLBACK_KINDS,
+    RETRYABLE_KINDS,
+    backoff_delay,
+    merge_usage,
+    model_chain,
+    resume_messages,
+)
+from sse_parser import SSEParser, iter_chat_chunks
+from usage_stats import build_usage, estimate_tokens
+
+DEFAULT_MAX_WORKERS = 32
+# Default number of models streamed at once in compare mode
+DEFAULT_COMPARE_CONCURRENCY = 4
+# Cancel generations nobody has polled for this long (closed tab, dead session)
+ABANDON_AFTER_SECONDS = 60.0
+
+_executor_lock = threading.Lock()
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Process-wide worker pool shared by every Streamlit session"""
+    global _executor
+    if _executor is not None:
+        return _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="openrouter-gen")
+        return _executor
+
+
+class GenerationJob:
+    """A streaming OpenRouter completion running on the worker pool.
+
+    The worker appends deltas to ``parts``; the script thread polls them with
+    ``read`` and can call ``cancel`` at any time, which closes the upstream
+    response so the provider stops generating. Transient failures are retried
+    with backoff and then passed down ``fallback_models``; ``attempts`` records
+    each failure and ``model`` the model that produced the answer. With
+    ``limits``, every attempt first waits its turn in the shared governor for
+    its API key and model (status ``queued``) without holding a worker: the
+    attempt is submitted to the pool only once the governor grants it.
+    """
+
+    def __init__(self, request: dict, meta: dict = None, fallback_models: tuple = (),
+                 max_retries: int = DEFAULT_MAX_RETRIES, limits: dict = None):
+        self.request = request
+        self.meta = meta or {}
+        self.fallback_models = fallback_models
+        self.max_retries = max_retries
+        self.limits = limits
+        self._governor = None
+        self._ticket = None
+        self._chain = model_chain(request['model'], fallback_models)
+        self._chain_index = 0
+        self._retries = 0
+        self._queued_at = None
+        self.on_finish = None
+        self.model = request.get('model')
+        self.attempts = []
+        self.resumes = 0
+        self.parts = []
+        self.status = 'pending'
+        self.error = None
+        self.error_kind = None
+        self.finish_reason = None
+        self.usage = None
+        self.parser = SSEParser()
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self.finished_at = None
+        self.connect_seconds = None
+        self.ttfb_seconds = None
+        self.chunk_gaps = new_histogram('chunk_gap')
+        self.last_polled = self.started_at
+        self._response = None
+        self._cancelled = threading.Event()
+        self._changed = threading.Condition()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ('done', 'cancelled', 'error')
+
+    def queue_position(self):
+        """``(requests ahead, estimated seconds)`` while waiting for the rate limiter, else None"""
+        governor, ticket = self._governor, self._ticket
+        if ticket is None:
+            return None
+        return governor.position(ticket)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def cancel(self) -> None:
+        """Stop the generation and close the upstream connection immediately"""
+        self._cancelled.set()
+        governor, ticket = self._governor, self._ticket
+        if ticket is not None:
+            # Ends the job through _on_turn(None) if it is still waiting for its turn
+            governor.withdraw(ticket)
+        response = self._response
+        if response is not None:
+            response.close()
+        self._notify()
+
+    def read(self, cursor: int, timeout: float = 0.1) -> list:
+        """Return deltas after ``cursor``, waiting up to ``timeout`` for new ones"""
+        self.last_polled = time.monotonic()
+        with self._changed:
+            if len(self.parts) <= cursor and not self.is_finished:
+                self._changed.wait(timeout)
+        return self.parts[cursor:]
+
+    def start(self) -> None:
+        """Queue the first attempt"""
+        self._schedule()
+
+    def _schedule(self) -> None:
+        """Queue the next attempt: in the governor with limits, else straight onto the worker pool"""
+        if self._cancelled.is_set():
+            self._finish('cancelled')
+            return
+        model = self.model = self._chain[self._chain_index]
+        if not self.limits:
+            get_executor().submit(self._attempt, None)
+            return
+        governor = get_governor(self.request['api_key'], model, self.limits.get('shared_path', ''))
+        governor.configure(self.limits['requests_per_minute'], self.limits['burst'],
+                           self.limits['max_concurrent'])
+        self._governor = governor
+        self._ticket = WaitTicket(self.meta.get('session_id', ''), self._on_turn)
+        self._queued_at = time.monotonic()
+        self.status = 'queued'
+        RATE_LIMIT_WAITING.inc(model)
+        governor.enqueue(self._ticket)
+
+    def _on_turn(self, lease) -> None:
+        """Governor callback: run the attempt holding ``lease``, or end the job if it was withdrawn"""
+        self._ticket = None
+        RATE_LIMIT_WAITING.dec(self.model)
+        RATE_LIMIT_WAIT_SECONDS.inc(self.model, amount=time.monotonic() - self._queued_at)
+        get_executor().submit(self._attempt, lease)
+
+    def _attempt(self, lease) -> None:
+        """One upstream attempt on the worker pool, then the next step: retry, fallback or finish"""
+        status = 'error'
+        retry_in = None
+        try:
+            if self._cancelled.is_set():
+                return
+            self.status = 'streaming'
+            # Time spent queued is not upstream latency
+            if self.ttfb_seconds is None:
+                self.started_at = time.monotonic()
+            # _stream releases the lease from here on
+            held, lease = lease, None
+            self._stream(self.model, held)
+            status = 'done'
+        except OpenRouterError as e:
+            if not self._cancelled.is_set():
+                retry_in = self._next_attempt(e)
+        except Exception as e:
+            # Anything else still has to end the job, or its session would poll it forever
+            self.error = f"Unexpected error while streaming: {e}"
+            self.error_kind = UPSTREAM
+        finally:
+            if lease is not None:
+                self._governor.release(lease)
+            if self._cancelled.is_set() or retry_in is None:
+                self._finish('cancelled' if self._cancelled.is_set() else status)
+            elif retry_in:
+                # Back off on a plain thread, not a worker; cancelling ends the wait at once
+                threading.Thread(target=self._retry_after, args=(retry_in,), name="openrouter-retry",
+                                 daemon=True).start()
+            else:
+                self._schedule()
+
+    def _retry_after(self, delay: float) -> None:
+        self._cancelled.wait(delay)
+        self._schedule()
+
+    def _next_attempt(self, e: OpenRouterError):
+        """Record a failed attempt and pick the next one: seconds to wait before it
+        (0 for the next fallback model), or None when the job has failed"""
+        model = self.model
+        UPSTREAM_ERRORS.inc(model, e.kind)
+        self.attempts.append({'model': model, 'kind': e.kind, 'error': str(e)})
+        if e.kind == RATE_LIMIT and e.retry_after and self._governor is not None:
+            # Hold back every session on this key and model, not just this request
+            self._governor.pause(e.retry_after)
+        if e.kind in RETRYABLE_KINDS and self._retries < self.max_retries:
+            delay = backoff_delay(self._retries, e.retry_after)
+            if delay is not None:
+                self._retries += 1
+                return delay
+        if e.kind in FALLBACK_KINDS and self._chain_index < len(self._chain) - 1:
+            self._chain_index += 1
+            self._retries = 0
+            return 0
+        self.error = str(e)
+        self.error_kind = e.kind
+        return None
+
+    def _stream(self, model: str, lease) -> None:
+        """Stream from upstream while holding the rate limiter ``lease``, which is always released"""
+        held_from = time.monotonic()
+        STREAMS_IN_FLIGHT.inc()
+        try:
+            self._stream_upstream(model)
+        finally:
+            STREAMS_IN_FLIGHT.dec()
+            if lease is not None:
+                self._governor.release(lease, time.monotonic() - held_from)
+
+    def _stream_upstream(self, model: str) -> None:
+        """Deltas extend ``parts``, so a retry after a drop resumes the same answer"""
+        messages = self.request['messages']
+        if self.parts:
+            messages = resume_messages(messages, self.text)
+            self.resumes += 1
+        self.parser.reset()
+        self.finish_reason = None
+        self._response = call_openrouter_api(**{**self.request, 'model': model, 'messages': messages})
+        if self.ttfb_seconds is None:
+            # Headers are in once the call returns
+            self.ttfb_seconds = time.monotonic() - self.started_at
+            self.connect_seconds = connect_time(self._response)
+        last_chunk_at = None
+        try:
+            if self._cancelled.is_set():
+                return
+            for chunk in iter_chat_chunks(self._response, self.parser):
+                if chunk['error']:
+                    raise error_from_event(chunk['error'], mid_stream=bool(self.parts))
+                if chunk['content']:
+                    now = time.monotonic()
+                    if self.first_token_at is None:
+                        self.first_token_at = now
+                    elif last_chunk_at is not None:
+                        self.chunk_gaps.record(now - last_chunk_at)
+                    last_chunk_at = now
+                    self.parts.append(chunk['content'])
+                    self._notify()
+                if chunk['finish_reason']:
+                    self.finish_reason = chunk['finish_reason']
+                if chunk['usage']:
+                    self.usage = merge_usage(self.usage, chunk['usage'])
+                if self._cancelled.is_set():
+                    return
+                if time.monotonic() - self.last_polled > ABANDON_AFTER_SECONDS:
+                    self._cancelled.set()
+                    return
+        except OpenRouterError:
+            raise
+        except Exception as e:
+            # Closing the response from cancel() also surfaces here; run() checks for that
+            raise error_from_exception(e, mid_stream=bool(self.parts))
+        finally:
+            self._response.close()
+        if not self.parser.is_done and self.finish_reason is None:
+            raise OpenRouterError(STREAM_DROP if self.parts else UPSTREAM,
+                                  "stream ended before the answer finished")
+
+    def timings(self) -> dict:
+        """Time to first token, total time and completion tokens for a finished job"""
+        end = self.finished_at or time.monotonic()
+        usage = self.usage or {}
+        return {
+            'ttft': self.first_token_at - self.started_at if self.first_token_at else None,
+            'total': end - self.started_at,
+            'completion_tokens': usage['completion_tokens'] if 'completion_tokens' in usage else estimate_tokens(self.text),
+            'is_estimate': 'completion_tokens' not in usage
+        }
+
+    def token_usage(self) -> dict:
+        """Prompt and completion tokens and cost, estimated locally when the stream did not report them"""
+        end = self.finished_at or time.monotonic()
+        return build_usage(self.model, self.request['messages'], self.text,
+                           self.usage, end - self.started_at, get_model_catalog().prices(self.model))
+
+    def _finish(self, status: str) -> None:
+        self.finished_at = time.monotonic()
+        try:
+            self._record_latency(status)
+            self._record_counters(status)
+        finally:
+            self.status = status
+            self._notify()
+            if self.on_finish is not None:
+                self.on_finish(self)
+
+    def _record_counters(self, status: str) -> None:
+        """Report the finished request to the Prometheus registry, once per request"""
+        model = self.model
+        REQUESTS.inc(model, status)
+        STREAM_BYTES.inc(model, amount=self.parser.bytes_received)
+        STREAM_PARSE_ERRORS.inc(model, amount=self.parser.parse_errors)
+        if status != 'error' or self.parts:
+            usage = self.token_usage()
+            TOKENS.inc(model, 'prompt', amount=usage['prompt_tokens'])
+            TOKENS.inc(model, 'completion', amount=usage['completion_tokens'])
+            TOKENS.inc(model, 'cached', amount=usage['cached_tokens'])
+
+    def _record_latency(self, status: str) -> None:
+        """Add this request's timings to the shared per-model histograms"""
+        stats = get_latency_stats()
+        model = self.model
+        stats.record(model, 'connect', self.connect_seconds)
+        stats.record(model, 'ttfb', self.ttfb_seconds)
+        if self.first_token_at is not None:
+            stats.record(model, 'ttft', self.first_token_at - self.started_at)
+        stats.merge(model, 'chunk_gap', self.chunk_gaps)
+        # Stopped or failed requests would skew durations and throughput
+        if status != 'done':
+            return
+        stats.record(model, 'total', self.finished_at - self.started_at)
+        if self.first_token_at is not None and self.finished_at > self.first_token_at:
+            completion_tokens = self.timings()['completion_tokens']
+            stats.record(model, 'tokens_per_second',
+                         completion_tokens / (self.finished_at - self.first_token_at))
+
+    def _notify(self) -> None:
+        with self._changed:
+            self._changed.notify_all()
+
+
+def start_generation(request: dict, meta: dict = None, fallback_models: tuple = (),
+                     max_retries: int = DEFAULT_MAX_RETRIES, limits: dict = None) -> GenerationJob:
+    """Queue a streaming completion and return its job"""
+    job = GenerationJob(request, meta, fallback_models, max_retries, limits)
+    job.start()
+    return job
+
+
+def start_comparison(request: dict, models: list, max_concurrency: int = DEFAULT_COMPARE_CONCURRENCY,
+                     max_retries: int = DEFAULT_MAX_RETRIES, limits: dict = None, meta: dict = None) -> dict:
+    """Fan one request out to several models; returns ``{model: job}``.
+
+    At most ``max_concurrency`` jobs run at once; each finished job starts the next one.
+    Each model is retried but never replaced by a fallback, which would defeat the comparison.
+    """
+    jobs = {
+        model: GenerationJob({**request, 'model': model}, {**(meta or {}), 'model': model},
+                             max_retries=max_retries, limits=limits)
+        for model in models
+    }
+    waiting = deque(jobs.values())
+    lock = threading.Lock()
+
+    def _start_next(_finished=None):
+        with lock:
+            job = waiting.popleft() if waiting else None
+        if job is not None:
+            job.start()
+
+    for job in jobs.values():
+        job.on_finish = _start_next
+    for _ in range(max(1, max_concurrency)):
+        _start_next()
+    return jobs
@@ -0,0 +1,150 @@
+"""Streaming export and import of conversation history.
+
+Exports consume any iterable of conversation dicts (ConversationStore.iter_conversations
+reads them from SQLite a batch at a time) and write each record as soon as it
+is read, so memory use stays flat however long the history is:
+
+- ``jsonl``: one JSON object per conversation, the lossless format
+- ``markdown``: a readable transcript, not meant to be imported again
+- ``zip``: the JSONL deflate-compressed, plus a manifest with the record count
+
+Imports read JSONL and zip exports line by line, and still accept the JSON
+list of dicts older versions exported.
+"""
+import json
+import os
+import zipfile
+from datetime import datetime
+
+# Format -> (MIME type, file extension)
+EXPORT_FORMATS = {
+    "jsonl": ("application/x-ndjson", ".jsonl"),
+    "markdown": ("text/markdown", ".md"),
+    "zip": ("application/zip", ".zip"),
+}
+EXPORT_FIELDS = ('id', 'timestamp', 'model', 'session_id', 'settings', 'usage',
+                 'system_prompt', 'context', 'question', 'response')
+ZIP_MEMBER = "conversations.jsonl"
+ZIP_MANIFEST = "manifest.json"
+
+
+def export_format(path: str) -> str:
+    """Format implied by a file name's extension; JSONL when it is not recognized"""
+    extension = os.path.splitext(path)[1].lower()
+    for name, (_mime, format_extension) in EXPORT_FORMATS.items():
+        if extension == format_extension or (name == "markdown" and extension == ".markdown"):
+            return name
+    return "jsonl"
+
+
+def export_filename(export_type: str, now: datetime = None) -> str:
+    timestamp = (now or datetime.now()).strftime("%Y%m%d_%H%M%S")
+    return f"conversation_history_{timestamp}{EXPORT_FORMATS[export_type][1]}"
+
+
+def _export_record(conv: dict) -> dict:
+    return {field: conv.get(field) for field in EXPORT_FIELDS if conv.get(field) not in (None, '')}
+
+
+def iter_jsonl(records):
+    """One JSON line per conversation"""
+    for conv in records:
+        yield json.dumps(_export_record(conv), ensure_ascii=False) + "\n"
+
+
+def _format_settings(settings: dict) -> str:
+    parts = []
+    if settings.get('temperature') is not None:
+        parts.append(f"temperature {settings['temperature']}")
+    if settings.get('max_tokens') is not None:
+        parts.append(f"max tokens {settings['max_tokens']}")
+    return " • ".join(parts)
+
+
+def iter_markdown(records):
+    """A Markdown section per conversation"""
+    yield f"# Conversation History\n\nExported {datetime.now().isoformat(timespec='seconds')}\n"
+    for conv in records:
+        heading = " • ".join(filter(None, (conv.get('timestamp'), conv.get('model'))))
+        yield f"\n---\n\n## {heading or 'Conversation'}\n\n"
+        settings = conv.get('settings')
+        if isinstance(settings, dict) and _format_settings(settings):
+            yield f"*Settings: {_format_settings(settings)}*\n\n"
+        if conv.get('system_prompt'):
+            yield f"**System prompt:** {conv['system_prompt']}\n\n"
+        if conv.get('context'):
+            yield "**Context:**\n\n" + "".join(f"> {line}\n" for line in conv['context'].splitlines()) + "\n"
+        yield f"### Question\n\n{conv.get('question') or ''}\n\n### Response\n\n{conv.get('response') or ''}\n"
+
+
+class _Counter:
+    """Counts records as an export generator consumes them"""
+
+    def __init__(self, records):
+        self.records = records
+        self.count = 0
+
+    def __iter__(self):
+        for conv in self.records:
+            self.count += 1
+            yield conv
+
+
+def write_export(records, handle, export_type: str = "jsonl") -> int:
+    """Stream conversations into a binary file object; returns how many were written"""
+    counter = _Counter(records)
+    if export_type == "zip":
+        with zipfile.ZipFile(handle, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(ZIP_MEMBER, "w") as member:
+                for line in iter_jsonl(counter):
+                    member.write(line.encode("utf-8"))
+            archive.writestr(ZIP_MANIFEST, json.dumps({
+                "format": "jsonl", "file": ZIP_MEMBER, "count": counter.count,
+                "exported_at": datetime.now().isoformat(timespec='seconds')
+            }, indent=2))
+        return counter.count
+
+    chunks = iter_markdown(counter) if export_type == "markdown" else iter_jsonl(counter)
+    for chunk in chunks:
+        handle.write(chunk.encode("utf-8"))
+    return counter.count
+
+
+def _iter_lines(stream):
+    # Binary lines, so the caller's file object is not wrapped (and closed) by a text reader
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"line {number}: {e}") from None
+        if isinstance(record, dict):
+            yield record
+
+
+def read_export(handle, name: str = ""):
+    """Yield conversation dicts from a binary file object holding a JSONL or zip export,
+    or an old JSON list; raises ValueError for anything else"""
+    if zipfile.is_zipfile(handle):
+        handle.seek(0)
+        try:
+            with zipfile.ZipFile(handle) as archive:
+                members = [info.filename for info in archive.infolist() if info.filename.endswith(".jsonl")]
+                if not members:
+                    raise ValueError("zip export has no .jsonl file")
+                with archive.open(ZIP_MEMBER if ZIP_MEMBER in members else members[0]) as member:
+                    yield from _iter_lines(member)
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"damaged zip export: {e}") from None
+        return
+    handle.seek(0)
+    if name.lower().endswith(".json"):
+        # Older exports were a single JSON list, which has to be read whole
+        records = json.load(handle)
+        if not isinstance(records, list):
+            raise ValueError("expected a JSON list of conversations")
+        yield from (record for record in records if isinstance(record, dict))
+        return
+    yield from _iter_lines(handle)
@@ -0,0 +1,183 @@
+"""Background validation of OpenRouter API keys, cached per key.
+
+A check calls GET /key (the key's label, spend, limit and rate limit) and GET
+/credits (the account balance) on the shared pooled session, so it also opens
+the connection the first question will reuse. Results are cached by a hash of
+the key and the base URL, so reruns only read the cache: KEY_TTL_SECONDS for
+an accepted key, INVALID_TTL_SECONDS for a rejected one and ERROR_TTL_SECONDS
+when the check itself failed. The key itself is never stored.
+"""
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+
+import openrouter_api
+
+KEY_TTL_SECONDS = 10 * 60
+INVALID_TTL_SECONDS = 60 * 60
+ERROR_TTL_SECONDS = 30
+# Oldest results are dropped past this many keys
+MAX_CACHED_KEYS = 1024
+
+CHECKING = "checking"
+VALID = "valid"
+INVALID = "invalid"
+UNKNOWN = "unknown"  # the check failed, e.g. offline
+
+
+@dataclass(frozen=True)
+class KeyStatus:
+    """What OpenRouter reported about a key; amounts are USD, None when unknown or unlimited"""
+
+    state: str
+    label: str = None
+    usage: float = None
+    limit: float = None
+    limit_remaining: float = None
+    credits_remaining: float = None
+    is_free_tier: bool = None
+    rate_limit_requests: int = None
+    rate_limit_interval: str = None
+    error: str = None
+    checked_at: float = None
+
+
+def key_hash(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_message(response: requests.Response) -> str:
+    try:
+        return response.json()["error"]["message"]
+    except (ValueError, KeyError, TypeError):
+        return f"HTTP {response.status_code}"
+
+
+def fetch_key_status(api_key: str, base_url: str = None, pool_size: int = openrouter_api.DEFAULT_POOL_SIZE,
+                     timeout: float = openrouter_api.DEFAULT_CONNECT_TIMEOUT) -> KeyStatus:
+    """Ask OpenRouter about a key now; never raises"""
+    session = openrouter_api.get_http_session(pool_size)
+    base_url = base_url or openrouter_api.OPENROUTER_BASE_URL
+    headers = {"Authorization": f"Bearer {api_key}"}
+    try:
+        response = session.get(f"{base_url}/key", headers=headers, timeout=(timeout, timeout))
+    except requests.exceptions.RequestException as e:
+        return KeyStatus(UNKNOWN, error=str(e), checked_at=time.time())
+    if response.status_code in (401, 403):
+        return KeyStatus(INVALID, error=_error_message(response), checked_at=time.time())
+    if response.status_code != 200:
+        return KeyStatus(UNKNOWN, error=_error_message(response), checked_at=time.time())
+    try:
+        data = response.json().get("data") or {}
+    except ValueError:
+        return KeyStatus(UNKNOWN, error="unreadable /key response", checked_at=time.time())
+
+    # The account balance is optional extra information
+    credits_remaining = None
+    try:
+        credits = session.get(f"{base_url}/credits", headers=headers, timeout=(timeout, timeout))
+        if credits.status_code == 200:
+            balance = credits.json().get("data") or {}
+            total, used = _number(balance.get("total_credits")), _number(balance.get("total_usage"))
+            if total is not None and used is not None:
+                credits_remaining = total - used
+    except (requests.exceptions.RequestException, ValueError):
+        pass
+
+    rate_limit = data.get("rate_limit") or {}
+    return KeyStatus(
+        VALID,
+        label=data.get("label"),
+        usage=_number(data.get("usage")),
+        limit=_number(data.get("limit")),
+        limit_remaining=_number(data.get("limit_remaining")),
+        credits_remaining=credits_remaining,
+        is_free_tier=data.get("is_free_tier"),
+        rate_limit_requests=rate_limit.get("requests"),
+        rate_limit_interval=rate_limit.get("interval"),
+        checked_at=time.time(),
+    )
+
+
+class KeyValidator:
+    """Process-wide cache of key checks, each run once in a background thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+        self._pending = set()
+
+    def status(self, api_key: str, base_url: str = None):
+        """Last known status of the key, or None if it was never checked"""
+        cached = self._results.get((key_hash(api_key), base_url or openrouter_api.OPENROUTER_BASE_URL))
+        return cached[0] if cached else None
+
+    def check(self, api_key: str, base_url: str = None, pool_size: int = openrouter_api.DEFAULT_POOL_SIZE,
+              connect_timeout: float = openrouter_api.DEFAULT_CONNECT_TIMEOUT) -> KeyStatus:
+        """Cached status of the key; starts a background check when there is none or it expired,
+        returning the previous status (or CHECKING) meanwhile"""
+        cache_key = (key_hash(api_key), base_url or openrouter_api.OPENROUTER_BASE_URL)
+        with self._lock:
+            cached = self._results.get(cache_key)
+            if cached is not None and cached[1] > time.monotonic():
+                return cached[0]
+            current = cached[0] if cached is not None else KeyStatus(CHECKING)
+            if cache_key in self._pending:
+                return current
+            self._pending.add(cache_key)
+
+        def _check():
+            status = KeyStatus(UNKNOWN, error="check failed", checked_at=time.time())
+            try:
+                status = fetch_key_status(api_key, cache_key[1], pool_size, connect_timeout)
+            finally:
+                ttl = {VALID: KEY_TTL_SECONDS, INVALID: INVALID_TTL_SECONDS}.get(status.state, ERROR_TTL_SECONDS)
+                with self._lock:
+                    self._results.pop(cache_key, None)
+                    self._results[cache_key] = (status, time.monotonic() + ttl)
+                    while len(self._results) > MAX_CACHED_KEYS:
+                        del self._results[next(iter(self._results))]
+                    self._pending.discard(cache_key)
+
+        threading.Thread(target=_check, name="key-check", daemon=True).start()
+        return current
+
+
+_validator = KeyValidator()
+
+
+def get_key_validator() -> KeyValidator:
+    """Key check cache shared by every session in the process"""
+    return _validator
+
+
+def format_key_status(status: KeyStatus) -> str:
+    """One-line summary of a key check for the configuration area"""
+    if status.state == CHECKING:
+        return "⏳ Checking API key..."
+    if status.state == INVALID:
+        return f"❌ OpenRouter rejected this key: {status.error}"
+    if status.state == UNKNOWN:
+        return f"⚠️ Could not check the key: {status.error}"
+    parts = [f"✅ Key valid{f' ({status.label})' if status.label else ''}"]
+    if status.credits_remaining is not None:
+        parts.append(f"${status.credits_remaining:,.2f} credits left")
+    if status.limit is not None and status.limit_remaining is not None:
+        parts.append(f"${status.limit_remaining:,.2f} of ${status.limit:,.2f} key limit left")
+    elif status.usage is not None:
+        parts.append(f"${status.usage:,.2f} used")
+    if status.rate_limit_requests is not None:
+        parts.append(f"{status.rate_limit_requests} requests / {status.rate_limit_interval}")
+    if status.is_free_tier:
+        parts.append("free tier")
+    return " • ".join(parts)
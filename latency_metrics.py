@@ -0,0 +1,147 @@
+import math
+import threading
+
+# Relative error of a recorded value is at most 2 ** (1 / BUCKETS_PER_OCTAVE) - 1, about 9%
+BUCKETS_PER_OCTAVE = 8
+
+# Metric name -> (unit, smallest and largest value tracked); values outside are clamped
+METRICS = {
+    'connect': ('s', 1e-4, 600.0),
+    'ttfb': ('s', 1e-4, 600.0),
+    'ttft': ('s', 1e-4, 600.0),
+    'total': ('s', 1e-4, 3600.0),
+    'tokens_per_second': ('tok/s', 0.1, 100000.0),
+    'chunk_gap': ('s', 1e-5, 600.0),
+}
+PERCENTILES = (50, 95, 99)
+
+
+class LogHistogram:
+    """Fixed-memory histogram with logarithmic buckets, in the spirit of HdrHistogram.
+
+    Memory is one int per bucket no matter how many values are recorded, and
+    percentiles are accurate to the bucket width (about 9% with the defaults).
+    Not thread-safe; ``LatencyStats`` serializes access.
+    """
+
+    __slots__ = ('min_value', 'max_value', 'counts', 'count', 'total', 'lowest', 'highest', '_scale')
+
+    def __init__(self, min_value: float, max_value: float, buckets_per_octave: int = BUCKETS_PER_OCTAVE):
+        self.min_value = min_value
+        self.max_value = max_value
+        self._scale = buckets_per_octave / math.log(2)
+        # Bucket 0 holds everything at or below min_value
+        self.counts = [0] * (self._bucket(max_value) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.lowest = None
+        self.highest = None
+
+    def _bucket(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        return 1 + int(math.log(value / self.min_value) * self._scale)
+
+    def _bucket_value(self, index: int) -> float:
+        """Geometric midpoint of a bucket"""
+        if index == 0:
+            return self.min_value
+        return self.min_value * math.exp((index - 0.5) / self._scale)
+
+    def record(self, value: float) -> None:
+        value = min(max(value, 0.0), self.max_value)
+        self.counts[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.lowest is None or value < self.lowest:
+            self.lowest = value
+        if self.highest is None or value > self.highest:
+            self.highest = value
+
+    def merge(self, other: "LogHistogram") -> None:
+        """Add another histogram with the same bounds into this one"""
+        for index, bucket_count in enumerate(other.counts):
+            if bucket_count:
+                self.counts[index] += bucket_count
+        self.count += other.count
+        self.total += other.total
+        if other.lowest is not None and (self.lowest is None or other.lowest < self.lowest):
+            self.lowest = other.lowest
+        if other.highest is not None and (self.highest is None or other.highest > self.highest):
+            self.highest = other.highest
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent: float):
+        """Value at or below which ``percent`` of recorded values fall; None when empty"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(max(self._bucket_value(index), self.lowest), self.highest)
+        return self.highest
+
+
+def new_histogram(metric: str) -> LogHistogram:
+    _unit, min_value, max_value = METRICS[metric]
+    return LogHistogram(min_value, max_value)
+
+
+class LatencyStats:
+    """Process-wide latency histograms keyed by model and metric"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def record(self, model: str, metric: str, value: float) -> None:
+        if value is None:
+            return
+        with self._lock:
+            self._histogram(model, metric).record(value)
+
+    def merge(self, model: str, metric: str, histogram: LogHistogram) -> None:
+        """Fold a request-local histogram (such as its chunk gaps) into the shared one"""
+        if not histogram.count:
+            return
+        with self._lock:
+            self._histogram(model, metric).merge(histogram)
+
+    def _histogram(self, model: str, metric: str) -> LogHistogram:
+        key = (model, metric)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = new_histogram(metric)
+        return histogram
+
+    def models(self) -> list:
+        with self._lock:
+            return sorted({model for model, _metric in self._histograms})
+
+    def summary(self, model: str) -> list:
+        """Count, mean and percentiles of every recorded metric for one model"""
+        rows = []
+        with self._lock:
+            for metric, (unit, _min, _max) in METRICS.items():
+                histogram = self._histograms.get((model, metric))
+                if histogram is None or not histogram.count:
+                    continue
+                row = {'metric': metric, 'unit': unit, 'count': histogram.count,
+                       'sum': histogram.total, 'mean': histogram.mean}
+                for percent in PERCENTILES:
+                    row[f"p{percent}"] = histogram.percentile(percent)
+                rows.append(row)
+        return rows
+
+
+_stats = LatencyStats()
+
+
+def get_latency_stats() -> LatencyStats:
+    """Latency histograms shared by every Streamlit session in the process"""
+    return _stats
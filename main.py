@@ -1,9 +1,32 @@
 import streamlit as st
 import time
-import json
-import requests
 from datetime import datetime
 import os
+import hashlib
+import tempfile
+import uuid
+
+from conversation_record import ConversationHistory, content_hash
+from conversation_store import get_conversation_store
+from generation_jobs import start_generation, start_comparison
+from history_export import EXPORT_FORMATS, export_filename, read_export, write_export
+from key_validation import INVALID, format_key_status, get_key_validator
+from latency_metrics import get_latency_stats
+from metrics import start_exporters_from_env
+from context_retrieval import format_retrieval_report, select_context
+from context_window import ConversationContext, fixed_prompt_tokens, format_context_report, history_budget, prompt_room
+from model_catalog import MAIN_SCREEN_MODELS, get_model_catalog
+from openrouter_api import AUTH, OPENROUTER_BASE_URL, build_messages
+from prompt_cache import cache_breakpoints, prefix_length
+from resilience import ERROR_LABELS
+from response_cache import get_response_cache, make_cache_key, is_cacheable, iter_replay_chunks
+from session_settings import SessionSettings, get_settings, set_settings
+from similarity_index import SimilarityIndex, get_stored_index
+from stream_render import StreamRenderer
+from usage_stats import UsageStats, format_usage
+
+# Expose Prometheus metrics if CHAT_METRICS_PORT or CHAT_METRICS_FILE is set (once per process)
+start_exporters_from_env()
 
 # Page configuration with sidebar hidden by default
 st.set_page_config(
@@ -286,6 +309,18 @@ st.markdown("""
         font-size: 0.9rem;
         font-weight: 600;
     }
+    
+    /* Cached response badge */
+    .cached-badge {
+        display: inline-block;
+        background: #ffc107;
+        color: #000;
+        padding: 0.1rem 0.6rem;
+        border-radius: 12px;
+        font-size: 0.8rem;
+        font-weight: bold;
+        margin-bottom: 0.5rem;
+    }
 </style>
 """, unsafe_allow_html=True)
 
@@ -295,7 +330,7 @@ if 'dark_mode' not in st.session_state:
 if 'auto_save_enabled' not in st.session_state:
     st.session_state.auto_save_enabled = True
 if 'conversation_history' not in st.session_state:
-    st.session_state.conversation_history = []
+    st.session_state.conversation_history = ConversationHistory()
 if 'current_conversation' not in st.session_state:
     st.session_state.current_conversation = {
         'system_prompt': '',
@@ -304,26 +339,28 @@ if 'current_conversation' not in st.session_state:
         'response': '',
         'timestamp': None
     }
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if 'history_page' not in st.session_state:
+    st.session_state.history_page = 0
+if 'usage_stats' not in st.session_state:
+    st.session_state.usage_stats = UsageStats()
+if 'conversation_context' not in st.session_state:
+    st.session_state.conversation_context = ConversationContext()
+if 'context_files' not in st.session_state:
+    st.session_state.context_files = {}
 if 'mobile_detected' not in st.session_state:
     st.session_state.mobile_detected = False
 if 'sidebar_visible' not in st.session_state:
     st.session_state.sidebar_visible = False
 if 'settings_visible' not in st.session_state:
     st.session_state.settings_visible = False
+if 'analytics_visible' not in st.session_state:
+    st.session_state.analytics_visible = False
 
-# Standardized default settings
-DEFAULT_SETTINGS = {
-    'model': 'openai/gpt-3.5-turbo',
-    'temperature': 0.7,
-    'max_tokens': 1000,
-    'enable_streaming': True,
-    'save_conversation': True,
-    'auto_clear': False,
-    'show_tokens': True,
-    'api_key': '',
-    'system_prompt': 'You are a helpful AI assistant. You provide clear, concise, and accurate responses.',
-    'context': ''
-}
+# Per-session settings; the module-level defaults are read-only
+if 'settings' not in st.session_state:
+    st.session_state.settings = SessionSettings()
 
 # Auto-save functionality
 def auto_save_conversation():
@@ -339,13 +376,86 @@ def auto_save_conversation():
 # Enhanced error handling
 def show_error_message(message, duration=5):
     """Display error message as toast notification"""
+    # Never sleep here: it would block the script thread for every session error
     st.error(f"⚠️ {message}")
-    time.sleep(duration)
 
 def show_success_message(message, duration=3):
     """Display success message as toast notification"""
     st.success(f"✅ {message}")
 
+# Near-duplicate question lookup
+def get_similarity_index():
+    """Return the session's similarity index, built from history on first use"""
+    if 'similarity_index' not in st.session_state:
+        # Only record ids are indexed, and records leaving the history window leave the index
+        index = SimilarityIndex()
+        for record in st.session_state.conversation_history:
+            index.add(record.question, record.record_id)
+        st.session_state.conversation_history.on_evict = index.remove
+        st.session_state.similarity_index = index
+    return st.session_state.similarity_index
+
+def find_similar(question):
+    """Closest earlier answer to a near-duplicate question, from this session or the stored
+    history; returns (score, conversation dict) or None"""
+    threshold = get_settings().similarity_threshold
+    similar = get_similarity_index().query(question, threshold)
+    record = st.session_state.conversation_history.get(similar[1]) if similar else None
+    store = get_conversation_store(get_settings().history_db_path)
+    stored = get_stored_index(store.path, history_owner()).query(store, history_owner(), question, threshold)
+    if stored and (record is None or stored[0] > similar[0]):
+        conv = store.get(stored[1])
+        if conv is not None:
+            return stored[0], conv
+    return (similar[0], record.to_dict()) if record is not None else None
+
+def load_conversation(conv):
+    """Show an earlier conversation, keeping it in the session window (and index) so it is not saved again"""
+    history = st.session_state.conversation_history
+    history.max_entries = get_settings().history_window
+    record = history.append(conv)
+    if record is not None:
+        get_similarity_index().add(record.question, record.record_id)
+    st.session_state.current_conversation = conv
+
+# Persistent conversation history
+def history_owner():
+    """History is filed under the API key's hash, or the session when no key is set"""
+    api_key = get_settings().api_key
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return "session:" + st.session_state.session_id
+
+def record_conversation(conv):
+    """Persist a finished conversation and keep a bounded in-session window of recent ones"""
+    history = st.session_state.conversation_history
+    history.max_entries = get_settings().history_window
+    record = history.append(conv)
+    if record is None:
+        return
+    get_similarity_index().add(record.question, record.record_id)
+    get_conversation_store(get_settings().history_db_path).save(
+        conv, history_owner(), st.session_state.session_id
+    )
+
+def build_history_export(export_type, model=None, date_from=None, date_to=None):
+    """Stream the filtered history through a temporary file; returns (data, count) for one download"""
+    records = get_conversation_store(get_settings().history_db_path).iter_conversations(
+        history_owner(), model, date_from, date_to
+    )
+    # Records go to disk as they are read; the file is deleted as soon as it is closed
+    with tempfile.TemporaryFile() as handle:
+        count = write_export(records, handle, export_type)
+        handle.seek(0)
+        return handle.read(), count
+
+def minutes_since(timestamp):
+    """Whole minutes elapsed since an ISO timestamp"""
+    try:
+        return int((datetime.now() - datetime.fromisoformat(timestamp)).total_seconds() // 60)
+    except (TypeError, ValueError):
+        return None
+
 # Mobile detection (simplified)
 def detect_mobile():
     """Detect if user is on mobile device"""
@@ -391,29 +501,31 @@ with config_col1:
         "OpenRouter API Key",
         type="password",
         placeholder="Enter your OpenRouter API key...",
-        value=DEFAULT_SETTINGS['api_key'],
+        value=get_settings().api_key,
         help="Your OpenRouter API key (required for AI responses)"
     )
-    DEFAULT_SETTINGS['api_key'] = api_key
+    set_settings(api_key=api_key)
+    
+    # Check the key in the background as soon as it changes; the check also opens the pooled
+    # connection the first question reuses, and reruns only read the cached result
+    if api_key:
+        key_status = get_key_validator().check(api_key, get_settings().api_base_url,
+                                               get_settings().pool_size, get_settings().connect_timeout)
+        st.caption(format_key_status(key_status))
 
 with config_col2:
-    # Model Selection Dropdown
-    model_options = {
-        "openai/gpt-4o": "ChatGPT-4o (OpenAI)",
-        "openai/gpt-3.5-turbo": "ChatGPT-3.5 (OpenAI)",
-        "google/gemini-pro": "Gemini Pro (Google)",
-        "anthropic/claude-3.5-sonnet": "Claude Sonnet (Anthropic)",
-        "microsoft/copilot": "CoPilot (Microsoft)"
-    }
+    # Model Selection Dropdown; a model picked in Settings is added so it can stay selected
+    model_catalog = get_model_catalog()
+    model_options = model_catalog.options(MAIN_SCREEN_MODELS, include=get_settings().model)
     
     selected_model = st.selectbox(
         "Model",
         list(model_options.keys()),
-        index=list(model_options.keys()).index(DEFAULT_SETTINGS.get('model', 'openai/gpt-3.5-turbo')),
+        index=list(model_options.keys()).index(get_settings().model),
         format_func=lambda x: model_options[x],
         help="Select the AI model to use"
     )
-    DEFAULT_SETTINGS['model'] = selected_model
+    set_settings(model=selected_model)
 
 st.markdown("---")
 
@@ -421,8 +533,8 @@ st.markdown("---")
 st.markdown("### 💬 Ask Your Question")
 
 # Set default values for system_prompt and context (hidden from user)
-system_prompt = DEFAULT_SETTINGS.get('system_prompt', 'You are a helpful AI assistant. You provide clear, concise, and accurate responses.')
-context = DEFAULT_SETTINGS.get('context', '')
+system_prompt = get_settings().system_prompt
+context = get_settings().context
 
 question = st.text_area(
     "What would you like to know?",
@@ -432,6 +544,23 @@ question = st.text_area(
     help="Ask anything and get an AI response"
 )
 
+# Compare mode: send the same question to several models at once
+compare_mode = st.checkbox(
+    "🆚 Compare models",
+    key="compare_mode",
+    help="Stream the same question from several models side by side"
+)
+compare_models = []
+if compare_mode:
+    compare_models = st.multiselect(
+        "Models to compare",
+        list(model_options.keys()),
+        default=[get_settings().model],
+        format_func=lambda x: model_options[x],
+        key="compare_models",
+        help="Pick two or more models"
+    )
+
 # Submit button
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
@@ -439,7 +568,7 @@ with col2:
         "🚀 Send to AI",
         type="primary",
         use_container_width=True,
-        disabled=not question,
+        disabled=not question or (compare_mode and len(compare_models) < 2),
         help="Send your question to the AI"
     )
 
@@ -454,7 +583,7 @@ col2_1, col2_2, col2_3 = st.columns([2, 1, 1])
 with col2_1:
     st.markdown("**Response:**")
 with col2_2:
-    if submit_button:
+    if submit_button or st.session_state.get('active_job') is not None or st.session_state.get('compare_jobs'):
         st.markdown('<span class="streaming-indicator"></span> Streaming...', unsafe_allow_html=True)
     else:
         st.markdown("Ready")
@@ -463,110 +592,431 @@ with col2_3:
         st.session_state.current_conversation['response'] = ''
         st.rerun()
 
-# Real OpenRouter API Integration
-def call_openrouter_api(messages, model, temperature, max_tokens, api_key):
-    """Make API call to OpenRouter"""
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://localhost:8501",  # Streamlit default
-        "X-Title": "AI Chat Assistant"
+# Offer a previous answer to a near-duplicate question
+if st.session_state.get('pending_similar'):
+    pending = st.session_state.pending_similar
+    match = pending['match']
+    minutes = minutes_since(match.get('timestamp'))
+    when = f"{minutes} minutes ago" if minutes is not None else "earlier"
+    st.info(f"💡 A very similar question was answered {when} ({pending['score']:.0%} match): "
+            f"*{match.get('question', '')[:80]}*")
+    col_similar1, col_similar2 = st.columns(2)
+    with col_similar1:
+        if st.button("📋 Use previous answer", use_container_width=True, key="use_similar"):
+            load_conversation(match.copy())
+            st.session_state.conversation_context.add_turn(pending['question'], match.get('response', ''))
+            st.session_state.pending_similar = None
+            st.rerun()
+    with col_similar2:
+        if st.button("🚀 Send anyway", use_container_width=True, key="send_anyway"):
+            st.session_state.skip_similarity_for = pending['question']
+            st.session_state.pending_similar = None
+            submit_button = True
+
+def prompt_cache_breakpoints(messages, system_prompt, context, retrieval_report=None):
+    """Where providers that need cache hints may cache the prompt prefix, when enabled"""
+    if not get_settings().prompt_cache_hints:
+        return ()
+    # Retrieved excerpts differ from question to question, so only the system prompt before them is reusable
+    stable_count = prefix_length(system_prompt, '') if retrieval_report else None
+    return cache_breakpoints(messages, prefix_length(system_prompt, context), get_settings().prompt_cache_min_tokens,
+                             stable_count)
+
+def build_request(messages, model, breakpoints=()):
+    """Keyword arguments for call_openrouter_api from the current settings"""
+    return {
+        'messages': messages,
+        'model': model,
+        'temperature': get_settings().temperature,
+        'max_tokens': get_settings().max_tokens,
+        'api_key': get_settings().api_key,
+        'connect_timeout': get_settings().connect_timeout,
+        'first_byte_timeout': get_settings().first_byte_timeout,
+        'stream_idle_timeout': get_settings().stream_idle_timeout,
+        'pool_size': get_settings().pool_size,
+        'base_url': get_settings().api_base_url,
+        'cache_breakpoints': breakpoints
     }
-    
-    data = {
-        "model": model,
-        "messages": messages,
-        "temperature": temperature,
-        "max_tokens": max_tokens,
-        "stream": True
+
+def rejected_key_error():
+    """Why OpenRouter rejected the current key, if the background check found it invalid"""
+    status = get_key_validator().status(get_settings().api_key, get_settings().api_base_url)
+    return status.error if status is not None and status.state == INVALID else None
+
+def context_document(context):
+    """Pasted context followed by the text of any uploaded context files"""
+    parts = [context] if context and context.strip() else []
+    parts += [f"# {name}\n\n{text}" for name, text in st.session_state.context_files.items()]
+    return "\n\n".join(parts)
+
+def retrieve_context(system_prompt, context, question, models):
+    """The context to send: whole when it fits the budget, otherwise the chunks most relevant
+    to the question; returns (text, report)"""
+    document = context_document(context)
+    if not get_settings().context_retrieval or not document.strip():
+        return document, None
+    fixed_tokens = fixed_prompt_tokens(system_prompt, '', question)
+    budget = max(0, min([get_settings().context_token_budget] +
+                        [prompt_room(model, get_settings().max_tokens, fixed_tokens) for model in models]))
+    return select_context(document, question, budget, get_settings().context_top_k)
+
+def show_retrieval_report(report):
+    """Which context chunks were sent, with a preview of each"""
+    st.caption(format_retrieval_report(report))
+    if report['included']:
+        with st.expander("📄 Context chunks sent", expanded=False):
+            for chunk in report['included']:
+                st.caption(f"**#{chunk['number']}** • score {chunk['score']:.2f} • ~{chunk['tokens']} tokens — "
+                           f"{chunk['preview']}")
+
+def build_prompt(system_prompt, context, question, models):
+    """Messages with as much earlier conversation as fits every target model; returns (messages, report)"""
+    conversation = st.session_state.conversation_context
+    if not get_settings().include_history or not len(conversation):
+        return build_messages(system_prompt, context, question), None
+    fixed_tokens = fixed_prompt_tokens(system_prompt, context, question)
+    budget = min(history_budget(model, get_settings().max_tokens, fixed_tokens, get_settings().history_token_budget)
+                 for model in models)
+    history, report = conversation.history_messages(budget)
+    return build_messages(system_prompt, context, question, history), report
+
+def record_prompt_savings(retrieval_report, history_report):
+    """Count the prompt tokens retrieval and history trimming kept out of a request once it is sent"""
+    if retrieval_report:
+        st.session_state.usage_stats.record_context(retrieval_report)
+    if history_report:
+        st.session_state.usage_stats.record_history(history_report)
+
+def rate_limits():
+    """Client-side limits shared by every session using the same API key and model"""
+    return {
+        'requests_per_minute': get_settings().rate_limit_rpm,
+        'burst': get_settings().rate_limit_burst,
+        'max_concurrent': get_settings().max_concurrent_streams,
+        'shared_path': get_settings().rate_limit_shared_path
     }
+
+def format_queue_position(position):
+    """Waiting message for a request held back by the rate limiter"""
+    ahead, eta = position
+    return f"⏳ Waiting for capacity: {ahead} request(s) ahead, ~{eta:.0f}s"
+
+def format_job_metrics(metrics):
+    """One-line summary of a finished generation's timings"""
+    ttft = f"{metrics['ttft']:.2f}s" if metrics['ttft'] is not None else "n/a"
+    tokens = f"{'~' if metrics['is_estimate'] else ''}{metrics['completion_tokens']} tokens"
+    return f"⏱️ TTFT {ttft} • Total {metrics['total']:.2f}s • {tokens}"
+
+def describe_attempts(job):
+    """Caption listing the failed attempts a generation recovered from, or failed after"""
+    steps = [f"{ERROR_LABELS.get(attempt['kind'], attempt['kind'])} ({attempt['model']})"
+             for attempt in job.attempts]
+    text = f"🔁 {len(steps)} failed attempt(s): " + " → ".join(steps)
+    if job.resumes:
+        text += f" • resumed the answer {job.resumes} time(s)"
+    return text
+
+def show_usage(usage):
+    """Token and cost caption for a response when token display is enabled"""
+    if get_settings().show_tokens and usage:
+        st.caption(format_usage(usage))
+
+def render_comparison(results):
+    """Show finished compare-mode answers side by side"""
+    columns = st.columns(len(results))
+    for column, result in zip(columns, results):
+        with column:
+            st.markdown(f"**{model_catalog.label(result['model'])}**")
+            st.markdown(f"```\n{result['response']}\n```")
+            st.caption(format_job_metrics(result['metrics']))
+            show_usage(result.get('usage'))
+
+def stream_comparison(jobs):
+    """Stream several generations into their own columns; returns per-model results"""
+    if st.button("⏹️ Stop", key="stop_comparison", help="Stop all models and close their upstream requests"):
+        for job in jobs.values():
+            job.cancel()
     
-    try:
-        response = requests.post(url, headers=headers, json=data, stream=True)
-        response.raise_for_status()
-        return response
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"API Error: {str(e)}")
+    views = []
+    for column, (model, job) in zip(st.columns(len(jobs)), jobs.items()):
+        with column:
+            st.markdown(f"**{model_catalog.label(model)}**")
+            placeholder = st.empty()
+            show_loading(placeholder)
+            views.append({'model': model, 'job': job, 'renderer': new_renderer(placeholder),
+                          'metrics': st.empty(), 'cursor': 0, 'result': None})
+    status_placeholder = st.empty()
+    
+    started = time.monotonic()
+    last_status = 0.0
+    while True:
+        has_progress = False
+        for view in views:
+            if view['result'] is not None:
+                continue
+            job = view['job']
+            is_finished = job.is_finished
+            parts = job.read(view['cursor'], timeout=0)
+            for part in parts:
+                view['renderer'].write(part)
+            view['cursor'] += len(parts)
+            has_progress = has_progress or bool(parts)
+            if is_finished:
+                response_text = view['renderer'].finish()
+                if job.status == 'error':
+                    view['renderer'].placeholder.error(f"⚠️ {job.error}")
+                metrics = job.timings()
+                usage = job.token_usage()
+                st.session_state.usage_stats.record(usage)
+                caption = format_job_metrics(metrics)
+                if get_settings().show_tokens:
+                    caption += "  \n" + format_usage(usage)
+                view['metrics'].caption(caption)
+                view['result'] = {'model': view['model'], 'response': response_text,
+                                  'metrics': metrics, 'usage': usage}
+        if all(view['result'] is not None for view in views):
+            break
+        now = time.monotonic()
+        if now - last_status >= 0.5:
+            status_placeholder.caption(f"Comparing... {now - started:.0f}s")
+            for view in views:
+                position = view['job'].queue_position() if view['result'] is None else None
+                if position is not None:
+                    view['metrics'].caption(format_queue_position(position))
+                    view['was_queued'] = True
+                elif view.pop('was_queued', False):
+                    view['metrics'].empty()
+            last_status = now
+        if not has_progress:
+            time.sleep(0.02)
+    status_placeholder.caption(f"Wall clock {time.monotonic() - started:.2f}s for {len(views)} models")
+    return [view['result'] for view in views]
+
+def show_loading(placeholder):
+    """Show the skeleton loader in a response placeholder"""
+    with placeholder.container():
+        st.markdown("""
+        <div class="skeleton"></div>
+        <div class="skeleton"></div>
+        <div class="skeleton"></div>
+        """, unsafe_allow_html=True)
+
+def new_renderer(placeholder):
+    """Streaming renderer using the configured flush cadence"""
+    return StreamRenderer(
+        placeholder,
+        flush_interval_ms=get_settings().render_interval_ms,
+        flush_chars=get_settings().render_chunk_chars
+    )
+
+def complete_response(response_text, meta):
+    """Save a finished response to session state and apply post-response settings"""
+    st.session_state.current_conversation.update({
+        'system_prompt': meta['system_prompt'],
+        'context': meta['context'],
+        'question': meta['question'],
+        'response': response_text,
+        'timestamp': datetime.now().isoformat(),
+        'model': meta['model'],
+        'settings': meta.get('settings'),
+        'usage': meta.get('usage')
+    })
+    st.session_state.conversation_context.add_turn(meta['question'], response_text)
+    st.session_state.skip_similarity_for = None
+    
+    # Show success message
+    show_success_message("Response completed successfully!")
+    
+    # Auto-clear if enabled
+    if get_settings().auto_clear:
+        st.session_state.question = ''
+        st.rerun()
+
+def stream_generation(job):
+    """Render a background generation until it finishes or is stopped; returns the text"""
+    if st.button("⏹️ Stop", key="stop_generation", help="Stop generating and close the upstream request"):
+        job.cancel()
+    
+    response_placeholder = st.empty()
+    if not job.parts:
+        show_loading(response_placeholder)
+    renderer = new_renderer(response_placeholder)
+    status_placeholder = st.empty()
+    
+    cursor = 0
+    last_status = 0.0
+    while True:
+        # Read the status first so deltas that arrive with completion are not missed
+        is_finished = job.is_finished
+        parts = job.read(cursor, min(0.1, renderer.flush_interval or 0.1))
+        for part in parts:
+            renderer.write(part)
+        cursor += len(parts)
+        if is_finished:
+            break
+        # A stalled stream must not leave the buffered tail of the answer hidden
+        renderer.tick()
+        # Regular output lets Streamlit interrupt this loop when a widget such as Stop is clicked
+        now = time.monotonic()
+        if now - last_status >= 0.5:
+            position = job.queue_position()
+            if position is not None:
+                status_placeholder.caption(format_queue_position(position))
+            else:
+                status_placeholder.caption(f"Generating... {now - job.started_at:.0f}s")
+            last_status = now
+    status_placeholder.empty()
+    return renderer.finish()
 
 # Enhanced Response Content Area with real API integration
 if submit_button:
     try:
         # Validate inputs
-        if not DEFAULT_SETTINGS['api_key']:
+        if not get_settings().api_key:
             show_error_message("Please enter your OpenRouter API key in the Configuration section")
+        elif (rejected_reason := rejected_key_error()):
+            # A key the background check rejected fails here instead of after a round trip
+            show_error_message(f"OpenRouter rejected this API key: {rejected_reason}")
         elif not question:
             show_error_message("Please enter a question")
+        elif compare_mode:
+            # Fan the same messages out to every selected model
+            for job in (st.session_state.get('compare_jobs') or {}).values():
+                job.cancel()
+            sent_context, retrieval_report = retrieve_context(system_prompt, context, question, compare_models)
+            messages, history_report = build_prompt(system_prompt, sent_context, question, compare_models)
+            if retrieval_report:
+                show_retrieval_report(retrieval_report)
+            if history_report:
+                st.caption(format_context_report(history_report))
+            st.session_state.compare_results = None
+            st.session_state.compare_jobs = start_comparison(
+                build_request(messages, None,
+                              prompt_cache_breakpoints(messages, system_prompt, sent_context, retrieval_report)),
+                compare_models,
+                get_settings().compare_concurrency,
+                get_settings().max_retries,
+                rate_limits(),
+                {'session_id': st.session_state.session_id}
+            )
+            record_prompt_savings(retrieval_report, history_report)
         else:
-            # Prepare messages for API
-            messages = []
-            
-            # Add system prompt if provided
-            if system_prompt and system_prompt.strip():
-                messages.append({"role": "system", "content": system_prompt})
-            
-            # Add context if provided
-            if context and context.strip():
-                messages.append({"role": "user", "content": f"Context: {context}"})
+            sent_context, retrieval_report = retrieve_context(system_prompt, context, question, [get_settings().model])
+            messages, history_report = build_prompt(system_prompt, sent_context, question, [get_settings().model])
             
-            # Add user question
-            messages.append({"role": "user", "content": question})
-            
-            # Show loading indicator
-            response_placeholder = st.empty()
-            with response_placeholder.container():
-                st.markdown("""
-                <div class="skeleton"></div>
-                <div class="skeleton"></div>
-                <div class="skeleton"></div>
-                """, unsafe_allow_html=True)
-            
-            # Make API call
-            response = call_openrouter_api(
-                messages=messages,
-                model=DEFAULT_SETTINGS['model'],
-                temperature=DEFAULT_SETTINGS['temperature'],
-                max_tokens=DEFAULT_SETTINGS['max_tokens'],
-                api_key=DEFAULT_SETTINGS['api_key']
+            # Repeated deterministic prompts are served from the shared cache
+            cache = get_response_cache(get_settings().response_cache_path)
+            cache_key = make_cache_key(
+                get_settings().model, messages,
+                get_settings().temperature, get_settings().max_tokens
             )
+            use_cache = not get_settings().bypass_cache and is_cacheable(
+                get_settings().temperature, get_settings().cache_nondeterministic
+            )
+            cached = cache.get(cache_key) if use_cache else None
             
-            # Stream the response
-            response_text = ""
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        data = line[6:]  # Remove 'data: ' prefix
-                        if data == '[DONE]':
-                            break
-                        try:
-                            json_data = json.loads(data)
-                            if 'choices' in json_data and len(json_data['choices']) > 0:
-                                delta = json_data['choices'][0].get('delta', {})
-                                if 'content' in delta:
-                                    response_text += delta['content']
-                                    response_placeholder.markdown(f"```\n{response_text}\n```")
-                        except json.JSONDecodeError:
-                            continue
-            
-            # Save response to session state
-            st.session_state.current_conversation['response'] = response_text
+            # Offer an earlier answer to a near-duplicate question before paying for a new one
+            if (not cached and get_settings().suggest_similar
+                    and st.session_state.get('skip_similarity_for') != question):
+                similar = find_similar(question)
+                if similar:
+                    st.session_state.pending_similar = {
+                        'question': question,
+                        'score': similar[0],
+                        'match': similar[1]
+                    }
+                    st.rerun()
             
-            # Show success message
-            show_success_message("Response completed successfully!")
+            meta = {
+                'system_prompt': system_prompt,
+                'context': context,
+                'question': question,
+                'model': get_settings().model,
+                'settings': {'temperature': get_settings().temperature, 'max_tokens': get_settings().max_tokens},
+                'session_id': st.session_state.session_id,
+                'cache_key': cache_key if use_cache else None,
+                'history': history_report,
+                'retrieval': retrieval_report
+            }
             
-            # Auto-clear if enabled
-            if DEFAULT_SETTINGS['auto_clear']:
-                st.session_state.question = ''
-                st.rerun()
+            if cached:
+                st.markdown('<span class="cached-badge">⚡ Cached</span>', unsafe_allow_html=True)
+                
+                # Replay the stored answer through the normal display path
+                response_placeholder = st.empty()
+                renderer = new_renderer(response_placeholder)
+                for piece in iter_replay_chunks(cached['response']):
+                    renderer.write(piece)
+                st.session_state.usage_stats.record_cache_hit()
+                if retrieval_report:
+                    show_retrieval_report(retrieval_report)
+                if history_report:
+                    st.caption(format_context_report(history_report))
+                complete_response(renderer.finish(), meta)
+            else:
+                # A new question supersedes any generation still running for this session
+                if st.session_state.get('active_job') is not None:
+                    st.session_state.active_job.cancel()
+                
+                # Run the API call on the shared worker pool
+                st.session_state.active_job = start_generation(
+                    build_request(messages, get_settings().model,
+                                  prompt_cache_breakpoints(messages, system_prompt, sent_context, retrieval_report)), meta,
+                    fallback_models=get_settings().fallback_models if get_settings().enable_fallback else (),
+                    max_retries=get_settings().max_retries,
+                    limits=rate_limits()
+                )
+                record_prompt_savings(retrieval_report, history_report)
             
     except Exception as e:
         show_error_message(f"An error occurred: {str(e)}")
-else:
+
+# Attach to the session's comparison or generation; survives reruns until finished or stopped
+if st.session_state.get('compare_jobs'):
+    st.session_state.compare_results = stream_comparison(st.session_state.compare_jobs)
+    st.session_state.compare_jobs = None
+elif st.session_state.get('active_job') is not None:
+    job = st.session_state.active_job
+    response_text = stream_generation(job)
+    st.session_state.active_job = None
+    
+    if job.parser.parse_errors:
+        st.caption(f"⚠️ Skipped {job.parser.parse_errors} malformed stream event(s): {job.parser.last_error}")
+    if job.attempts:
+        st.caption(describe_attempts(job))
+    if job.model != job.meta['model'] and job.status != 'error':
+        st.info(f"↪️ {job.meta['model']} was unavailable; answered by fallback model {job.model}")
+    
+    # Partial output of a failed stream may still have been billed
+    if job.status != 'error' or job.parts:
+        job.meta['usage'] = job.token_usage()
+        st.session_state.usage_stats.record(job.meta['usage'])
+        show_usage(job.meta['usage'])
+    if job.meta.get('retrieval'):
+        show_retrieval_report(job.meta['retrieval'])
+    if job.meta.get('history'):
+        st.caption(format_context_report(job.meta['history']))
+    
+    if job.status == 'error':
+        label = ERROR_LABELS.get(job.error_kind, "An error occurred")
+        hint = " Check your OpenRouter API key and credits." if job.error_kind == AUTH else ""
+        show_error_message(f"{label}: {job.error}{hint}")
+    else:
+        if job.status == 'cancelled':
+            st.info("⏹️ Generation stopped")
+        elif job.meta.get('cache_key') and job.model == job.meta['model']:
+            # A fallback model's answer is not cached under the selected model's key
+            get_response_cache(get_settings().response_cache_path).put(
+                job.meta['cache_key'], response_text, job.meta['model']
+            )
+        complete_response(response_text, {**job.meta, 'model': job.model})
+elif not submit_button:
     # Show placeholder with better guidance
-    if st.session_state.current_conversation.get('response'):
+    if compare_mode and st.session_state.get('compare_results'):
+        render_comparison(st.session_state.compare_results)
+    elif st.session_state.current_conversation.get('response'):
         st.markdown(f"```\n{st.session_state.current_conversation['response']}\n```")
+        show_usage(st.session_state.current_conversation.get('usage'))
     else:
         st.markdown("""
         ```
@@ -601,41 +1051,150 @@ with col2_4:
         st.rerun()
 
 with col2_5:
-    if st.button("💾 Export", type="secondary", use_container_width=True,
-                help="Export response as text file"):
-        if st.session_state.current_conversation.get('response'):
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"ai_response_{timestamp}.txt"
-            st.download_button(
-                label="Download",
-                data=st.session_state.current_conversation['response'],
-                file_name=filename,
-                mime="text/plain"
-            )
-        else:
-            show_error_message("No response to export")
+    # A single click downloads; the file name is part of the widget id, so it follows
+    # the response's timestamp rather than the clock
+    response_time = st.session_state.current_conversation.get('timestamp') or ''
+    st.download_button(
+        "💾 Export",
+        data=st.session_state.current_conversation.get('response') or '',
+        file_name=f"ai_response_{response_time[:19].replace('-', '').replace(':', '').replace('T', '_')}.txt",
+        mime="text/plain",
+        type="secondary",
+        use_container_width=True,
+        help="Export response as text file",
+        disabled=not st.session_state.current_conversation.get('response')
+    )
 
 with col2_6:
     if st.button("📊 Analytics", type="secondary", use_container_width=True,
                 help="View usage analytics"):
-        st.info("Analytics feature coming soon!")
+        st.session_state.analytics_visible = not st.session_state.analytics_visible
+
+# Latency percentiles per model, across every session in this process
+if st.session_state.analytics_visible:
+    st.markdown("### 📊 Latency Analytics")
+    latency_stats = get_latency_stats()
+    analytics_models = latency_stats.models()
+    if not analytics_models:
+        st.info("No timings yet. Send a message to start collecting latency data.")
+    for analytics_model in analytics_models:
+        st.markdown(f"**{analytics_model}**")
+        rows = []
+        for row in latency_stats.summary(analytics_model):
+            # Durations read best in milliseconds
+            scale, unit = (1000, "ms") if row['unit'] == 's' else (1, row['unit'])
+            rows.append({
+                'Metric': row['metric'],
+                'Unit': unit,
+                'Count': row['count'],
+                'p50': round(row['p50'] * scale, 1),
+                'p95': round(row['p95'] * scale, 1),
+                'p99': round(row['p99'] * scale, 1),
+                'Mean': round(row['mean'] * scale, 1)
+            })
+        st.dataframe(rows, hide_index=True, use_container_width=True)
 
 # Enhanced Conversation History with better organization
 with st.expander("📚 Conversation History", expanded=False):
-    if st.session_state.conversation_history:
-        for i, conv in enumerate(reversed(st.session_state.conversation_history[-10:])):  # Show last 10
+    history_store = get_conversation_store(get_settings().history_db_path)
+    
+    # Full-text search over every stored question and response
+    search_text = st.text_input("🔍 Search history", key="history_search",
+                                placeholder="Search questions and responses...")
+    col_filter1, col_filter2 = st.columns(2)
+    with col_filter1:
+        search_model = st.selectbox("Model", ["All models"] + history_store.models(history_owner()),
+                                    key="history_search_model")
+    with col_filter2:
+        search_dates = st.date_input("Date range", value=(), key="history_search_dates")
+    
+    # The model and date filters apply to search and to exports
+    filter_model = None if search_model == "All models" else search_model
+    date_from = search_dates[0].isoformat() if len(search_dates) > 0 else None
+    date_to = search_dates[-1].isoformat() if len(search_dates) > 0 else None
+    
+    if search_text.strip():
+        results = history_store.search(
+            history_owner(), search_text, model=filter_model, date_from=date_from, date_to=date_to
+        )
+        if not results:
+            st.info("No matching conversations.")
+        for result in results:
             with st.container():
-                col_hist1, col_hist2, col_hist3 = st.columns([3, 1, 1])
-                with col_hist1:
-                    st.markdown(f"**{conv.get('question', 'No question')[:50]}...**")
-                with col_hist2:
-                    st.markdown(f"*{conv.get('timestamp', 'Unknown')[:10]}*")
-                with col_hist3:
-                    if st.button("Load", key=f"load_{i}"):
-                        st.session_state.current_conversation = conv
+                col_result1, col_result2 = st.columns([4, 1])
+                with col_result1:
+                    st.markdown(f"**{(result.get('question') or 'No question')[:80]}**")
+                    st.markdown(result['snippet'])
+                    st.caption(f"{result.get('model') or 'Unknown model'} • {(result.get('timestamp') or 'Unknown')[:10]}")
+                with col_result2:
+                    if st.button("Load", key=f"search_load_{result['id']}"):
+                        load_conversation(history_store.get(result['id']))
                         st.rerun()
     else:
-        st.info("No conversation history yet. Start chatting to build your history!")
+        # Only the visible page is read from the store
+        page_size = get_settings().history_page_size
+        history_total = history_store.count(history_owner())
+        page_count = max(1, -(-history_total // page_size))
+        st.session_state.history_page = min(st.session_state.history_page, page_count - 1)
+        history_page = history_store.page(history_owner(), page_size, st.session_state.history_page * page_size)
+        if history_page:
+            for conv in history_page:
+                with st.container():
+                    col_hist1, col_hist2, col_hist3 = st.columns([3, 1, 1])
+                    with col_hist1:
+                        st.markdown(f"**{(conv.get('question') or 'No question')[:50]}...**")
+                    with col_hist2:
+                        st.markdown(f"*{(conv.get('timestamp') or 'Unknown')[:10]}*")
+                    with col_hist3:
+                        if st.button("Load", key=f"load_{conv['id']}"):
+                            load_conversation(conv)
+                            st.rerun()
+        
+            col_page1, col_page2, col_page3 = st.columns([1, 2, 1])
+            with col_page1:
+                if st.button("◀ Newer", key="history_newer", disabled=st.session_state.history_page == 0):
+                    st.session_state.history_page -= 1
+                    st.rerun()
+            with col_page2:
+                st.caption(f"Page {st.session_state.history_page + 1} of {page_count} • {history_total:,} conversations")
+            with col_page3:
+                if st.button("Older ▶", key="history_older",
+                             disabled=st.session_state.history_page >= page_count - 1):
+                    st.session_state.history_page += 1
+                    st.rerun()
+        else:
+            st.info("No conversation history yet. Start chatting to build your history!")
+    
+    # Bulk export of the whole history, narrowed by the model and date filters above
+    st.markdown("#### 📦 Export & Import")
+    col_export1, col_export2 = st.columns([2, 1])
+    with col_export1:
+        export_type = st.selectbox("Export format", list(EXPORT_FORMATS), index=list(EXPORT_FORMATS).index("zip"),
+                                   key="history_export_format",
+                                   format_func={'jsonl': "JSONL", 'markdown': "Markdown", 'zip': "JSONL (zip)"}.get)
+    with col_export2:
+        prepare_export = st.button("Prepare export", key="history_export_build", use_container_width=True,
+                                   help="Export every conversation matching the model and date filters")
+    if prepare_export:
+        # Offered in this run only, so later reruns never read or hold the export again
+        export_data, export_count = build_history_export(export_type, filter_model, date_from, date_to)
+        st.download_button(f"⬇️ Download {export_count:,} conversations", data=export_data,
+                           file_name=export_filename(export_type), mime=EXPORT_FORMATS[export_type][0],
+                           key="history_export_download", use_container_width=True)
+    
+    uploaded_export = st.file_uploader("Import an export", type=["zip", "jsonl", "json"], key="history_import_file")
+    if uploaded_export is not None and st.button("📥 Import", key="history_import"):
+        try:
+            # Records are read line by line and written in chunks; ones already stored are skipped
+            imported = history_store.import_records(
+                read_export(uploaded_export, uploaded_export.name), history_owner(),
+                st.session_state.session_id, skip_existing=True
+            )
+        except ValueError as e:
+            show_error_message(f"Could not import {uploaded_export.name}: {e}")
+        else:
+            history_store.flush()
+            show_success_message(f"Imported {imported:,} conversations")
 
 # Enhanced Footer with more information
 st.markdown("---")
@@ -653,75 +1212,175 @@ if st.session_state.settings_visible:
         st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
         st.markdown("### ⚙️ Settings")
         
-        # AI Model (Advanced - Override main screen selection)
-        model_options_advanced = {
-            "openai/gpt-4o": "ChatGPT-4o (OpenAI)",
-            "openai/gpt-3.5-turbo": "ChatGPT-3.5 (OpenAI)", 
-            "google/gemini-pro": "Gemini Pro (Google)",
-            "anthropic/claude-3.5-sonnet": "Claude Sonnet (Anthropic)",
-            "microsoft/copilot": "CoPilot (Microsoft)",
-            "anthropic/claude-3-opus": "Claude Opus (Anthropic)",
-            "meta-llama/llama-3.1-8b": "Llama 3.1 (Meta)"
-        }
+        # AI Model (Advanced - Override main screen selection), from the full catalog
+        model_options_advanced = model_catalog.options(include=get_settings().model)
         
         model = st.selectbox(
             "AI Model (Advanced)",
             list(model_options_advanced.keys()),
-            index=list(model_options_advanced.keys()).index(DEFAULT_SETTINGS['model']),
+            index=list(model_options_advanced.keys()).index(get_settings().model),
             format_func=lambda x: model_options_advanced[x],
             help="Override the model selected on the main screen"
         )
-        DEFAULT_SETTINGS['model'] = model
+        set_settings(model=model)
+        
+        # Where the model list came from; it refreshes itself once a day
+        catalog_sources = {'live': "OpenRouter", 'snapshot': "a cached snapshot", 'bundled': "the built-in list"}
+        catalog_caption = f"{len(model_catalog)} models from {catalog_sources[model_catalog.source]}"
+        if model_catalog.fetched_at:
+            catalog_caption += f", updated {int((time.time() - model_catalog.fetched_at) // 60)} minutes ago"
+        st.caption(catalog_caption)
+        if st.button("🔄 Refresh Model List", use_container_width=True):
+            model_catalog.refresh_in_background(force=True)
+            show_success_message("Refreshing the model list in the background")
         
         # Temperature
         temperature = st.slider(
             "Temperature",
             min_value=0.0,
             max_value=2.0,
-            value=DEFAULT_SETTINGS['temperature'],
+            value=get_settings().temperature,
             step=0.1,
             help="Controls randomness in responses (0 = deterministic, 2 = very creative)"
         )
-        DEFAULT_SETTINGS['temperature'] = temperature
+        set_settings(temperature=temperature)
         
         # Max Tokens
         max_tokens = st.number_input(
             "Max Tokens",
             min_value=100,
             max_value=4000,
-            value=DEFAULT_SETTINGS['max_tokens'],
+            value=get_settings().max_tokens,
             step=100,
             help="Maximum response length in tokens"
         )
-        DEFAULT_SETTINGS['max_tokens'] = max_tokens
+        set_settings(max_tokens=max_tokens)
         
         # API Key
         api_key = st.text_input(
             "OpenRouter API Key",
             type="password",
             placeholder="sk-or-...",
-            value=DEFAULT_SETTINGS['api_key'],
+            value=get_settings().api_key,
             help="Your OpenRouter API key (required for AI responses)"
         )
-        DEFAULT_SETTINGS['api_key'] = api_key
+        set_settings(api_key=api_key)
+        
+        # API Base URL, e.g. a local mock_openrouter.py for load tests
+        api_base_url = st.text_input(
+            "API Base URL",
+            value=get_settings().api_base_url,
+            help="OpenRouter-compatible endpoint; run mock_openrouter.py and enter its URL to test without credits"
+        )
+        set_settings(api_base_url=api_base_url.strip().rstrip("/") or OPENROUTER_BASE_URL)
         
         # System Prompt (Advanced)
         system_prompt = st.text_area(
             "System Prompt (Advanced)",
-            value=DEFAULT_SETTINGS['system_prompt'],
+            value=get_settings().system_prompt,
             height=80,
             help="Define how the AI should behave and respond"
         )
-        DEFAULT_SETTINGS['system_prompt'] = system_prompt
+        set_settings(system_prompt=system_prompt)
         
         # Context (Advanced)
         context = st.text_area(
             "Context (Advanced)",
-            value=DEFAULT_SETTINGS['context'],
+            value=get_settings().context,
             height=60,
             help="Provide background information or previous conversation context"
         )
-        DEFAULT_SETTINGS['context'] = context
+        set_settings(context=context)
+        
+        # Long documents are chunked and indexed; only the chunks relevant to each question are sent
+        context_uploads = st.file_uploader(
+            "Context Files",
+            type=["txt", "md", "csv", "json", "py", "html", "xml", "log"],
+            accept_multiple_files=True,
+            help="Text files added to the context"
+        )
+        # Kept in session state, since the uploader forgets its files while settings are closed
+        if context_uploads:
+            st.session_state.context_files = {
+                upload.name: upload.getvalue().decode("utf-8", errors="replace") for upload in context_uploads
+            }
+        if st.session_state.context_files:
+            st.caption("📎 " + ", ".join(st.session_state.context_files))
+            if st.button("Remove Context Files", key="remove_context_files"):
+                st.session_state.context_files = {}
+                st.rerun()
+        col_retrieval1, col_retrieval2, col_retrieval3 = st.columns(3)
+        with col_retrieval1:
+            context_retrieval = st.checkbox(
+                "Relevant Chunks Only",
+                value=get_settings().context_retrieval,
+                help="Send only the context chunks that best match the question once the context exceeds its budget. "
+                     "The chunks change per question, so the context is then no longer prompt-cached"
+            )
+            set_settings(context_retrieval=context_retrieval)
+        with col_retrieval2:
+            context_token_budget = st.number_input(
+                "Context Token Budget",
+                min_value=100,
+                max_value=100000,
+                value=get_settings().context_token_budget,
+                step=500,
+                disabled=not context_retrieval,
+                help="Most prompt tokens spent on context; also limited by the model's context length"
+            )
+            set_settings(context_token_budget=context_token_budget)
+        with col_retrieval3:
+            context_top_k = st.number_input(
+                "Max Chunks",
+                min_value=1,
+                max_value=50,
+                value=get_settings().context_top_k,
+                disabled=not context_retrieval,
+                help="Most context chunks sent with a question"
+            )
+            set_settings(context_top_k=context_top_k)
+        
+        # Earlier turns of the conversation, within a token budget
+        col_history1, col_history2 = st.columns(2)
+        with col_history1:
+            include_history = st.checkbox(
+                "Include Conversation History",
+                value=get_settings().include_history,
+                help="Send earlier turns with each question; older turns are summarized to fit the budget"
+            )
+            set_settings(include_history=include_history)
+        with col_history2:
+            history_token_budget = st.number_input(
+                "History Token Budget",
+                min_value=0,
+                max_value=100000,
+                value=get_settings().history_token_budget,
+                step=500,
+                disabled=not include_history,
+                help="Most prompt tokens spent on earlier turns; also limited by the model's context length"
+            )
+            set_settings(history_token_budget=history_token_budget)
+        
+        # Prompt caching for long system prompts and context
+        col_cache1, col_cache2 = st.columns(2)
+        with col_cache1:
+            prompt_cache_hints = st.checkbox(
+                "Prompt Cache Hints",
+                value=get_settings().prompt_cache_hints,
+                help="Ask providers that need it (Anthropic) to cache the system prompt, context and earlier turns"
+            )
+            set_settings(prompt_cache_hints=prompt_cache_hints)
+        with col_cache2:
+            prompt_cache_min_tokens = st.number_input(
+                "Min Cached Prefix (tokens)",
+                min_value=0,
+                max_value=100000,
+                value=get_settings().prompt_cache_min_tokens,
+                step=256,
+                disabled=not prompt_cache_hints,
+                help="Only mark prefixes at least this long; shorter ones are not cached by the provider"
+            )
+            set_settings(prompt_cache_min_tokens=prompt_cache_min_tokens)
         
         st.markdown("---")
         
@@ -731,32 +1390,191 @@ if st.session_state.settings_visible:
         with col_settings1:
             enable_streaming = st.checkbox(
                 "Enable Streaming",
-                value=DEFAULT_SETTINGS['enable_streaming'],
+                value=get_settings().enable_streaming,
                 help="Show response as it's being generated"
             )
-            DEFAULT_SETTINGS['enable_streaming'] = enable_streaming
+            set_settings(enable_streaming=enable_streaming)
             
             save_conversation = st.checkbox(
                 "Save to History",
-                value=DEFAULT_SETTINGS['save_conversation'],
+                value=get_settings().save_conversation,
                 help="Automatically save conversations to history"
             )
-            DEFAULT_SETTINGS['save_conversation'] = save_conversation
+            set_settings(save_conversation=save_conversation)
         
         with col_settings2:
             auto_clear = st.checkbox(
                 "Auto-clear after response",
-                value=DEFAULT_SETTINGS['auto_clear'],
+                value=get_settings().auto_clear,
                 help="Clear input fields after receiving response"
             )
-            DEFAULT_SETTINGS['auto_clear'] = auto_clear
+            set_settings(auto_clear=auto_clear)
             
             show_tokens = st.checkbox(
                 "Show token usage",
-                value=DEFAULT_SETTINGS['show_tokens'],
+                value=get_settings().show_tokens,
                 help="Display token usage information"
             )
-            DEFAULT_SETTINGS['show_tokens'] = show_tokens
+            set_settings(show_tokens=show_tokens)
+        
+        # Streaming render cadence
+        render_interval_ms = st.slider(
+            "Render Interval (ms)",
+            min_value=0,
+            max_value=500,
+            value=get_settings().render_interval_ms,
+            step=10,
+            help="How often streamed text is pushed to the page (0 = every chunk)"
+        )
+        set_settings(render_interval_ms=render_interval_ms)
+        
+        # Response cache
+        bypass_cache = st.checkbox(
+            "Bypass response cache",
+            value=get_settings().bypass_cache,
+            help="Always send the question to OpenRouter, even if an identical request was answered before"
+        )
+        set_settings(bypass_cache=bypass_cache)
+        
+        cache_nondeterministic = st.checkbox(
+            "Cache non-zero temperature",
+            value=get_settings().cache_nondeterministic,
+            help="Also reuse answers for requests with temperature above 0"
+        )
+        set_settings(cache_nondeterministic=cache_nondeterministic)
+        
+        # Near-duplicate suggestions
+        suggest_similar = st.checkbox(
+            "Suggest similar past answers",
+            value=get_settings().suggest_similar,
+            help="Offer an earlier answer when a very similar question was already asked"
+        )
+        set_settings(suggest_similar=suggest_similar)
+        
+        similarity_threshold = st.slider(
+            "Similarity Threshold",
+            min_value=0.5,
+            max_value=1.0,
+            value=get_settings().similarity_threshold,
+            step=0.05,
+            help="How close a past question must be to be offered"
+        )
+        set_settings(similarity_threshold=similarity_threshold)
+        
+        # Compare mode
+        compare_concurrency = st.number_input(
+            "Compare Concurrency",
+            min_value=1,
+            max_value=8,
+            value=get_settings().compare_concurrency,
+            step=1,
+            help="How many models stream at the same time in compare mode"
+        )
+        set_settings(compare_concurrency=compare_concurrency)
+        
+        # Upstream failures
+        max_retries = st.number_input(
+            "Retries per Model",
+            min_value=0,
+            max_value=5,
+            value=get_settings().max_retries,
+            step=1,
+            help="Retries with backoff for rate limits, provider errors, timeouts and dropped streams"
+        )
+        set_settings(max_retries=max_retries)
+        
+        enable_fallback = st.checkbox(
+            "Fall back to other models",
+            value=get_settings().enable_fallback,
+            help="Try the fallback models in order when the selected model keeps failing"
+        )
+        set_settings(enable_fallback=enable_fallback)
+        
+        fallback_models = st.multiselect(
+            "Fallback Models",
+            list(model_options_advanced.keys()),
+            default=[model for model in get_settings().fallback_models if model in model_options_advanced],
+            format_func=lambda x: model_options_advanced[x],
+            disabled=not enable_fallback,
+            help="Tried in the order selected"
+        )
+        set_settings(fallback_models=tuple(fallback_models))
+        
+        # Client-side limits, shared by every session on the same API key and model
+        col_limits1, col_limits2, col_limits3 = st.columns(3)
+        with col_limits1:
+            rate_limit_rpm = st.number_input(
+                "Requests / Minute",
+                min_value=0,
+                max_value=10000,
+                value=get_settings().rate_limit_rpm,
+                step=10,
+                help="Requests per minute per API key and model (0 = no limit)"
+            )
+            set_settings(rate_limit_rpm=rate_limit_rpm)
+        with col_limits2:
+            rate_limit_burst = st.number_input(
+                "Burst",
+                min_value=1,
+                max_value=1000,
+                value=get_settings().rate_limit_burst,
+                step=1,
+                help="Requests allowed at once before the per-minute rate applies"
+            )
+            set_settings(rate_limit_burst=rate_limit_burst)
+        with col_limits3:
+            max_concurrent_streams = st.number_input(
+                "Max Concurrent Streams",
+                min_value=0,
+                max_value=100,
+                value=get_settings().max_concurrent_streams,
+                step=1,
+                help="Streams open at once per API key and model (0 = no limit)"
+            )
+            set_settings(max_concurrent_streams=max_concurrent_streams)
+        
+        # Connection pool and timeouts; defaults come from the OPENROUTER_* environment variables
+        col_conn1, col_conn2, col_conn3, col_conn4 = st.columns(4)
+        with col_conn1:
+            pool_size = st.number_input(
+                "Connection Pool Size",
+                min_value=1,
+                max_value=1000,
+                value=get_settings().pool_size,
+                step=1,
+                help="Keep-alive connections to OpenRouter; the pool is shared by every session in this process"
+            )
+            set_settings(pool_size=pool_size)
+        with col_conn2:
+            connect_timeout = st.number_input(
+                "Connect Timeout (s)",
+                min_value=0.5,
+                max_value=600.0,
+                value=float(get_settings().connect_timeout),
+                step=0.5,
+                help="Give up if a connection cannot be opened in this time"
+            )
+            set_settings(connect_timeout=connect_timeout)
+        with col_conn3:
+            first_byte_timeout = st.number_input(
+                "First Byte Timeout (s)",
+                min_value=1.0,
+                max_value=3600.0,
+                value=float(get_settings().first_byte_timeout),
+                step=5.0,
+                help="Give up if OpenRouter has not started answering in this time"
+            )
+            set_settings(first_byte_timeout=first_byte_timeout)
+        with col_conn4:
+            stream_idle_timeout = st.number_input(
+                "Stream Idle Timeout (s)",
+                min_value=1.0,
+                max_value=3600.0,
+                value=float(get_settings().stream_idle_timeout),
+                step=5.0,
+                help="Give up on a stream that sends nothing for this long"
+            )
+            set_settings(stream_idle_timeout=stream_idle_timeout)
         
         # Close settings button
         if st.button("✅ Close Settings", use_container_width=True):
@@ -780,6 +1598,7 @@ if st.session_state.sidebar_visible:
                 'response': '',
                 'timestamp': None
             }
+            st.session_state.conversation_context.clear()
             st.rerun()
         
         if st.button("📖 Load Template", use_container_width=True,
@@ -804,20 +1623,31 @@ if st.session_state.sidebar_visible:
         st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
         st.markdown("### 📊 Usage Stats")
         
-        # Simulate real usage stats
-        total_requests = len(st.session_state.conversation_history) + 1247
-        tokens_used = total_requests * 150  # Estimate
-        avg_response_time = 2.3
+        # Running totals for this session, updated as each request finishes
+        usage_stats = st.session_state.usage_stats
+        totals = usage_stats.totals
+        avg_seconds = totals.avg_seconds
         
-        st.metric("Total Requests", f"{total_requests:,}")
-        st.metric("Tokens Used", f"{tokens_used:,}")
-        st.metric("Avg Response Time", f"{avg_response_time}s")
+        st.metric("Total Requests", f"{totals.requests:,}")
+        st.metric("Tokens Used", f"{totals.total_tokens:,}",
+                  help=f"{totals.prompt_tokens:,} prompt + {totals.completion_tokens:,} completion")
+        st.metric("Cost", f"${totals.cost:.4f}")
+        st.metric("Avg Response Time", f"{avg_seconds:.1f}s" if avg_seconds is not None else "n/a")
+        st.caption(f"Avg {totals.avg_tokens:,.0f} tokens/request • {usage_stats.cache_hits} cache hits")
+        if usage_stats.history_tokens_saved:
+            st.caption(f"🧠 ~{usage_stats.history_tokens_saved:,} prompt tokens saved by trimming history")
+        if usage_stats.context_tokens_saved:
+            st.caption(f"📄 ~{usage_stats.context_tokens_saved:,} prompt tokens saved by context retrieval")
+        if totals.cached_tokens:
+            st.caption(f"♻️ {totals.cached_tokens:,} prompt tokens read from provider caches "
+                       f"({totals.cached_tokens / max(totals.prompt_tokens, 1):.0%} of prompt)")
+        if totals.estimated_requests:
+            st.caption(f"~ {totals.estimated_requests} request(s) estimated locally")
         
-        # Progress bar for daily usage
-        daily_limit = 1000
-        daily_usage = total_requests % daily_limit
-        st.progress(daily_usage / daily_limit)
-        st.caption(f"Daily usage: {daily_usage}/{daily_limit}")
+        # Per-model breakdown
+        for model, model_totals in sorted(usage_stats.by_model.items()):
+            st.caption(f"**{model}**: {model_totals.requests} req • {model_totals.total_tokens:,} tokens • "
+                       f"${model_totals.cost:.4f} • avg {model_totals.avg_tokens:,.0f} tokens")
         
         st.markdown('</div>', unsafe_allow_html=True)
         
@@ -855,6 +1685,7 @@ else:
     """, unsafe_allow_html=True)
 
 # Auto-save current conversation to history when response is received
+# Membership is a hash-set lookup, so this costs the same however long the history is
 if (st.session_state.current_conversation.get('response') and 
-    st.session_state.current_conversation not in st.session_state.conversation_history):
-    st.session_state.conversation_history.append(st.session_state.current_conversation.copy())
+    content_hash(st.session_state.current_conversation) not in st.session_state.conversation_history):
+    record_conversation(st.session_state.current_conversation.copy())
@@ -0,0 +1,249 @@
+"""Process-wide metrics in Prometheus text format.
+
+Counters and gauges are updated once per request (never per token) under a
+short lock. Latency summaries are read from the histograms in latency_metrics
+at scrape time. Expose them over HTTP on a local port or as a textfile for
+node_exporter's textfile collector by setting environment variables before
+starting the app:
+
+    CHAT_METRICS_PORT=9464 streamlit run main.py
+    CHAT_METRICS_FILE=/var/lib/node_exporter/chat.prom streamlit run main.py
+"""
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from latency_metrics import PERCENTILES, get_latency_stats
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_FILE_INTERVAL = 15.0
+
+# latency_metrics metric -> exported summary name
+LATENCY_SUMMARIES = {
+    'connect': ('chat_connect_seconds', "Time to open an upstream connection (0 when reused)"),
+    'ttfb': ('chat_time_to_first_byte_seconds', "Time until upstream response headers"),
+    'ttft': ('chat_time_to_first_token_seconds', "Time until the first content token"),
+    'total': ('chat_request_duration_seconds', "Duration of completed generations"),
+    'tokens_per_second': ('chat_tokens_per_second', "Completion tokens per second after the first token"),
+    'chunk_gap': ('chat_chunk_gap_seconds', "Gap between consecutive streamed chunks"),
+}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """A metric family: one value per combination of label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _add(self, labels: tuple, amount: float) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(tuple(labels), 0.0)
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        if amount:
+            self._add(labels, amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._add(labels, amount)
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self._add(labels, -amount)
+
+    def set(self, value: float, *labels) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class MetricsRegistry:
+    """Named metric families rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        lines.extend(_render_latency())
+        return "\n".join(lines) + "\n"
+
+
+def _render_latency() -> list:
+    """Per-model latency histograms as Prometheus summaries"""
+    stats = get_latency_stats()
+    rows = {metric: [] for metric in LATENCY_SUMMARIES}
+    for model in stats.models():
+        for row in stats.summary(model):
+            rows[row['metric']].append((model, row))
+    lines = []
+    for metric, (name, help_text) in LATENCY_SUMMARIES.items():
+        if not rows[metric]:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} summary")
+        for model, row in rows[metric]:
+            model_label = _escape(model)
+            for percent in PERCENTILES:
+                lines.append(f'{name}{{model="{model_label}",quantile="{percent / 100}"}} '
+                             f"{_format_value(row[f'p{percent}'])}")
+            lines.append(f'{name}_sum{{model="{model_label}"}} {_format_value(row["sum"])}')
+            lines.append(f'{name}_count{{model="{model_label}"}} {row["count"]}')
+    return lines
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter("chat_requests_total", "Finished chat completions by outcome", ("model", "status"))
+STREAMS_IN_FLIGHT = REGISTRY.gauge("chat_streams_in_flight", "Completions currently streaming from upstream")
+STREAM_BYTES = REGISTRY.counter("chat_stream_bytes_total", "Bytes received from upstream streams", ("model",))
+STREAM_PARSE_ERRORS = REGISTRY.counter("chat_stream_parse_errors_total", "Malformed stream events skipped", ("model",))
+UPSTREAM_ERRORS = REGISTRY.counter("chat_upstream_errors_total", "Failed upstream attempts by error kind, "
+                                   "including ones later retried or passed to a fallback model", ("model", "kind"))
+RATE_LIMIT_WAITING = REGISTRY.gauge("chat_rate_limit_waiting", "Requests queued by the client-side rate limiter",
+                                    ("model",))
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.counter("chat_rate_limit_wait_seconds_total",
+                                           "Time requests spent queued by the client-side rate limiter", ("model",))
+TOKENS = REGISTRY.counter("chat_tokens_total", "Tokens used, reported or estimated; "
+                          "cached prompt tokens are also counted as prompt", ("model", "kind"))
+CACHE_LOOKUPS = REGISTRY.counter("chat_response_cache_lookups_total", "Response cache lookups", ("result",))
+HISTORY_SAVES = REGISTRY.counter("chat_history_saves_total", "Conversations written to the history store", ("result",))
+HISTORY_QUEUE_DEPTH = REGISTRY.gauge("chat_history_queue_depth", "Conversations waiting for the history writer")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporter_lock = threading.Lock()
+_server = None
+_file_thread = None
+_env_checked = False
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics on a local port from a daemon thread; later calls return the running server"""
+    global _server
+    with _exporter_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
+
+
+def write_metrics_file(path: str) -> None:
+    """Atomically write the current metrics to ``path`` so a scraper never reads a partial file"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as handle:
+        handle.write(REGISTRY.render())
+    os.replace(temp_path, path)
+
+
+def start_metrics_file(path: str, interval: float = DEFAULT_FILE_INTERVAL) -> None:
+    """Rewrite the metrics file every ``interval`` seconds from a daemon thread"""
+    global _file_thread
+    with _exporter_lock:
+        if _file_thread is not None:
+            return
+
+        def _loop():
+            while True:
+                try:
+                    write_metrics_file(path)
+                except OSError:
+                    pass
+                time.sleep(interval)
+
+        _file_thread = threading.Thread(target=_loop, name="metrics-file", daemon=True)
+        _file_thread.start()
+
+
+def start_exporters_from_env() -> None:
+    """Start whichever exporters CHAT_METRICS_PORT / CHAT_METRICS_FILE ask for; runs once per process"""
+    global _env_checked
+    with _exporter_lock:
+        if _env_checked:
+            return
+        _env_checked = True
+    port = os.environ.get("CHAT_METRICS_PORT")
+    if port:
+        try:
+            start_metrics_server(int(port), os.environ.get("CHAT_METRICS_HOST", "127.0.0.1"))
+        except (OSError, ValueError) as e:
+            # Bad port, or another process (such as a second Streamlit worker) already owns it
+            print(f"Metrics server not started: {e}", file=sys.stderr)
+    path = os.environ.get("CHAT_METRICS_FILE")
+    if path:
+        start_metrics_file(path)
@@ -0,0 +1,233 @@
+"""Local stand-in for the OpenRouter chat completions API, for load tests.
+
+Streams OpenAI-style SSE chunks over chunked HTTP like the real endpoint, with
+a configurable first-token delay, token rate and chunk size, a final ``usage``
+payload, and optional injected failures. Point the app at it with the API Base
+URL setting (or OPENROUTER_BASE_URL) and any API key:
+
+    python mock_openrouter.py --port 8765 --tokens-per-second 50 --first-token-delay 0.3
+    python mock_openrouter.py --port 8765 --error-rate 0.2 --errors 429 500 drop
+
+Also serves ``GET /models`` for the model catalog, ``GET /key`` and ``GET
+/credits`` for key checks (keys containing "invalid" are rejected), and ``GET
+/stats`` with the server's CPU time and streamed token count.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from model_catalog import BUNDLED_MODELS
+from usage_stats import estimate_prompt_tokens
+
+ERROR_KINDS = ("429", "500", "502", "503", "drop")
+WORDS = ("the", "stream", "model", "answer", "token", "latency", "cache", "of", "a", "request",
+         "python", "server", "chunk", "and", "to", "is", "for", "with", "response", "data")
+
+
+@dataclass
+class MockConfig:
+    """How the mock answers; every request reads the current values"""
+
+    completion_tokens: int = 200
+    tokens_per_second: float = 0.0  # 0 streams as fast as possible
+    first_token_delay: float = 0.0
+    chunk_tokens: int = 1
+    error_rate: float = 0.0
+    errors: tuple = ("429", "500", "drop")
+    retry_after: float = 1.0
+    seed: int = None
+    rng: random.Random = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.rng is None:
+            self.rng = random.Random(self.seed)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_event(self, event: dict) -> None:
+        self._send_chunk(b"data: " + json.dumps(event).encode("utf-8") + b"\n\n")
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/models"):
+            self._send_json(200, {"data": [{
+                "id": model.id, "name": model.name, "context_length": model.context_length,
+                "pricing": {"prompt": str((model.prompt_price or 0) / 1e6),
+                            "completion": str((model.completion_price or 0) / 1e6)}
+            } for model in BUNDLED_MODELS]})
+        elif path.endswith("/key") or path.endswith("/credits"):
+            api_key = self.headers.get("Authorization", "").partition("Bearer ")[2]
+            if not api_key or "invalid" in api_key:
+                self._send_json(401, {"error": {"code": 401, "message": "No auth credentials found (mock)"}})
+            elif path.endswith("/key"):
+                self._send_json(200, {"data": {
+                    "label": f"{api_key[:8]}... (mock)", "usage": 0, "limit": None, "limit_remaining": None,
+                    "is_free_tier": False, "rate_limit": {"requests": 200, "interval": "10s"}
+                }})
+            else:
+                self._send_json(200, {"data": {"total_credits": 10.0, "total_usage": 0}})
+        elif path.endswith("/stats"):
+            self._send_json(200, self.server.stats())
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if not self.path.split("?")[0].endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        config = self.server.config
+        error = None
+        if config.errors and config.rng.random() < config.error_rate:
+            error = config.rng.choice(config.errors)
+        if error == "429":
+            self._send_json(429, {"error": {"code": 429, "message": "Rate limit exceeded (mock)"}},
+                            {"Retry-After": f"{config.retry_after:g}"})
+            return
+        if error in ("500", "502", "503"):
+            self._send_json(int(error), {"error": {"code": int(error), "message": "Provider error (mock)"}})
+            return
+        self._stream(body, config, drop=error == "drop")
+
+    def _stream(self, body: dict, config: MockConfig, drop: bool) -> None:
+        try:
+            self._write_stream(body, config, drop)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, as Stop and the benchmarks' cancellations do
+            self.close_connection = True
+
+    def _write_stream(self, body: dict, config: MockConfig, drop: bool) -> None:
+        model = body.get("model") or "mock/model"
+        completion_tokens = min(config.completion_tokens, int(body.get("max_tokens") or config.completion_tokens))
+        created = int(time.time())
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # OpenRouter sends keep-alive comments while the model warms up
+        self._send_chunk(b": OPENROUTER PROCESSING\n\n")
+        if config.first_token_delay:
+            time.sleep(config.first_token_delay)
+
+        interval = config.chunk_tokens / config.tokens_per_second if config.tokens_per_second else 0.0
+        next_send = time.monotonic()
+        sent = 0
+        # A dropped stream stops about halfway, without a terminating chunk
+        stop_at = completion_tokens // 2 if drop else completion_tokens
+        while sent < stop_at:
+            count = min(config.chunk_tokens, stop_at - sent)
+            text = "".join(" " + WORDS[(sent + i) % len(WORDS)] for i in range(count))
+            self._send_event({"id": "gen-mock", "object": "chat.completion.chunk", "created": created,
+                              "model": model, "choices": [{"index": 0, "delta": {"content": text},
+                                                           "finish_reason": None}]})
+            sent += count
+            self.server.add_tokens(count)
+            if interval:
+                next_send += interval
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        if drop:
+            self.close_connection = True
+            return
+
+        prompt_tokens = estimate_prompt_tokens(body.get("messages") or [])
+        self._send_event({"id": "gen-mock", "object": "chat.completion.chunk", "created": created,
+                          "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                          "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": sent,
+                                    "total_tokens": prompt_tokens + sent, "cost": 0}})
+        self._send_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class MockOpenRouter(ThreadingHTTPServer):
+    """The mock server; ``start`` serves it from a daemon thread"""
+
+    daemon_threads = True
+
+    def __init__(self, config: MockConfig = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _MockHandler)
+        self.config = config or MockConfig()
+        self._lock = threading.Lock()
+        self.tokens_streamed = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def add_tokens(self, count: int) -> None:
+        with self._lock:
+            self.tokens_streamed += count
+
+    def stats(self) -> dict:
+        """CPU time of the whole server process, so run it in its own process to measure it"""
+        return {"cpu_seconds": time.process_time(), "tokens_streamed": self.tokens_streamed}
+
+    def start(self) -> "MockOpenRouter":
+        threading.Thread(target=self.serve_forever, name="mock-openrouter", daemon=True).start()
+        return self
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765, help="0 picks a free port")
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="0 = unthrottled")
+    parser.add_argument("--first-token-delay", type=float, default=0.0, help="seconds")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="tokens per SSE event")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--errors", nargs="+", choices=ERROR_KINDS, default=["429", "500", "drop"])
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on 429")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    config = MockConfig(
+        completion_tokens=args.completion_tokens, tokens_per_second=args.tokens_per_second,
+        first_token_delay=args.first_token_delay, chunk_tokens=max(1, args.chunk_tokens),
+        error_rate=args.error_rate, errors=tuple(args.errors), retry_after=args.retry_after, seed=args.seed
+    )
+    server = MockOpenRouter(config, args.host, args.port)
+    # The first line tells a parent process where to connect
+    print(f"Mock OpenRouter listening on {server.base_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""Model list with context lengths and prices from OpenRouter's /models endpoint.
+
+The catalog is loaded once per process from a JSON snapshot on disk, or from
+the bundled defaults below when there is no snapshot, and refreshed from the
+API in a background thread once the snapshot is older than its TTL. Lookups
+read an immutable dict index that a refresh swaps out whole, so the script
+thread never waits on the network.
+"""
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+import requests
+
+import openrouter_api
+
+DEFAULT_CATALOG_PATH = os.environ.get("CHAT_MODEL_CATALOG", "models_cache.json")
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+# Wait this long before trying again after a failed refresh
+RETRY_SECONDS = 5 * 60
+FETCH_TIMEOUT = 10.0
+# Context length assumed for models the catalog does not know
+DEFAULT_CONTEXT_LENGTH = 8192
+
+
+@dataclass(frozen=True)
+class ModelInfo:
+    """One model; prices are USD per million tokens, None when unknown"""
+
+    id: str
+    name: str
+    context_length: int = DEFAULT_CONTEXT_LENGTH
+    prompt_price: float = None
+    completion_price: float = None
+
+
+# Shown on the main screen, in this order, with these labels
+FEATURED_MODELS = {
+    "openai/gpt-4o": "ChatGPT-4o (OpenAI)",
+    "openai/gpt-3.5-turbo": "ChatGPT-3.5 (OpenAI)",
+    "google/gemini-pro": "Gemini Pro (Google)",
+    "anthropic/claude-3.5-sonnet": "Claude Sonnet (Anthropic)",
+    "microsoft/copilot": "CoPilot (Microsoft)",
+    "anthropic/claude-3-opus": "Claude Opus (Anthropic)",
+    "meta-llama/llama-3.1-8b": "Llama 3.1 (Meta)",
+}
+MAIN_SCREEN_MODELS = tuple(FEATURED_MODELS)[:5]
+
+# Used offline until a snapshot has been fetched
+BUNDLED_MODELS = (
+    ModelInfo("openai/gpt-4o", "ChatGPT-4o (OpenAI)", 128000, 2.5, 10.0),
+    ModelInfo("openai/gpt-3.5-turbo", "ChatGPT-3.5 (OpenAI)", 16385, 0.5, 1.5),
+    ModelInfo("google/gemini-pro", "Gemini Pro (Google)", 32760, 0.5, 1.5),
+    ModelInfo("anthropic/claude-3.5-sonnet", "Claude Sonnet (Anthropic)", 200000, 3.0, 15.0),
+    ModelInfo("microsoft/copilot", "CoPilot (Microsoft)"),
+    ModelInfo("anthropic/claude-3-opus", "Claude Opus (Anthropic)", 200000, 15.0, 75.0),
+    ModelInfo("meta-llama/llama-3.1-8b", "Llama 3.1 (Meta)", 131072),
+)
+
+
+def _per_million(price):
+    """OpenRouter prices are USD per token, as strings; negative means variable"""
+    try:
+        value = float(price)
+    except (TypeError, ValueError):
+        return None
+    return value * 1e6 if value >= 0 else None
+
+
+def parse_models(payload: dict) -> list:
+    """ModelInfo entries from a /models response body"""
+    models = []
+    for entry in payload.get("data") or []:
+        if not isinstance(entry, dict) or not entry.get("id"):
+            continue
+        pricing = entry.get("pricing") or {}
+        models.append(ModelInfo(
+            id=entry["id"],
+            name=entry.get("name") or entry["id"],
+            context_length=int(entry.get("context_length") or DEFAULT_CONTEXT_LENGTH),
+            prompt_price=_per_million(pricing.get("prompt")),
+            completion_price=_per_million(pricing.get("completion")),
+        ))
+    return models
+
+
+def fetch_models(timeout: float = FETCH_TIMEOUT) -> list:
+    """Current model list from OpenRouter; no API key is needed"""
+    session = openrouter_api.get_http_session()
+    response = session.get(f"{openrouter_api.OPENROUTER_BASE_URL}/models", timeout=timeout)
+    response.raise_for_status()
+    models = parse_models(response.json())
+    if not models:
+        raise ValueError("empty model list")
+    return models
+
+
+class ModelCatalog:
+    """Process-wide model index, loaded once and refreshed in the background"""
+
+    def __init__(self, path: str = DEFAULT_CATALOG_PATH, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._next_attempt = 0.0
+        self.last_error = None
+        self._install(BUNDLED_MODELS, 0.0, 'bundled')
+        self._load_snapshot()
+
+    def _install(self, models, fetched_at: float, source: str) -> None:
+        # Built off to the side and swapped in with one assignment
+        self._index = {model.id: model for model in models}
+        self.fetched_at = fetched_at
+        self.source = source
+
+    def _load_snapshot(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as handle:
+                snapshot = json.load(handle)
+            models = [ModelInfo(**entry) for entry in snapshot["models"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if models:
+            self._install(models, float(snapshot.get("fetched_at") or 0.0), 'snapshot')
+
+    def _save_snapshot(self, models, fetched_at: float) -> None:
+        """Atomically replace the snapshot so another process never reads a partial file"""
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump({"fetched_at": fetched_at, "models": [asdict(model) for model in models]}, handle)
+        os.replace(temp_path, self.path)
+
+    @property
+    def is_stale(self) -> bool:
+        return time.time() - self.fetched_at > self.ttl_seconds
+
+    def refresh(self) -> bool:
+        """Fetch the list now; on failure the current index is kept"""
+        try:
+            models = fetch_models()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.last_error = str(e)
+            self._next_attempt = time.monotonic() + RETRY_SECONDS
+            return False
+        fetched_at = time.time()
+        self._install(models, fetched_at, 'live')
+        self.last_error = None
+        if self.path:
+            try:
+                self._save_snapshot(models, fetched_at)
+            except OSError:
+                pass
+        return True
+
+    def refresh_in_background(self, force: bool = False) -> bool:
+        """Start a refresh thread when the index is stale; returns whether one was started"""
+        with self._lock:
+            if self._refreshing or not (force or (self.is_stale and time.monotonic() >= self._next_attempt)):
+                return False
+            self._refreshing = True
+
+        def _refresh():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=_refresh, name="model-catalog-refresh", daemon=True).start()
+        return True
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, model_id: str) -> bool:
+        return model_id in self._index
+
+    def get(self, model_id: str):
+        return self._index.get(model_id)
+
+    def label(self, model_id: str) -> str:
+        if model_id in FEATURED_MODELS:
+            return FEATURED_MODELS[model_id]
+        model = self._index.get(model_id)
+        return model.name if model else model_id
+
+    def context_length(self, model_id: str) -> int:
+        model = self._index.get(model_id)
+        return model.context_length if model else DEFAULT_CONTEXT_LENGTH
+
+    def prices(self, model_id: str):
+        """(prompt, completion) USD per million tokens, or None when either is unknown"""
+        model = self._index.get(model_id)
+        if model is None or model.prompt_price is None or model.completion_price is None:
+            return None
+        return model.prompt_price, model.completion_price
+
+    def options(self, model_ids=None, include: str = None) -> dict:
+        """Model id -> label for a selector: the given ids (default: every model, featured
+        first) that the catalog knows, plus ``include`` so the current choice is never missing"""
+        index = self._index
+        if model_ids is None:
+            model_ids = [model_id for model_id in FEATURED_MODELS if model_id in index]
+            model_ids += sorted(model_id for model_id in index if model_id not in FEATURED_MODELS)
+        else:
+            model_ids = [model_id for model_id in model_ids if model_id in index]
+        if include and include not in model_ids:
+            model_ids.insert(0, include)
+        return {model_id: self.label(model_id) for model_id in model_ids}
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_model_catalog() -> ModelCatalog:
+    """Model catalog shared by every session in the process; starts a refresh when stale"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = ModelCatalog()
+    _catalog.refresh_in_background()
+    return _catalog
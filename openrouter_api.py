@@ -0,0 +1,273 @@
+import os
+import sys
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from prompt_cache import add_cache_hints, supports_cache_control
+
+# Point at a compatible server, such as mock_openrouter.py, to test without credits
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+DEFAULT_MODEL = "openai/gpt-3.5-turbo"
+DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant. You provide clear, concise, and accurate responses."
+
+
+
+def _env_number(name: str, default):
+    """``default``, unless the environment variable ``name`` holds a positive number of its type"""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        number = type(default)(value)
+    except ValueError:
+        number = None
+    if number is None or not number > 0:
+        print(f"Ignoring {name}={value!r}: expected a positive number", file=sys.stderr)
+        return default
+    return number
+
+
+# Connection pool and timeout defaults (seconds), e.g. OPENROUTER_CONNECT_TIMEOUT=10
+DEFAULT_POOL_SIZE = _env_number("OPENROUTER_POOL_SIZE", 20)
+DEFAULT_CONNECT_TIMEOUT = _env_number("OPENROUTER_CONNECT_TIMEOUT", 5.0)
+DEFAULT_FIRST_BYTE_TIMEOUT = _env_number("OPENROUTER_FIRST_BYTE_TIMEOUT", 60.0)
+DEFAULT_STREAM_IDLE_TIMEOUT = _env_number("OPENROUTER_STREAM_IDLE_TIMEOUT", 30.0)
+
+# Error kinds, by what a caller can do about them
+AUTH = "auth"                # bad key or no credits: fails the same on every model
+BAD_REQUEST = "bad_request"  # rejected for this model (unknown model, context too long)
+RATE_LIMIT = "rate_limit"
+UPSTREAM = "upstream"        # 5xx or a provider error event
+TIMEOUT = "timeout"
+NETWORK = "network"
+STREAM_DROP = "stream_drop"  # connection lost after the answer started
+
+
+class OpenRouterError(Exception):
+    """An upstream failure classified by ``kind``, with the server's Retry-After if it sent one"""
+
+    def __init__(self, kind: str, message: str, status: int = None, retry_after: float = None):
+        super().__init__(f"API Error: {message}")
+        self.kind = kind
+        self.status = status
+        self.retry_after = retry_after
+
+
+def classify_status(status: int) -> str:
+    if status in (401, 402, 403):
+        return AUTH
+    if status == 429:
+        return RATE_LIMIT
+    if status == 408 or status >= 500:
+        return UPSTREAM
+    return BAD_REQUEST
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def error_from_response(response: requests.Response) -> OpenRouterError:
+    """Classify a non-2xx response, using OpenRouter's error message when present"""
+    message = f"{response.status_code} {response.reason}"
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    # Proxies and some upstream failures send a plain string, or no object at all
+    error = body.get("error") if isinstance(body, dict) else None
+    detail = error.get("message") if isinstance(error, dict) else error
+    if detail:
+        message = f"{message}: {detail}"
+    return OpenRouterError(classify_status(response.status_code), message, response.status_code,
+                           parse_retry_after(response.headers.get("Retry-After")))
+
+
+def error_from_event(error, mid_stream: bool = False) -> OpenRouterError:
+    """Classify an error event sent inside the stream"""
+    if not isinstance(error, dict):
+        error = {"message": str(error)}
+    code = error.get("code")
+    kind = classify_status(code) if isinstance(code, int) else UPSTREAM
+    # A provider dying part way through an answer is resumable like a dropped connection
+    if mid_stream and kind == UPSTREAM:
+        kind = STREAM_DROP
+    return OpenRouterError(kind, error.get("message", str(error)), code if isinstance(code, int) else None)
+
+
+def error_from_exception(error: Exception, mid_stream: bool = False) -> OpenRouterError:
+    """Classify a transport exception raised while connecting or streaming"""
+    if mid_stream:
+        return OpenRouterError(STREAM_DROP, f"stream interrupted: {error}")
+    if isinstance(error, requests.exceptions.Timeout):
+        return OpenRouterError(TIMEOUT, str(error))
+    return OpenRouterError(NETWORK, str(error))
+
+class _ConnectTimer:
+    """Connection mixin that stamps each response with the time spent opening the connection.
+
+    Only the first response on a connection carries the connect cost; later
+    responses on the same keep-alive connection report 0.0.
+    """
+
+    _connect_seconds = 0.0
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        self._connect_seconds = time.perf_counter() - started
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        response.connect_seconds = self._connect_seconds
+        self._connect_seconds = 0.0
+        return response
+
+
+class _TimedHTTPConnection(_ConnectTimer, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_ConnectTimer, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Pooling adapter whose connections record their connect time"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+_session_lock = threading.Lock()
+_session = None
+_session_pool_size = None
+
+
+def get_http_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """Return the process-wide keep-alive session, shared by every Streamlit session"""
+    global _session, _session_pool_size
+    if _session is not None and _session_pool_size == pool_size:
+        return _session
+    with _session_lock:
+        if _session is not None and _session_pool_size == pool_size:
+            return _session
+        session = requests.Session()
+        adapter = TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        # Older sessions are left for in-flight streams to finish on
+        _session, _session_pool_size = session, pool_size
+        return session
+
+
+def _raw_connection(response: requests.Response):
+    raw = response.raw
+    return getattr(raw, "_connection", None) or getattr(raw, "connection", None)
+
+
+def connect_time(response: requests.Response):
+    """Seconds spent opening this response's connection: 0.0 when a pooled one was reused, None if unknown"""
+    return getattr(response.raw, "connect_seconds", None)
+
+
+def _set_read_timeout(response: requests.Response, seconds: float) -> None:
+    """Switch an open streaming response from the first-byte to the idle-stream timeout"""
+    connection = _raw_connection(response)
+    sock = getattr(connection, "sock", None)
+    if sock is None:
+        return
+    sock.settimeout(seconds)
+
+
+def build_messages(system_prompt, context, question, history=None):
+    """Prepare messages for API; ``history`` holds prior turns, placed after the fixed prefix"""
+    messages = []
+
+    # Add system prompt if provided
+    if system_prompt and system_prompt.strip():
+        messages.append({"role": "system", "content": system_prompt})
+
+    # Add context if provided
+    if context and context.strip():
+        messages.append({"role": "user", "content": f"Context: {context}"})
+
+    # Add earlier turns of the conversation
+    if history:
+        messages.extend(history)
+
+    # Add user question
+    messages.append({"role": "user", "content": question})
+    return messages
+
+
+def call_openrouter_api(messages, model, temperature, max_tokens, api_key,
+                        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                        first_byte_timeout=DEFAULT_FIRST_BYTE_TIMEOUT,
+                        stream_idle_timeout=DEFAULT_STREAM_IDLE_TIMEOUT,
+                        pool_size=DEFAULT_POOL_SIZE, cache_breakpoints=(), base_url=None):
+    """Make API call to OpenRouter"""
+    url = f"{base_url or OPENROUTER_BASE_URL}/chat/completions"
+
+    # Mark the reusable prefix for providers that only cache when asked
+    if cache_breakpoints and supports_cache_control(model):
+        messages = add_cache_hints(messages, cache_breakpoints)
+
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://localhost:8501",  # Streamlit default
+        "X-Title": "AI Chat Assistant"
+    }
+
+    data = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True,
+        # Ask for token counts and cost in the final stream chunk
+        "usage": {"include": True}
+    }
+
+    session = get_http_session(pool_size)
+    try:
+        response = session.post(url, headers=headers, json=data, stream=True,
+                                timeout=(connect_timeout, first_byte_timeout))
+    except requests.exceptions.RequestException as e:
+        raise error_from_exception(e)
+    if not response.ok:
+        # Reading the small error body also releases the pooled connection
+        error = error_from_response(response)
+        response.close()
+        raise error
+    _set_read_timeout(response, stream_idle_timeout)
+    return response
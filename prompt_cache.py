@@ -0,0 +1,44 @@
+from usage_stats import estimate_prompt_tokens
+
+# Providers that only cache a prompt prefix when asked with cache_control
+# breakpoints; OpenAI and DeepSeek models cache long prefixes automatically
+CACHE_CONTROL_PREFIXES = ("anthropic/",)
+# Anthropic does not cache prefixes shorter than this
+DEFAULT_MIN_CACHE_TOKENS = 1024
+# Anthropic accepts at most this many breakpoints per request
+MAX_BREAKPOINTS = 4
+
+
+def supports_cache_control(model: str) -> bool:
+    return bool(model) and model.startswith(CACHE_CONTROL_PREFIXES)
+
+
+def prefix_length(system_prompt: str, context: str) -> int:
+    """Number of fixed messages build_messages puts before the conversation"""
+    return sum(1 for text in (system_prompt, context) if text and text.strip())
+
+
+def cache_breakpoints(messages: list, prefix_count: int, min_tokens: int = DEFAULT_MIN_CACHE_TOKENS,
+                      stable_count: int = None) -> tuple:
+    """Indexes of messages that end a cacheable prefix: the fixed system/context
+    prefix and the earlier turns, each only once the prompt up to it is long enough.
+    With ``stable_count``, only the first that many messages repeat between questions,
+    such as when the context holds excerpts picked for each question"""
+    # The last message is the new question, which is never reused
+    candidates = {prefix_count - 1, len(messages) - 2}
+    if stable_count is not None:
+        candidates = {index for index in candidates if index < stable_count} | {stable_count - 1}
+    candidates = sorted(candidates)
+    return tuple(index for index in candidates
+                 if index >= 0 and estimate_prompt_tokens(messages[:index + 1]) >= min_tokens)[-MAX_BREAKPOINTS:]
+
+
+def add_cache_hints(messages: list, breakpoints) -> list:
+    """Copy of ``messages`` with a cache_control breakpoint after each given message"""
+    hinted = list(messages)
+    for index in breakpoints:
+        message = hinted[index]
+        hinted[index] = {**message, "content": [
+            {"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}
+        ]}
+    return hinted
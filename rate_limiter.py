@@ -0,0 +1,374 @@
+"""Client-side rate limiting and concurrency limits per API key and model.
+
+Every request waits its turn in a ``Governor`` before calling OpenRouter. A
+governor is a token bucket (requests per minute with a burst allowance) plus a
+cap on concurrent streams. Waiting sessions are served round-robin, so one
+busy session cannot starve the others. Waiters hold no thread: the governor's
+dispatcher thread grants turns one at a time and hands each lease to the
+waiter's callback, which only then submits work to the worker pool. The bucket and the in-flight count live
+in this process by default. With a shared SQLite path, several server
+processes on one host share them:
+
+    CHAT_RATE_LIMIT_DB=/tmp/chat-limits.db streamlit run main.py --server.port 8501
+    CHAT_RATE_LIMIT_DB=/tmp/chat-limits.db streamlit run main.py --server.port 8502
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_BURST = 10
+DEFAULT_MAX_CONCURRENT = 8
+DEFAULT_SHARED_PATH = os.environ.get("CHAT_RATE_LIMIT_DB", "")
+# Waiters re-check at least this often (other processes do not notify us)
+POLL_INTERVAL = 0.25
+# Slots held by a crashed process are reclaimed after this long
+LEASE_SECONDS = 600.0
+# Lease handed out when shared state is unavailable; no lease row has this id
+NO_LEASE = 0
+# Weight of the newest hold time in the running average used for ETAs
+HOLD_SMOOTHING = 0.2
+
+
+class LocalBackend:
+    """Token buckets and in-flight counts for this process only"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._in_flight = {}
+        self._paused_until = {}
+
+    def try_acquire(self, key: str, rate: float, burst: int, max_concurrent: int) -> tuple:
+        """Take a token and a slot: ``(lease, None)``, or ``(None, seconds until a token)``;
+        a wait of None means wait for a slot to free up"""
+        now = time.monotonic()
+        with self._lock:
+            if max_concurrent and self._in_flight.get(key, 0) >= max_concurrent:
+                return None, None
+            paused_until = self._paused_until.get(key, 0.0)
+            if now < paused_until:
+                return None, paused_until - now
+            if rate:
+                tokens, updated = self._buckets.get(key, (burst, now))
+                tokens = min(burst, tokens + (now - updated) * rate)
+                if tokens < 1:
+                    self._buckets[key] = (tokens, now)
+                    return None, (1 - tokens) / rate
+                self._buckets[key] = (tokens - 1, now)
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+            return key, None
+
+    def release(self, key: str, lease) -> None:
+        with self._lock:
+            self._in_flight[key] = max(0, self._in_flight.get(key, 0) - 1)
+
+    def pause(self, key: str, seconds: float) -> None:
+        """Hold every request for ``key`` back, such as after an upstream Retry-After"""
+        with self._lock:
+            self._paused_until[key] = max(self._paused_until.get(key, 0.0), time.monotonic() + seconds)
+
+    def snapshot(self, key: str, rate: float, burst: int) -> tuple:
+        """Tokens available now and streams in flight"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            return min(burst, tokens + (now - updated) * rate), self._in_flight.get(key, 0)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    paused_until REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS leases (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_leases_key ON leases(key, expires_at);
+"""
+
+
+class SQLiteBackend:
+    """Token buckets and leases in a SQLite file shared by processes on one host.
+
+    Each acquire is one short write transaction. In-flight slots are leases with
+    an expiry, so a crashed process cannot hold them forever.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SQLITE_SCHEMA)
+
+    def try_acquire(self, key: str, rate: float, burst: int, max_concurrent: int) -> tuple:
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    result = self._take(key, rate, burst, max_concurrent)
+                except sqlite3.Error:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._conn.execute("COMMIT")
+                return result
+            except sqlite3.Error as e:
+                # Fail open: a broken shared file must not stop every request
+                print(f"Shared rate limit state unavailable: {e}", file=sys.stderr)
+                return NO_LEASE, None
+
+    def _take(self, key: str, rate: float, burst: int, max_concurrent: int) -> tuple:
+        conn = self._conn
+        now = time.time()
+        conn.execute("DELETE FROM leases WHERE key = ? AND expires_at < ?", (key, now))
+        if max_concurrent:
+            in_flight = conn.execute("SELECT COUNT(*) FROM leases WHERE key = ?", (key,)).fetchone()[0]
+            if in_flight >= max_concurrent:
+                return None, None
+        row = conn.execute("SELECT tokens, updated_at, paused_until FROM buckets WHERE key = ?",
+                           (key,)).fetchone()
+        tokens, updated, paused_until = row if row else (burst, now, 0.0)
+        if now < paused_until:
+            return None, paused_until - now
+        if rate:
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                return None, (1 - tokens) / rate
+            tokens -= 1
+        conn.execute(
+            "INSERT INTO buckets (key, tokens, updated_at, paused_until) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+            (key, tokens, now, paused_until)
+        )
+        lease = conn.execute("INSERT INTO leases (key, expires_at) VALUES (?, ?)",
+                             (key, now + LEASE_SECONDS)).lastrowid
+        return lease, None
+
+    def release(self, key: str, lease) -> None:
+        with self._lock:
+            try:
+                self._conn.execute("DELETE FROM leases WHERE id = ?", (lease,))
+            except sqlite3.Error as e:
+                # The lease expires on its own
+                print(f"Could not release shared rate limit lease: {e}", file=sys.stderr)
+
+    def pause(self, key: str, seconds: float) -> None:
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT INTO buckets (key, tokens, updated_at, paused_until) VALUES (?, 0, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET paused_until = MAX(paused_until, excluded.paused_until)",
+                    (key, now, now + seconds)
+                )
+            except sqlite3.Error as e:
+                print(f"Could not share rate limit pause: {e}", file=sys.stderr)
+
+    def snapshot(self, key: str, rate: float, burst: int) -> tuple:
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?",
+                                         (key,)).fetchone()
+                in_flight = self._conn.execute("SELECT COUNT(*) FROM leases WHERE key = ? AND expires_at >= ?",
+                                               (key, now)).fetchone()[0]
+            except sqlite3.Error:
+                return burst, 0
+        if row is None:
+            return burst, in_flight
+        return min(burst, row[0] + (now - row[1]) * rate), in_flight
+
+
+class WaitTicket:
+    """A request waiting in a governor's queue; ``on_turn(lease)`` runs once it is granted
+    a lease, or with None if it is withdrawn first"""
+
+    __slots__ = ('session_id', 'on_turn', 'enqueued_at')
+
+    def __init__(self, session_id: str, on_turn):
+        self.session_id = session_id
+        self.on_turn = on_turn
+        self.enqueued_at = time.monotonic()
+
+
+class Governor:
+    """Fair queue in front of one API key and model's rate limit and concurrency cap"""
+
+    def __init__(self, key: str, backend):
+        self.key = key
+        self.backend = backend
+        self.requests_per_minute = DEFAULT_REQUESTS_PER_MINUTE
+        self.burst = DEFAULT_BURST
+        self.max_concurrent = DEFAULT_MAX_CONCURRENT
+        self._changed = threading.Condition()
+        # session id -> its waiting tickets; the first session is served next
+        self._queues = OrderedDict()
+        self._avg_hold = None
+        self._dispatcher = None
+        # Bumped on every notify, so the dispatcher never sleeps through a change made
+        # while it was talking to the backend
+        self._changes = 0
+
+    @property
+    def rate(self) -> float:
+        """Tokens per second"""
+        return self.requests_per_minute / 60.0
+
+    def configure(self, requests_per_minute: int, burst: int, max_concurrent: int) -> None:
+        """Apply the latest limits; every session sharing the key uses the same governor"""
+        self.requests_per_minute = max(0, requests_per_minute)
+        self.burst = max(1, burst)
+        self.max_concurrent = max(0, max_concurrent)
+
+    def enqueue(self, ticket: WaitTicket) -> None:
+        """Queue ``ticket``; its ``on_turn`` is called from the dispatcher thread when it is served"""
+        with self._changed:
+            self._queues.setdefault(ticket.session_id, deque()).append(ticket)
+            self._notify()
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="rate-limit-dispatch",
+                                                    daemon=True)
+                self._dispatcher.start()
+
+    def withdraw(self, ticket: WaitTicket) -> None:
+        """Take a waiting ticket out of the queue and call its ``on_turn(None)``;
+        a ticket already served is left alone"""
+        with self._changed:
+            queue = self._queues.get(ticket.session_id)
+            if queue is None or ticket not in queue:
+                return
+            self._dequeue(ticket)
+        ticket.on_turn(None)
+
+    def _dispatch(self) -> None:
+        """Serve the head of the queue whenever the backend grants a lease; exits once nobody waits"""
+        while True:
+            with self._changed:
+                ticket = self._head()
+                if ticket is None:
+                    self._dispatcher = None
+                    return
+                changes = self._changes
+            # Outside the lock: a shared backend can block on another process's write
+            lease, token_wait = self.backend.try_acquire(self.key, self.rate, self.burst, self.max_concurrent)
+            with self._changed:
+                if lease is None:
+                    if self._changes == changes:
+                        self._changed.wait(POLL_INTERVAL if token_wait is None else min(token_wait, POLL_INTERVAL))
+                    continue
+                served = self._head() is ticket
+                if served:
+                    self._dequeue(ticket)
+            if served:
+                try:
+                    ticket.on_turn(lease)
+                except Exception as e:
+                    # The waiters behind this one must still be served
+                    print(f"Rate limit turn callback failed: {e}", file=sys.stderr)
+            else:
+                # Withdrawn while the backend was deciding
+                self.backend.release(self.key, lease)
+
+    def release(self, lease, held_seconds: float = None) -> None:
+        self.backend.release(self.key, lease)
+        with self._changed:
+            if held_seconds is not None:
+                self._avg_hold = held_seconds if self._avg_hold is None else (
+                    HOLD_SMOOTHING * held_seconds + (1 - HOLD_SMOOTHING) * self._avg_hold
+                )
+            self._notify()
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every waiter for this key and model after the upstream said to slow down"""
+        self.backend.pause(self.key, seconds)
+
+    def _head(self):
+        for queue in self._queues.values():
+            return queue[0]
+        return None
+
+    def _notify(self) -> None:
+        self._changes += 1
+        self._changed.notify_all()
+
+    def _dequeue(self, ticket: WaitTicket) -> None:
+        queue = self._queues.get(ticket.session_id)
+        if queue is None or ticket not in queue:
+            return
+        was_next = self._head() is ticket
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[ticket.session_id]
+        elif was_next:
+            # Round-robin: the session just served goes to the back of the line
+            self._queues.move_to_end(ticket.session_id)
+        self._notify()
+
+    def waiting(self) -> int:
+        with self._changed:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def position(self, ticket: WaitTicket) -> tuple:
+        """``(requests ahead, estimated seconds)`` for a waiting ticket, or ``(0, 0.0)`` once served"""
+        with self._changed:
+            queue = self._queues.get(ticket.session_id)
+            if queue is None or ticket not in queue:
+                return 0, 0.0
+            depth = queue.index(ticket)
+            ahead = 0
+            is_before = True
+            for session_id, other in self._queues.items():
+                if session_id == ticket.session_id:
+                    ahead += depth
+                    is_before = False
+                else:
+                    # Sessions earlier in the rotation get one more turn before this ticket than later ones
+                    ahead += min(len(other), depth + 1 if is_before else depth)
+            avg_hold = self._avg_hold
+        return ahead, self._estimate_wait(ahead, avg_hold)
+
+    def _estimate_wait(self, ahead: int, avg_hold) -> float:
+        tokens, in_flight = self.backend.snapshot(self.key, self.rate, self.burst)
+        eta = 0.0
+        if self.rate:
+            eta = max(eta, (ahead + 1 - tokens) / self.rate)
+        if self.max_concurrent and avg_hold and in_flight + ahead >= self.max_concurrent:
+            rounds = math.ceil((in_flight + ahead + 1 - self.max_concurrent) / self.max_concurrent)
+            eta = max(eta, rounds * avg_hold)
+        return eta
+
+
+_registry_lock = threading.Lock()
+_governors = {}
+_backends = {}
+
+
+def _get_backend(shared_path: str):
+    backend = _backends.get(shared_path)
+    if backend is None:
+        backend = _backends[shared_path] = SQLiteBackend(shared_path) if shared_path else LocalBackend()
+    return backend
+
+
+def get_governor(api_key: str, model: str, shared_path: str = "") -> Governor:
+    """The process-wide governor for an API key and model"""
+    # Keys are hashed so raw API keys never sit in the registry or the shared file
+    key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] + ":" + model
+    registry_key = (shared_path, key)
+    governor = _governors.get(registry_key)
+    if governor is not None:
+        return governor
+    with _registry_lock:
+        if registry_key not in _governors:
+            _governors[registry_key] = Governor(key, _get_backend(shared_path))
+        return _governors[registry_key]
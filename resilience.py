@@ -0,0 +1,83 @@
+import random
+
+from openrouter_api import (
+    AUTH,
+    BAD_REQUEST,
+    NETWORK,
+    RATE_LIMIT,
+    STREAM_DROP,
+    TIMEOUT,
+    UPSTREAM,
+)
+from usage_stats import cached_prompt_tokens
+
+# Retries per model before moving down the fallback chain
+DEFAULT_MAX_RETRIES = 2
+# Full-jitter exponential backoff: a random wait up to BASE * 2**attempt, capped
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+# A longer Retry-After skips to the next model instead of holding the user up
+MAX_RETRY_AFTER_SECONDS = 20.0
+# Models tried in order when the selected one keeps failing, on different providers
+DEFAULT_FALLBACK_MODELS = ("openai/gpt-4o", "anthropic/claude-3.5-sonnet")
+
+RETRYABLE_KINDS = frozenset({RATE_LIMIT, UPSTREAM, TIMEOUT, NETWORK, STREAM_DROP})
+# An auth failure is the same on every model, so only it stops the chain
+FALLBACK_KINDS = RETRYABLE_KINDS | {BAD_REQUEST}
+ERROR_LABELS = {
+    AUTH: "Authentication failed",
+    BAD_REQUEST: "Request rejected",
+    RATE_LIMIT: "Rate limited",
+    UPSTREAM: "Provider error",
+    TIMEOUT: "Timed out",
+    NETWORK: "Network error",
+    STREAM_DROP: "Stream interrupted",
+}
+
+RESUME_PROMPT = ("Your previous answer was cut off. Continue it exactly where it stopped, "
+                 "without repeating anything or adding a preamble.")
+
+
+def backoff_delay(attempt: int, retry_after: float = None, rng=random):
+    """Seconds to wait before retry number ``attempt`` (0-based); None means do not wait for this model"""
+    if retry_after is not None:
+        if retry_after > MAX_RETRY_AFTER_SECONDS:
+            return None
+        # Jitter spreads out clients that were all told the same Retry-After
+        return retry_after + rng.uniform(0, BACKOFF_BASE_SECONDS)
+    return rng.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def model_chain(primary: str, fallbacks) -> list:
+    """The selected model followed by each distinct fallback"""
+    chain = [primary]
+    for model in fallbacks or ():
+        if model not in chain:
+            chain.append(model)
+    return chain
+
+
+def resume_messages(messages: list, partial: str) -> list:
+    """Messages asking the model to continue an answer that was cut off"""
+    if not partial:
+        return messages
+    return messages + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": RESUME_PROMPT},
+    ]
+
+
+def merge_usage(total, usage):
+    """Add one attempt's reported usage to the running total across retries"""
+    if not usage:
+        return total
+    if not total:
+        return dict(usage)
+    merged = dict(total)
+    for field in ("prompt_tokens", "completion_tokens", "total_tokens", "cost"):
+        if field in usage:
+            merged[field] = (merged.get(field) or 0) + (usage[field] or 0)
+    if usage.get("prompt_tokens_details"):
+        cached_tokens = cached_prompt_tokens(total) + cached_prompt_tokens(usage)
+        merged["prompt_tokens_details"] = {**usage["prompt_tokens_details"], "cached_tokens": cached_tokens}
+    return merged
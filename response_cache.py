@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import CACHE_LOOKUPS
+
+DEFAULT_MEMORY_ENTRIES = 512
+DEFAULT_DISK_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+# SQLite file behind the in-memory tier, e.g. CHAT_RESPONSE_CACHE_DB=/tmp/chat-responses.db;
+# unset keeps the cache in memory only
+DEFAULT_DISK_PATH = os.environ.get("CHAT_RESPONSE_CACHE_DB", "")
+# Replayed answers are fed to the renderer in pieces of this size
+REPLAY_CHUNK_CHARS = 64
+
+
+def make_cache_key(model: str, messages: list, temperature: float, max_tokens: int) -> str:
+    """Canonical hash of everything that determines a completion"""
+    payload = json.dumps(
+        [model, messages, round(float(temperature), 4), int(max_tokens)],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(temperature: float, allow_nondeterministic: bool = False) -> bool:
+    """Only temperature 0 requests are repeatable unless explicitly allowed"""
+    return allow_nondeterministic or float(temperature) == 0.0
+
+
+def iter_replay_chunks(text: str, chunk_chars: int = REPLAY_CHUNK_CHARS):
+    """Split a cached answer into pieces for the normal streaming display path"""
+    for start in range(0, len(text), chunk_chars):
+        yield text[start:start + chunk_chars]
+
+
+class ResponseCache:
+    """Process-wide response cache with an in-memory LRU tier and an optional SQLite tier"""
+
+    def __init__(self, memory_entries=DEFAULT_MEMORY_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 disk_path=None, disk_entries=DEFAULT_DISK_ENTRIES):
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self.disk_entries = disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, "
+                "created_at REAL, accessed_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+            self._db.commit()
+
+    def get(self, key: str):
+        """Return the cached entry dict for ``key`` or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry['created_at'] > self.ttl_seconds:
+                del self._memory[key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.inc('memory_hit')
+                return entry
+            entry = self._disk_get(key, now)
+            if entry is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc('miss')
+                return None
+            self._memory_put(key, entry)
+            self.hits += 1
+            CACHE_LOOKUPS.inc('disk_hit')
+            return entry
+
+    def put(self, key: str, response: str, model: str) -> None:
+        """Store a completed answer in both tiers"""
+        if not response:
+            return
+        now = time.time()
+        entry = {'response': response, 'model': model, 'created_at': now}
+        with self._lock:
+            self._memory_put(key, entry)
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now)
+            )
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.disk_entries,)
+            )
+            self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def _memory_put(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT response, model, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[2] > self.ttl_seconds:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+        self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self._db.commit()
+        return {'response': row[0], 'model': row[1], 'created_at': row[2]}
+
+
+_cache_lock = threading.Lock()
+_caches = {}
+
+
+def get_response_cache(disk_path: str = "") -> ResponseCache:
+    """Return the cache shared by every session in this process"""
+    cache = _caches.get(disk_path)
+    if cache is not None:
+        return cache
+    with _cache_lock:
+        if disk_path not in _caches:
+            _caches[disk_path] = ResponseCache(disk_path=disk_path or None)
+        return _caches[disk_path]
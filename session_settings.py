@@ -0,0 +1,95 @@
+from dataclasses import dataclass, asdict, replace
+from types import MappingProxyType
+
+import streamlit as st
+
+from context_retrieval import DEFAULT_CONTEXT_TOKEN_BUDGET, DEFAULT_TOP_K as DEFAULT_CONTEXT_TOP_K
+from context_window import DEFAULT_HISTORY_TOKEN_BUDGET
+from conversation_store import DEFAULT_DB_PATH
+from generation_jobs import DEFAULT_COMPARE_CONCURRENCY
+from openrouter_api import (
+    DEFAULT_MODEL,
+    DEFAULT_SYSTEM_PROMPT,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_FIRST_BYTE_TIMEOUT,
+    DEFAULT_STREAM_IDLE_TIMEOUT,
+    OPENROUTER_BASE_URL,
+)
+from prompt_cache import DEFAULT_MIN_CACHE_TOKENS
+from rate_limiter import (
+    DEFAULT_BURST,
+    DEFAULT_MAX_CONCURRENT,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    DEFAULT_SHARED_PATH,
+)
+from resilience import DEFAULT_FALLBACK_MODELS, DEFAULT_MAX_RETRIES
+from response_cache import DEFAULT_DISK_PATH as DEFAULT_RESPONSE_CACHE_PATH
+from similarity_index import DEFAULT_THRESHOLD as DEFAULT_SIMILARITY_THRESHOLD
+from stream_render import DEFAULT_FLUSH_INTERVAL_MS, DEFAULT_FLUSH_CHARS
+
+
+@dataclass(frozen=True)
+class SessionSettings:
+    """One session's settings; never mutated, updates produce a new object"""
+
+    model: str = DEFAULT_MODEL
+    temperature: float = 0.7
+    max_tokens: int = 1000
+    enable_streaming: bool = True
+    save_conversation: bool = True
+    auto_clear: bool = False
+    show_tokens: bool = True
+    api_key: str = ''
+    api_base_url: str = OPENROUTER_BASE_URL
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT
+    context: str = ''
+    context_retrieval: bool = True
+    context_token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET
+    context_top_k: int = DEFAULT_CONTEXT_TOP_K
+    include_history: bool = True
+    history_token_budget: int = DEFAULT_HISTORY_TOKEN_BUDGET
+    prompt_cache_hints: bool = True
+    prompt_cache_min_tokens: int = DEFAULT_MIN_CACHE_TOKENS
+    pool_size: int = DEFAULT_POOL_SIZE
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT
+    first_byte_timeout: float = DEFAULT_FIRST_BYTE_TIMEOUT
+    stream_idle_timeout: float = DEFAULT_STREAM_IDLE_TIMEOUT
+    render_interval_ms: int = DEFAULT_FLUSH_INTERVAL_MS
+    render_chunk_chars: int = DEFAULT_FLUSH_CHARS
+    bypass_cache: bool = False
+    cache_nondeterministic: bool = False
+    response_cache_path: str = DEFAULT_RESPONSE_CACHE_PATH
+    suggest_similar: bool = True
+    similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD
+    compare_concurrency: int = DEFAULT_COMPARE_CONCURRENCY
+    max_retries: int = DEFAULT_MAX_RETRIES
+    enable_fallback: bool = True
+    fallback_models: tuple = DEFAULT_FALLBACK_MODELS
+    rate_limit_rpm: int = DEFAULT_REQUESTS_PER_MINUTE
+    rate_limit_burst: int = DEFAULT_BURST
+    max_concurrent_streams: int = DEFAULT_MAX_CONCURRENT
+    rate_limit_shared_path: str = DEFAULT_SHARED_PATH
+    history_db_path: str = DEFAULT_DB_PATH
+    history_window: int = 50
+    history_page_size: int = 10
+
+    def replace(self, **changes) -> "SessionSettings":
+        """Copy with ``changes`` applied; returns self when nothing differs"""
+        if all(getattr(self, name) == value for name, value in changes.items()):
+            return self
+        return replace(self, **changes)
+
+
+# Read-only view of the defaults, shared by every session in the process
+DEFAULT_SETTINGS = MappingProxyType(asdict(SessionSettings()))
+
+
+def get_settings() -> SessionSettings:
+    """This session's settings"""
+    return st.session_state.settings
+
+
+def set_settings(**changes) -> None:
+    """Replace this session's settings with an updated copy"""
+    st.session_state.settings = st.session_state.settings.replace(**changes)
@@ -0,0 +1,200 @@
+import re
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+
+NUM_PERMUTATIONS = 32
+BANDS = 8
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_SIZE = 4
+DEFAULT_THRESHOLD = 0.8
+# Owners whose stored history stays indexed in this process (about 1 MB per 1,000 questions)
+STORED_INDEX_CACHE_SIZE = 8
+
+_BIN_BITS = NUM_PERMUTATIONS.bit_length() - 1
+_VALUE_MASK = (1 << (32 - _BIN_BITS)) - 1
+_EMPTY_BIN = 1 << 32
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text.lower())).strip()
+
+
+def shingle_hashes(text: str) -> set:
+    """Hashes of the character shingles of a normalized question"""
+    text = normalize_question(text)
+    if len(text) <= SHINGLE_SIZE:
+        return {zlib.crc32(text.encode("utf-8"))} if text else set()
+    data = text.encode("utf-8")
+    return {zlib.crc32(data[i:i + SHINGLE_SIZE]) for i in range(len(data) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signature(hashes: set) -> array:
+    """One-permutation MinHash signature of a shingle hash set.
+
+    Each shingle is hashed once and dropped into one of NUM_PERMUTATIONS bins by
+    its top bits; the signature is the minimum per bin. Empty bins borrow from the
+    next non-empty bin so signatures stay comparable.
+    """
+    mins = [_EMPTY_BIN] * NUM_PERMUTATIONS
+    shift = 32 - _BIN_BITS
+    for h in hashes:
+        h = (h * 0x9E3779B1) & 0xFFFFFFFF
+        bin_id = h >> shift
+        value = h & _VALUE_MASK
+        if value < mins[bin_id]:
+            mins[bin_id] = value
+    if _EMPTY_BIN in mins:
+        filled = mins[:]
+        for i in range(NUM_PERMUTATIONS):
+            if filled[i] != _EMPTY_BIN:
+                continue
+            for step in range(1, NUM_PERMUTATIONS):
+                borrowed = filled[(i + step) % NUM_PERMUTATIONS]
+                if borrowed != _EMPTY_BIN:
+                    mins[i] = borrowed + (step << 32)
+                    break
+    return array("Q", mins)
+
+
+def estimate_similarity(sig_a: array, sig_b: array) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERMUTATIONS
+
+
+class SimilarityIndex:
+    """In-process MinHash/LSH index of past questions.
+
+    Each question is reduced to a 32-value signature split into 8 bands; questions
+    sharing any band land in the same bucket and are then scored on the full
+    signature. No network or GPU is needed and lookups touch only a few buckets.
+    Entries are filed under a caller's key, such as a record id, and only the key
+    and signature are kept, so ``remove`` can keep the index in step with a
+    bounded history.
+    """
+
+    def __init__(self):
+        self._signatures = {}
+        self._keys = {}
+        self._entry_ids = {}
+        self._buckets = {}
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, question: str, key) -> int:
+        """Index a question under ``key`` and return its entry id; a key added again is replaced"""
+        hashes = shingle_hashes(question)
+        if not hashes:
+            return -1
+        self.remove(key)
+        signature = minhash_signature(hashes)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._signatures[entry_id] = signature
+        self._keys[entry_id] = key
+        self._entry_ids[key] = entry_id
+        buckets = self._buckets
+        for band_key in self._band_keys(signature):
+            bucket = buckets.get(band_key)
+            if bucket is None:
+                buckets[band_key] = entry_id
+            elif isinstance(bucket, int):
+                buckets[band_key] = [bucket, entry_id]
+            else:
+                bucket.append(entry_id)
+        return entry_id
+
+    def remove(self, key) -> bool:
+        """Drop the question filed under ``key``; False if there is none"""
+        entry_id = self._entry_ids.pop(key, None)
+        if entry_id is None:
+            return False
+        del self._keys[entry_id]
+        buckets = self._buckets
+        for band_key in self._band_keys(self._signatures.pop(entry_id)):
+            bucket = buckets.get(band_key)
+            if isinstance(bucket, int):
+                del buckets[band_key]
+            elif bucket is not None:
+                bucket.remove(entry_id)
+                if len(bucket) == 1:
+                    buckets[band_key] = bucket[0]
+        return True
+
+    def query(self, question: str, threshold: float = DEFAULT_THRESHOLD):
+        """Return ``(similarity, key)`` of the closest indexed question above threshold"""
+        hashes = shingle_hashes(question)
+        if not hashes or not self._keys:
+            return None
+        signature = minhash_signature(hashes)
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is None:
+                continue
+            if isinstance(bucket, int):
+                candidates.add(bucket)
+            else:
+                candidates.update(bucket)
+
+        best_id, best_score = None, threshold
+        for entry_id in candidates:
+            score = estimate_similarity(signature, self._signatures[entry_id])
+            # Prefer the most recent entry on ties
+            if score > best_score or (score == best_score and (best_id is None or entry_id > best_id)):
+                best_id, best_score = entry_id, score
+        if best_id is None:
+            return None
+        return best_score, self._keys[best_id]
+
+    @staticmethod
+    def _band_keys(signature):
+        return [
+            hash((band, *signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]))
+            for band in range(BANDS)
+        ]
+
+
+class StoredQuestionIndex:
+    """SimilarityIndex over one owner's stored conversations, keyed by row id.
+
+    Each query first indexes the rows added since the previous one, so the
+    owner's questions are read from the store once and then only new rows.
+    """
+
+    def __init__(self):
+        self.index = SimilarityIndex()
+        self.last_id = 0
+        self._lock = threading.Lock()
+
+    def query(self, store, owner: str, question: str, threshold: float = DEFAULT_THRESHOLD):
+        """Return ``(similarity, row id)`` of the closest stored question above threshold"""
+        with self._lock:
+            for row_id, stored_question in store.iter_questions(owner, self.last_id):
+                self.index.add(stored_question, row_id)
+                self.last_id = row_id
+            return self.index.query(question, threshold)
+
+
+_stored_indexes = OrderedDict()
+_stored_indexes_lock = threading.Lock()
+
+
+def get_stored_index(store_path: str, owner: str) -> StoredQuestionIndex:
+    """Index of an owner's stored questions, shared by every session in the process"""
+    key = (store_path, owner)
+    with _stored_indexes_lock:
+        index = _stored_indexes.get(key)
+        if index is None:
+            index = _stored_indexes[key] = StoredQuestionIndex()
+            while len(_stored_indexes) > STORED_INDEX_CACHE_SIZE:
+                _stored_indexes.popitem(last=False)
+        else:
+            _stored_indexes.move_to_end(key)
+        return index
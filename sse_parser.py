@@ -0,0 +1,181 @@
+import json
+import re
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    _json_loads = json.loads
+    JSON_BACKEND = "json"
+
+DONE_MARKER = b"[DONE]"
+
+# Fast path for the common OpenRouter token chunk:
+#   ..."delta":{"role":"assistant","content":"Hello"},"finish_reason":null...
+_FAST_DELTA = re.compile(rb'"delta":\{(?:"role":"assistant",)?"content":"((?:[^"\\]|\\.)*)"(?:,"[a-z_]+":null)*\}')
+_FAST_FINISH = re.compile(rb'"finish_reason":(?:null|"([a-z_]+)")')
+
+
+class SSEParser:
+    """Incremental Server-Sent Events parser working on raw byte chunks.
+
+    Feed it bytes as they arrive from the socket; it returns complete events as
+    ``(event, id, data)`` tuples with ``data`` left as bytes. Comment lines such as
+    OpenRouter's ``: OPENROUTER PROCESSING`` keep-alives are counted and skipped.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._event = None
+        self._id = None
+        self._data = []
+        self.last_event_id = None
+        self.event_count = 0
+        self.comment_count = 0
+        self.parse_errors = 0
+        self.fast_path_hits = 0
+        self.bytes_received = 0
+        self.last_error = None
+        self.is_done = False
+
+    def reset(self) -> None:
+        """Start a new stream (such as a retry), keeping the counters"""
+        self._buffer = b""
+        self._event, self._id, self._data = None, None, []
+        self.is_done = False
+
+    def feed(self, chunk: bytes) -> list:
+        """Consume a byte chunk and return the events it completes"""
+        self.bytes_received += len(chunk)
+        buffer = self._buffer + chunk if self._buffer else chunk
+        events = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            line = buffer[start:end]
+            start = end + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            event = self._process_line(line)
+            if event is not None:
+                events.append(event)
+        self._buffer = buffer[start:]
+        return events
+
+    def close(self) -> list:
+        """Flush an event left unterminated when the stream ends"""
+        events = self.feed(b"\n") if self._buffer else []
+        event = self._dispatch()
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _process_line(self, line: bytes):
+        if not line:
+            return self._dispatch()
+        if line[0:1] == b":":
+            self.comment_count += 1
+            return None
+        field, sep, value = line.partition(b":")
+        if sep and value[0:1] == b" ":
+            value = value[1:]
+        if field == b"data":
+            self._data.append(value)
+        elif field == b"event":
+            self._event = value.decode("utf-8", "replace")
+        elif field == b"id":
+            self._id = value.decode("utf-8", "replace")
+        return None
+
+    def _dispatch(self):
+        if not self._data:
+            self._event = None
+            return None
+        data = self._data[0] if len(self._data) == 1 else b"\n".join(self._data)
+        event = (self._event or "message", self._id, data)
+        if self._id is not None:
+            self.last_event_id = self._id
+        self._event, self._id, self._data = None, None, []
+        self.event_count += 1
+        return event
+
+    def parse_chunk(self, data: bytes):
+        """Extract content, finish_reason, usage and error from a completion chunk.
+
+        Returns None (and counts a parse error) when the payload is not valid JSON.
+        """
+        if b'"usage"' not in data and b'"error"' not in data and data.count(b'"delta"') == 1:
+            match = _FAST_DELTA.search(data)
+            if match:
+                raw = match.group(1)
+                try:
+                    content = raw.decode("utf-8") if b"\\" not in raw else _json_loads(b'"' + raw + b'"')
+                except ValueError:
+                    match = None
+            if match:
+                finish = _FAST_FINISH.search(data, match.end())
+                self.fast_path_hits += 1
+                return {
+                    'content': content,
+                    'finish_reason': finish.group(1).decode("ascii") if finish and finish.group(1) else None,
+                    'usage': None,
+                    'error': None
+                }
+
+        try:
+            payload = _json_loads(data)
+        except ValueError as e:
+            self.parse_errors += 1
+            self.last_error = str(e)
+            return None
+        if not isinstance(payload, dict):
+            self.parse_errors += 1
+            self.last_error = "Unexpected payload type"
+            return None
+
+        content = None
+        finish_reason = None
+        choices = payload.get('choices')
+        if choices:
+            choice = choices[0] if isinstance(choices, list) else None
+            delta = (choice.get('delta') or {}) if isinstance(choice, dict) else None
+            if not isinstance(delta, dict):
+                self.parse_errors += 1
+                self.last_error = "Unexpected choice type"
+                return None
+            content = delta.get('content')
+            finish_reason = choice.get('finish_reason')
+        return {
+            'content': content,
+            'finish_reason': finish_reason,
+            'usage': payload.get('usage'),
+            'error': payload.get('error')
+        }
+
+
+def iter_chat_chunks(response, parser: SSEParser):
+    """Yield parsed completion chunks from a streaming OpenRouter response"""
+    is_done = False
+    for raw in response.iter_content(chunk_size=None):
+        # Keep reading after [DONE] so the connection goes back to the pool
+        if is_done:
+            continue
+        for _event, _id, data in parser.feed(raw):
+            if data == DONE_MARKER:
+                is_done = parser.is_done = True
+                break
+            chunk = parser.parse_chunk(data)
+            if chunk is not None:
+                yield chunk
+    if is_done:
+        return
+    for _event, _id, data in parser.close():
+        if data == DONE_MARKER:
+            parser.is_done = True
+            return
+        chunk = parser.parse_chunk(data)
+        if chunk is not None:
+            yield chunk
@@ -0,0 +1,109 @@
+import re
+import time
+
+DEFAULT_FLUSH_INTERVAL_MS = 50
+DEFAULT_FLUSH_CHARS = 256
+# Segments longer than this are frozen and never re-sent to the browser
+DEFAULT_SEGMENT_CHARS = 2000
+
+_SENTENCE_BREAK = re.compile(r"[.!?]\s")
+
+
+def format_response(text: str) -> str:
+    """Markdown used for a finished response"""
+    return f"```\n{text}\n```"
+
+
+class StreamRenderer:
+    """Buffer streamed deltas and push them to a Streamlit placeholder on a time or size budget.
+
+    Text is rendered as a series of segments inside the placeholder. Once a segment
+    grows past ``segment_chars`` it is frozen at a line break (or, in text without
+    one, a sentence end or space), so each flush only re-sends the tail of the
+    answer instead of the whole response. Callers polling for deltas call ``tick``
+    so buffered text still appears on time when the stream stalls.
+    """
+
+    def __init__(self, placeholder, flush_interval_ms=DEFAULT_FLUSH_INTERVAL_MS,
+                 flush_chars=DEFAULT_FLUSH_CHARS, segment_chars=DEFAULT_SEGMENT_CHARS):
+        self.placeholder = placeholder
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_chars = flush_chars
+        self.segment_chars = segment_chars
+        self._parts = []
+        self._pending = []
+        self._pending_chars = 0
+        self._segment = ""
+        self._segment_slot = None
+        self._container = None
+        self._last_flush = time.monotonic()
+        self.flush_count = 0
+
+    def write(self, delta: str) -> None:
+        """Queue a delta and flush if the time or size budget is spent"""
+        if not delta:
+            return
+        self._parts.append(delta)
+        self._pending.append(delta)
+        self._pending_chars += len(delta)
+        if self._pending_chars >= self.flush_chars or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def tick(self) -> None:
+        """Flush buffered text whose time budget ran out while no delta arrived"""
+        if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Append buffered text to the live segment"""
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        if self._container is None:
+            self._container = self.placeholder.container()
+        self._segment += "".join(self._pending)
+        self._pending.clear()
+        self._pending_chars = 0
+
+        # Freeze the segment once it is long enough, so it is never rendered again
+        if len(self._segment) >= self.segment_chars:
+            cut = self._freeze_point(self._segment)
+            frozen, self._segment = self._segment[:cut], self._segment[cut:]
+            if self._segment[:1].isspace():
+                self._segment = self._segment[1:]
+            self._render_segment(frozen)
+            self._segment_slot = None
+
+        if self._segment:
+            self._render_segment(self._segment)
+        self.flush_count += 1
+
+    def _freeze_point(self, segment: str) -> int:
+        """Where to split a long segment: its last line break, else sentence end, else space"""
+        cut = segment.rfind("\n", 0, len(segment) - 1)
+        if cut > 0:
+            return cut
+        sentence_ends = [match.start() + 1 for match in _SENTENCE_BREAK.finditer(segment, 0, len(segment) - 1)]
+        if sentence_ends:
+            return sentence_ends[-1]
+        cut = max(segment.rfind(" ", 0, len(segment) - 1), segment.rfind("\t", 0, len(segment) - 1))
+        # Text with no spaces at all, such as a long URL or base64, is cut at the cap
+        return cut if cut > 0 else self.segment_chars
+
+    def _render_segment(self, text: str) -> None:
+        if self._segment_slot is None:
+            self._segment_slot = self._container.empty()
+        self._segment_slot.markdown(format_response(text))
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def finish(self) -> str:
+        """Replace the segments with the complete response and return its text"""
+        text = self.text
+        self._pending.clear()
+        self._pending_chars = 0
+        if text:
+            self.placeholder.markdown(format_response(text))
+        return text
@@ -0,0 +1,146 @@
+import re
+
+# Per-message framing tokens added by chat templates, and the reply primer
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMER_TOKENS = 3
+
+_WORD_OR_SYMBOL = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast BPE-free token estimate: about 4 characters per token, at least one per word or symbol"""
+    if not text:
+        return 0
+    by_chars = (len(text) + 3) // 4
+    # Symbol-heavy text (code, numbers) tokenizes finer than the character rule suggests
+    return max(by_chars, len(_WORD_OR_SYMBOL.findall(text)))
+
+
+def estimate_prompt_tokens(messages: list) -> int:
+    """Estimated prompt tokens for a chat messages list"""
+    return REPLY_PRIMER_TOKENS + sum(
+        MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get("content") or "")
+        for message in messages
+    )
+
+
+def estimate_cost(prices, prompt_tokens: int, completion_tokens: int):
+    """Cost in USD from (prompt, completion) prices per million tokens, or None without prices"""
+    if prices is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1e6
+
+
+def cached_prompt_tokens(usage: dict) -> int:
+    """Prompt tokens the provider reported reading from its prompt cache"""
+    return (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+
+
+def build_usage(model: str, messages: list, response_text: str, usage: dict = None, seconds: float = None,
+                prices=None) -> dict:
+    """Token counts and cost for one request, from reported usage or local estimates;
+    ``prices`` is only used when the provider did not report a cost"""
+    usage = usage or {}
+    is_estimate = 'prompt_tokens' not in usage or 'completion_tokens' not in usage
+    prompt_tokens = usage.get('prompt_tokens')
+    if prompt_tokens is None:
+        prompt_tokens = estimate_prompt_tokens(messages)
+    completion_tokens = usage.get('completion_tokens')
+    if completion_tokens is None:
+        completion_tokens = estimate_tokens(response_text)
+    cost = usage.get('cost')
+    if cost is None:
+        cost = estimate_cost(prices, prompt_tokens, completion_tokens)
+    return {
+        'model': model,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+        'cached_tokens': cached_prompt_tokens(usage),
+        'cost': cost,
+        'seconds': seconds,
+        'is_estimate': is_estimate
+    }
+
+
+def format_usage(usage: dict) -> str:
+    """One-line token and cost summary for a request"""
+    prefix = "~" if usage['is_estimate'] else ""
+    # Usage saved with older conversations has no cached count
+    cached = f" ({usage['cached_tokens']:,} cached)" if usage.get('cached_tokens') else ""
+    text = (f"🔢 {prefix}{usage['prompt_tokens']:,} prompt{cached} + "
+            f"{prefix}{usage['completion_tokens']:,} completion tokens")
+    if usage['cost'] is not None:
+        text += f" • ${usage['cost']:.4f}"
+    return text
+
+
+class UsageTotals:
+    """Running totals for a set of requests; O(1) to update and to read"""
+
+    __slots__ = ('requests', 'prompt_tokens', 'completion_tokens', 'cached_tokens', 'cost', 'seconds',
+                 'timed_requests', 'estimated_requests')
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+        self.seconds = 0.0
+        self.timed_requests = 0
+        self.estimated_requests = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def avg_tokens(self) -> float:
+        return self.total_tokens / self.requests if self.requests else 0.0
+
+    @property
+    def avg_seconds(self):
+        return self.seconds / self.timed_requests if self.timed_requests else None
+
+    def add(self, usage: dict) -> None:
+        self.requests += 1
+        self.prompt_tokens += usage['prompt_tokens']
+        self.completion_tokens += usage['completion_tokens']
+        self.cached_tokens += usage.get('cached_tokens', 0)
+        self.cost += usage['cost'] or 0.0
+        if usage['seconds'] is not None:
+            self.seconds += usage['seconds']
+            self.timed_requests += 1
+        if usage['is_estimate']:
+            self.estimated_requests += 1
+
+
+class UsageStats:
+    """Per-session usage aggregated overall and per model as each request finishes"""
+
+    def __init__(self):
+        self.totals = UsageTotals()
+        self.by_model = {}
+        self.cache_hits = 0
+        self.history_tokens_saved = 0
+        self.context_tokens_saved = 0
+
+    def record(self, usage: dict) -> None:
+        self.totals.add(usage)
+        model_totals = self.by_model.get(usage['model'])
+        if model_totals is None:
+            model_totals = self.by_model[usage['model']] = UsageTotals()
+        model_totals.add(usage)
+
+    def record_cache_hit(self) -> None:
+        """A response served from the cache costs no tokens"""
+        self.cache_hits += 1
+
+    def record_history(self, report: dict) -> None:
+        """Prompt tokens kept out of a request by trimming and summarizing earlier turns"""
+        self.history_tokens_saved += report['saved_tokens']
+
+    def record_context(self, report: dict) -> None:
+        """Prompt tokens kept out of a request by sending only relevant context chunks"""
+        self.context_tokens_saved += report['saved_tokens']